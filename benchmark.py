@@ -0,0 +1,302 @@
+"""
+Benchmarks for the transcript summarizer.
+
+Times importing the entry points and backend modules in a fresh interpreter, generates synthetic Zoom VTT
+transcripts, times count_tokens (exact and memoized), estimate_tokens, chunk_text_by_tokens, transcript parsing and
+the full TranscriptHandler.process_file pipeline against local stub LLM and Google Docs servers, and writes
+throughput, p50/p95/p99 latency and peak memory as JSON that can be compared between runs:
+
+    python benchmark.py --sizes 1000 10000 100000 --output before.json
+    python benchmark.py --sizes 1000 10000 100000 --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from router import percentile
+
+FIRST_NAMES = ["John", "Emily", "Alex", "Li", "Priya", "Carlos", "Fatima", "Noah", "Olivia", "Kenji", "Amara",
+               "Lucas", "Sofia", "Mateo", "Aisha", "Ethan", "Chloe", "Ravi", "Hannah", "Omar"]
+LAST_NAMES = ["Smith", "Jones", "Brown", "Wang", "Patel", "Garcia", "Khan", "Miller", "Davis", "Tanaka", "Okafor",
+              "Silva", "Rossi", "Lopez", "Hassan", "Wilson", "Martin", "Kumar", "Cohen", "Ali"]
+OPENERS = ["So", "Okay", "Right", "Well", "And", "Yeah", "I think", "To be honest", "Honestly", "Just to add"]
+FILLERS = ["um", "uh", "you know", "like", "I mean", "sort of"]
+SUBJECTS = ["the DNA extraction", "the sequencing budget", "the Q3 roadmap", "the vendor contract", "the gene editing",
+            "the incubation timeline", "the hiring plan", "the lab safety review", "the data pipeline",
+            "the partner demo", "the compliance audit", "the release checklist"]
+PREDICATES = ["is on track for next Friday", "needs another review before we commit", "slipped by two weeks",
+              "is blocked on legal sign off", "came in under budget", "should move to the next sprint",
+              "depends on the results from Siberia", "needs an owner", "looks good from my side",
+              "has a risk we haven't discussed"]
+BACKCHANNELS = ["Yeah.", "Right.", "Mm-hmm.", "Okay.", "Sure.", "Got it.", "Thanks."]
+IMPORT_MODULES = ["zoom_transcript_summarizer", "bulk_summarize", "claude_summarizer", "summarize", "docs_writer"]
+SDK_MODULES = ["anthropic", "openai", "googleapiclient", "tiktoken", "httpx"]  # reported when an import loads them
+# Imports one module in a fresh interpreter and prints the seconds taken, the peak RSS and the SDKs it loaded
+_IMPORT_SCRIPT = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - started, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  [name for name in {sdk_modules!r} if name in sys.modules]]))
+"""
+
+
+def _timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def generate_vtt_transcript(path, lines, speakers=12, seed=0):
+    """
+    Writes a synthetic Zoom VTT transcript with the given number of caption lines.
+    Speakers talk in runs of several cues, with fillers and short back-channel replies like a real meeting.
+    Returns the number of bytes written.
+    """
+    rng = random.Random(seed)
+    names = [f"{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}" for _ in range(speakers)]
+    clock = 0.0
+    speaker = names[0]
+    with open(path, 'w') as file:
+        file.write("WEBVTT\n\n")
+        for cue in range(1, lines + 1):
+            if rng.random() < 0.3:
+                speaker = rng.choice(names)
+            if rng.random() < 0.1:
+                text = rng.choice(BACKCHANNELS)
+            else:
+                filler = f" {rng.choice(FILLERS)}," if rng.random() < 0.4 else ""
+                text = f"{rng.choice(OPENERS)},{filler} {rng.choice(SUBJECTS)} {rng.choice(PREDICATES)}."
+            duration = 1.0 + len(text) / 15
+            file.write(f"{cue}\n{_timestamp(clock)} --> {_timestamp(clock + duration)}\n{speaker}: {text}\n\n")
+            clock += duration + rng.random()
+        return file.tell()
+
+
+def peak_rss_mb():
+    """The peak RSS of the whole process so far; benchmarks report their own peak_traced_mb instead."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def summarize_timings(latencies, peak_traced_mb, lines, size_bytes):
+    p50 = percentile(latencies, 0.50)
+    return {
+        "lines": lines,
+        "bytes": size_bytes,
+        "iterations": len(latencies),
+        "mean_s": sum(latencies) / len(latencies),
+        "p50_s": p50,
+        "p95_s": percentile(latencies, 0.95),
+        "p99_s": percentile(latencies, 0.99),
+        "throughput_lines_per_s": lines / p50 if p50 else None,
+        "throughput_mb_per_s": size_bytes / p50 / 1e6 if p50 else None,
+        "peak_traced_mb": peak_traced_mb,
+    }
+
+
+def time_calls(fn, iterations):
+    """
+    Times fn(0) to fn(iterations - 1), then makes one more call, fn(iterations), under tracemalloc to measure the
+    memory a single call allocates.  The traced call isn't timed, since tracing slows allocation down.
+    Returns:
+        tuple: The latencies in seconds, and the peak MB of Python memory allocated during the traced call.
+    """
+    latencies = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        fn(iterations)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return latencies, peak / (1024 * 1024)
+
+
+def benchmark_tokenizer(directory, sizes, speakers, iterations):
+    from tokenizer import chunk_text_by_tokens, count_tokens, estimate_tokens
+    from transcript_parser import Transcript, iter_turn_chunks
+
+    count_tokens("warm up the cached encoder")
+    results = {}
+    for lines in sizes:
+        path = os.path.join(directory, f"tokenizer_{lines}.vtt")
+        size_bytes = generate_vtt_transcript(path, lines, speakers)
+        with open(path) as file:
+            text = file.read()
+        # distinct strings, so every count is encoded; one more for the traced call
+        texts = [f"{i}\n{text}" for i in range(iterations + 1)]
+        results[f"count_tokens/{lines}"] = summarize_timings(
+            *time_calls(lambda i: count_tokens(texts[i]), iterations), lines, size_bytes)
+        results[f"count_tokens_memoized/{lines}"] = summarize_timings(
+            *time_calls(lambda i: count_tokens(texts[i]), iterations), lines, size_bytes)
+        results[f"estimate_tokens/{lines}"] = summarize_timings(
+            *time_calls(lambda i: estimate_tokens(texts[i], upper_bound=True), iterations), lines, size_bytes)
+        del texts
+        results[f"chunk_text_by_tokens/{lines}"] = summarize_timings(
+            *time_calls(lambda i: chunk_text_by_tokens(text, max_tokens=2000), iterations), lines, size_bytes)
+        del text
+        results[f"parse_transcript/{lines}"] = summarize_timings(
+            *time_calls(lambda i: Transcript.from_file(path), iterations), lines, size_bytes)
+        results[f"iter_turn_chunks/{lines}"] = summarize_timings(
+            *time_calls(lambda i: list(iter_turn_chunks(Transcript.from_file(path), max_tokens=2000)), iterations),
+            lines, size_bytes)
+    return results
+
+
+def benchmark_imports(modules, iterations):
+    """
+    Times importing each module in a fresh interpreter, as the watcher and the CLIs do at startup.
+    """
+    results = {}
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        script = _IMPORT_SCRIPT.format(module=module, sdk_modules=SDK_MODULES)
+        runs = [json.loads(subprocess.run([sys.executable, "-c", script], cwd=directory, capture_output=True,
+                                          text=True, check=True).stdout) for _ in range(iterations)]
+        latencies = [seconds for seconds, _, _ in runs]
+        peak_rss = max(rss for _, rss, _ in runs)
+        results[f"import/{module}"] = {
+            "iterations": iterations,
+            "mean_s": sum(latencies) / len(latencies),
+            "p50_s": percentile(latencies, 0.50),
+            "p95_s": percentile(latencies, 0.95),
+            "peak_rss_mb": peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024,
+            "sdk_modules": runs[0][2],
+        }
+    return results
+
+
+def benchmark_pipeline(directory, sizes, speakers, iterations, provider, llm_latency, piece_delay, docs_latency):
+    """
+    Times TranscriptHandler.process_file end to end against stub LLM and Docs servers.
+    Every iteration, and the traced call, uses a different transcript so the summary cache never hits.
+    """
+    from fake_docs_server import FakeDocsServer
+    from stub_llm_server import StubLLMServer
+
+    llm_server = StubLLMServer(latency=llm_latency, piece_delay=piece_delay).start()
+    docs_server = FakeDocsServer(latency=docs_latency).start()
+    os.environ.update(ANTHROPIC_BASE_URL=llm_server.url.rstrip("/"), OPENAI_BASE_URL=llm_server.url + "v1",
+                      ANTHROPIC_API_KEY="benchmark", OPENAI_API_KEY="benchmark")
+
+    import save_summary
+    import zoom_transcript_summarizer
+    from docs_writer import DocsWriter, build_docs_service
+    from processed_index import ProcessedIndex
+    from providers import get_provider
+    from rate_limiter import LLMScheduler
+    from summary_cache import SummaryCache
+
+    save_summary.SAVE_TO_PATH = os.path.join(directory, "summaries")
+    os.makedirs(save_summary.SAVE_TO_PATH, exist_ok=True)
+    zoom_transcript_summarizer.SUMMARY_PROVIDER = provider
+    get_provider(provider).scheduler = LLMScheduler(initial_concurrency=16)  # no quota limits against the stub
+
+    docs_writer = DocsWriter(build_docs_service(api_endpoint=docs_server.url),
+                             batch_uri=docs_server.url + "batch").start()
+    handler = zoom_transcript_summarizer.TranscriptHandler(docs_writer=docs_writer,
+                                                           summary_cache=SummaryCache(":memory:"),
+                                                           processed_index=ProcessedIndex(":memory:"))
+    results = {}
+    try:
+        for lines in sizes:
+            paths = []
+            size_bytes = 0
+            for i in range(iterations + 1):
+                path = os.path.join(directory, f"Meeting {lines} {i}", "meeting_saved_closed_caption.vtt")
+                os.makedirs(os.path.dirname(path))
+                size_bytes = generate_vtt_transcript(path, lines, speakers, seed=i)
+                paths.append(path)
+            llm_requests = llm_server.requests
+            result = summarize_timings(*time_calls(lambda i: handler.process_file(paths[i]), iterations),
+                                       lines, size_bytes)
+            result["llm_requests_per_transcript"] = (llm_server.requests - llm_requests) / (iterations + 1)
+            results[f"process_file/{provider}/{lines}"] = result
+        started = time.perf_counter()
+        docs_writer.close()
+        results["docs_drain"] = {"seconds": time.perf_counter() - started,
+                                 "http_requests": docs_server.http_requests, "api_calls": docs_server.api_calls}
+    finally:
+        handler.jobs.shutdown()
+        llm_server.stop()
+        docs_server.stop()
+    return results
+
+
+def compare(results, baseline, threshold=0.10):
+    """
+    Prints the p50 change of every benchmark against a previous run.  Returns True if any got slower than threshold.
+    """
+    regressed = False
+    for name, result in results["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name, {}).get("p50_s")
+        if before is None or "p50_s" not in result:
+            continue
+        change = (result["p50_s"] - before) / before
+        flag = "REGRESSION" if change > threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"{name:45s} p50 {before:9.4f}s -> {result['p50_s']:9.4f}s ({change:+.1%}) {flag}")
+    return regressed
+
+
+def main(argv=None):
+    from plugins import PROVIDERS, names as plugin_names
+
+    parser = argparse.ArgumentParser(description="Benchmark the transcript summarizer against local stub servers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="transcript sizes in caption lines")
+    parser.add_argument("--speakers", type=int, default=12)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--provider", choices=plugin_names(PROVIDERS), default="anthropic")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="stub LLM seconds to first token")
+    parser.add_argument("--piece-delay", type=float, default=0.005, help="stub LLM seconds between streamed pieces")
+    parser.add_argument("--docs-latency", type=float, default=0.1, help="fake Docs API seconds per HTTP request")
+    parser.add_argument("--skip-pipeline", action="store_true", help="only run the tokenizer benchmarks")
+    parser.add_argument("--output", help="write results JSON to this file")
+    parser.add_argument("--compare", help="results JSON of a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)  # keep per-transcript logging out of the timings
+    results = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')},
+        "parameters": vars(args),
+        "benchmarks": {},
+    }
+    results["benchmarks"].update(benchmark_imports(IMPORT_MODULES, args.iterations))
+    with tempfile.TemporaryDirectory() as directory:
+        results["benchmarks"].update(benchmark_tokenizer(directory, args.sizes, args.speakers, args.iterations))
+        if not args.skip_pipeline:
+            results["benchmarks"].update(benchmark_pipeline(directory, args.sizes, args.speakers, args.iterations,
+                                                            args.provider, args.llm_latency, args.piece_delay,
+                                                            args.docs_latency))
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as file:
+            return 1 if compare(results, json.load(file)) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""
+Offline bulk summarization of transcript archives.
+
+    python bulk_summarize.py ~/Documents/Zoom "~/Archive/2024-Q1/**/*.vtt" --provider anthropic
+
+Transcripts are parsed, preprocessed and chunked in a process pool.  They are then summarized in rounds: every chunk of
+every transcript is packed into provider batch submissions (the map step), and the partial summaries of long
+transcripts are combined in further batched rounds until each transcript has one summary.  Batch APIs run requests
+asynchronously at a lower price and outside the per-minute rate limits, so an archive is summarized in a few rounds
+of wall time instead of one serial call after another.  With --no-batch the rounds run as concurrent regular
+requests instead.
+
+Progress is kept in a JSON manifest, so an interrupted run resumes where it stopped, including batches that were
+still processing.  Summaries are saved with format_and_save_summary and save_google_doc, stored in the summary cache
+and marked done in the processed index, so the live watcher doesn't summarize them again.
+"""
+
+import argparse
+import functools
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from map_reduce_summarizer import CHUNK_TOKENS, COMBINE_SUMMARIES_ROLE, group_by_tokens, split_transcript
+from plugins import PROVIDERS, names as plugin_names
+from processed_index import DONE, FAILED, PENDING, TRANSCRIPT_SUFFIXES, ProcessedIndex, iter_transcript_files
+from providers import get_provider
+from save_summary import format_and_save_summary, save_google_doc
+from summary_cache import STATE_DIRECTORY, SummaryCache, summary_cache_key
+from transcript_parser import Transcript
+from transcript_preprocessor import preprocess_transcript
+
+MANIFEST_PATH = os.path.join(STATE_DIRECTORY, "bulk_manifest.json")
+PREPARE_WORKERS = os.cpu_count()  # processes parsing and chunking transcripts
+MAX_BATCH_REQUESTS = 10000  # requests per batch submission
+MAX_BATCH_CHARS = 50_000_000  # characters of transcript per batch submission, well below the APIs' size limits
+BATCH_POLL_SECONDS = 30.0  # how often to check on submitted batches
+CONCURRENT_REQUESTS = 8  # requests in flight at once with --no-batch
+
+
+def find_transcripts(patterns):
+    """
+    Returns the sorted absolute paths of the transcript files in the given directories and glob patterns.
+    """
+    paths = set()
+    for pattern in patterns:
+        pattern = os.path.abspath(os.path.expanduser(pattern))
+        if os.path.isdir(pattern):
+            paths.update(path for path, _ in iter_transcript_files(pattern))
+        else:
+            paths.update(path for path in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(path) and path.lower().endswith(TRANSCRIPT_SUFFIXES))
+    return sorted(paths)
+
+
+def prepare_transcript(path, provider_name, model, role, single_pass_tokens, chunk_tokens=CHUNK_TOKENS):
+    """
+    Parses, preprocesses and chunks a transcript.  Runs in a worker process, so it is given the provider's settings
+    rather than building the provider.
+    Args:
+        path: The transcript file.
+        provider_name, model, role: The provider's settings, matching what the live watcher uses, for the cache key.
+        single_pass_tokens: Transcripts up to this many tokens are summarized with one request.
+        chunk_tokens: Maximum tokens per chunk for longer transcripts.
+    Returns:
+        tuple: (path, cache_key, texts to summarize in the map step, error message or None)
+    """
+    try:
+        transcript = preprocess_transcript(Transcript.from_file(path))
+        cache_key = summary_cache_key(transcript.text(), provider_name, model, role)
+        return path, cache_key, split_transcript(transcript, single_pass_tokens, chunk_tokens), None
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
+
+
+class BulkManifest:
+    """
+    JSON record of a bulk run: the status and partial summaries of each transcript, and the requests and batches of
+    the round in progress.  It is saved atomically after every change so a run can be resumed.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = os.path.expanduser(path)
+        self.transcripts = {}  # path -> {"id", "status", "cache_key", "summaries", "error"}
+        self.requests = {}  # custom_id -> [path, index] for the round in progress
+        self.batches = []  # batch ids of the round in progress
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                state = json.load(file)
+            self.transcripts, self.requests, self.batches = state["transcripts"], state["requests"], state["batches"]
+
+    def add(self, path):
+        """Adds a transcript, or queues a failed one to be retried."""
+        entry = self.transcripts.get(path)
+        if entry is None:
+            self.transcripts[path] = {"id": len(self.transcripts), "status": PENDING}
+        elif entry["status"] == FAILED:
+            self.transcripts[path] = {"id": entry["id"], "status": PENDING}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump({"transcripts": self.transcripts, "requests": self.requests, "batches": self.batches}, file)
+        os.replace(temporary_path, self.path)
+
+    def counts(self):
+        """Returns the number of transcripts in each status."""
+        counts = {}
+        for entry in self.transcripts.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+
+class BulkSummarizer:
+    """
+    Summarizes many transcripts in batched map-reduce rounds, recording progress in a BulkManifest.
+    Args:
+        provider_name: "anthropic" or "openai".
+        manifest: The BulkManifest of this run.
+        docs_service: Google Docs service to save summaries with, or None to save them locally only.
+        use_batches: Submit requests through the provider's batch API rather than as regular requests.
+        summary_cache: SummaryCache to use.  Defaults to the cache shared with the live watcher.
+        processed_index: ProcessedIndex to use.  Defaults to the index shared with the live watcher.
+        workers: Processes preparing transcripts.
+        poll_seconds: Seconds between checks on submitted batches.
+        single_pass_tokens: Transcripts up to this many tokens are summarized with one request.  Defaults to the
+            provider's MAX_TOKENS.
+        chunk_tokens: Maximum tokens per chunk (and per group of partial summaries) for longer transcripts.
+    Raises:
+        ValueError: If use_batches is set but the provider has no batch API.
+    """
+
+    def __init__(self, provider_name, manifest, docs_service=None, use_batches=True, summary_cache=None,
+                 processed_index=None, workers=PREPARE_WORKERS, poll_seconds=BATCH_POLL_SECONDS,
+                 single_pass_tokens=None, chunk_tokens=CHUNK_TOKENS):
+        self.provider_name = provider_name
+        self.provider = get_provider(provider_name)
+        if use_batches and not self.provider.supports_batches:
+            raise ValueError(f"The {provider_name} provider doesn't support batches; run without them (--no-batch)")
+        self.manifest = manifest
+        self.docs_service = docs_service
+        self.use_batches = use_batches
+        self.summary_cache = summary_cache or SummaryCache()
+        self.processed_index = processed_index or ProcessedIndex()
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.single_pass_tokens = single_pass_tokens
+        self.chunk_tokens = chunk_tokens
+
+    def run(self, paths):
+        """
+        Summarizes the transcripts, resuming the manifest's previous run if there is one.
+        Returns:
+            dict: The number of transcripts in each status.
+        """
+        for path in paths:
+            self.manifest.add(path)
+        if self.manifest.batches:
+            logging.info(f"Resuming {len(self.manifest.batches)} batches from the previous run")
+            self._apply(self._wait_for_batches(self.manifest.batches))
+        self.manifest.requests = {}  # requests of an interrupted round without batches are made again
+        self.manifest.save()
+
+        rounds = 0
+        while True:
+            requests = self._prepare() if rounds == 0 else []
+            requests += self._combine_requests()
+            if not requests:
+                break
+            rounds += 1
+            logging.info(f"Round {rounds}: {len(requests)} requests")
+            self._apply(self._run_round(requests))
+
+        counts = self.manifest.counts()
+        logging.info(f"Bulk summarization finished: {counts}")
+        return counts
+
+    def _prepare(self):
+        """Prepares transcripts that have no partial summaries yet and returns their map step requests."""
+        paths = [path for path, entry in self.manifest.transcripts.items()
+                 if entry["status"] == PENDING and not entry.get("summaries")]
+        if not paths:
+            return []
+        prepare = functools.partial(prepare_transcript, provider_name=self.provider_name, model=self.provider.model,
+                                    role=self.provider.summary_role,
+                                    single_pass_tokens=self.single_pass_tokens or self.provider.max_input_tokens,
+                                    chunk_tokens=self.chunk_tokens)
+        requests = []
+        # spawned rather than forked: the run already has threads holding locks, e.g. the Google credential refresh
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            for path, cache_key, texts, error in executor.map(prepare, paths, chunksize=4):
+                entry = self.manifest.transcripts[path]
+                if error:
+                    self._fail(path, error)
+                    continue
+                entry["cache_key"] = cache_key
+                summary = self.summary_cache.get(cache_key)
+                if summary is not None:
+                    self._finish(path, summary)
+                    continue
+                requests += [self._request(path, index, text) for index, text in enumerate(texts)]
+        self.manifest.save()
+        return requests
+
+    def _combine_requests(self):
+        """Finishes transcripts with a single summary and returns requests combining the others' partial ones."""
+        requests = []
+        for path, entry in list(self.manifest.transcripts.items()):
+            summaries = entry.get("summaries")
+            if entry["status"] != PENDING or not summaries:
+                continue
+            if len(summaries) == 1:
+                self._finish(path, summaries[0])
+                continue
+            groups = group_by_tokens(summaries, self.chunk_tokens)
+            requests += [self._request(path, index, "\n\n".join(group), COMBINE_SUMMARIES_ROLE)
+                         for index, group in enumerate(groups)]
+        return requests
+
+    def _request(self, path, index, text, role=None):
+        """Returns a (custom_id, text, role) request for part index of a transcript and records it in the round."""
+        custom_id = f"t{self.manifest.transcripts[path]['id']}-{index}"
+        self.manifest.requests[custom_id] = [path, index]
+        return custom_id, text, role
+
+    def _run_round(self, requests):
+        """Runs a round of requests and returns a dict of custom_id to summary (None for failed requests)."""
+        if not self.use_batches:
+            return self._run_concurrently(requests)
+        for batch in _pack_batches(requests):
+            self.manifest.batches.append(self.provider.submit_batch(batch))
+            self.manifest.save()  # a resumed run polls this batch instead of submitting it again
+            logging.info(f"Submitted batch {self.manifest.batches[-1]} of {len(batch)} requests")
+        return self._wait_for_batches(self.manifest.batches)
+
+    def _run_concurrently(self, requests):
+        def summarize(request):
+            custom_id, text, role = request
+            try:
+                return custom_id, self.provider.summarize(text, role)
+            except Exception as e:
+                logging.warning(f"Request {custom_id} failed: {e}")
+                return custom_id, None
+
+        with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
+            return dict(executor.map(summarize, requests))
+
+    def _wait_for_batches(self, batch_ids):
+        results = {}
+        waiting = list(batch_ids)
+        while waiting:
+            for batch_id in list(waiting):
+                batch_results = self.provider.batch_results(batch_id)
+                if batch_results is not None:
+                    results.update(batch_results)
+                    waiting.remove(batch_id)
+            if waiting:
+                logging.info(f"Waiting for {len(waiting)} batches")
+                time.sleep(self.poll_seconds)
+        return results
+
+    def _apply(self, results):
+        """Stores each transcript's summaries from a finished round, failing transcripts with failed requests."""
+        summaries = {}
+        for custom_id, (path, index) in self.manifest.requests.items():
+            summaries.setdefault(path, {})[index] = results.get(custom_id)
+        for path, by_index in summaries.items():
+            failed = sum(summary is None for summary in by_index.values())
+            if failed:
+                self._fail(path, f"{failed} of {len(by_index)} requests failed")
+            else:
+                self.manifest.transcripts[path]["summaries"] = [by_index[index] for index in sorted(by_index)]
+        self.manifest.requests = {}
+        self.manifest.batches = []
+        self.manifest.save()
+
+    def _finish(self, path, summary):
+        entry = self.manifest.transcripts[path]
+        try:
+            self.summary_cache.put(entry["cache_key"], summary)
+            format_and_save_summary(summary, path)
+            if self.docs_service is not None:
+                save_google_doc(self.docs_service, summary, path)
+        except Exception as e:
+            logging.exception(f"Failed to save the summary of {path}")
+            self._fail(path, f"{type(e).__name__}: {e}")
+            return
+        self.manifest.transcripts[path] = {"id": entry["id"], "status": DONE, "cache_key": entry["cache_key"]}
+        self.processed_index.mark(path, DONE)
+        self.manifest.save()
+
+    def _fail(self, path, error):
+        logging.warning(f"Failed to summarize {path}: {error}")
+        entry = self.manifest.transcripts[path]
+        self.manifest.transcripts[path] = {"id": entry["id"], "status": FAILED, "error": error}
+        self.processed_index.mark(path, FAILED)
+        self.manifest.save()
+
+
+def _pack_batches(requests):
+    """Splits requests into batches of at most MAX_BATCH_REQUESTS requests and MAX_BATCH_CHARS characters."""
+    batch, chars = [], 0
+    for request in requests:
+        if batch and (len(batch) >= MAX_BATCH_REQUESTS or chars + len(request[1]) > MAX_BATCH_CHARS):
+            yield batch
+            batch, chars = [], 0
+        batch.append(request)
+        chars += len(request[1])
+    if batch:
+        yield batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize an archive of Zoom transcripts in bulk.")
+    parser.add_argument("paths", nargs="+", help="directories or glob patterns of transcript files")
+    parser.add_argument("--provider", choices=plugin_names(PROVIDERS), default="anthropic")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="progress file; rerun with it to resume")
+    parser.add_argument("--no-batch", action="store_true", help="send regular requests instead of batches")
+    parser.add_argument("--no-google-docs", action="store_true", help="only save summaries locally")
+    parser.add_argument("--workers", type=int, default=PREPARE_WORKERS, help="processes preparing transcripts")
+    parser.add_argument("--poll-seconds", type=float, default=BATCH_POLL_SECONDS)
+    parser.add_argument("--stub-llm", action="store_true",
+                        help="summarize with the local stub LLM server, to try a run without API calls")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    stub_server = None
+    if args.stub_llm:
+        from stub_llm_server import StubLLMServer
+        stub_server = StubLLMServer(batch_seconds=1.0).start()
+        os.environ.update(ANTHROPIC_BASE_URL=stub_server.url.rstrip("/"), OPENAI_BASE_URL=stub_server.url + "v1",
+                          ANTHROPIC_API_KEY="stub", OPENAI_API_KEY="stub")
+    docs_service = None
+    if not args.no_google_docs:
+        from docs_writer import build_docs_service
+        from google_auth import get_google_credentials
+        docs_service = build_docs_service(get_google_credentials())
+
+    paths = find_transcripts(args.paths)
+    logging.info(f"Found {len(paths)} transcripts")
+    summarizer = BulkSummarizer(args.provider, BulkManifest(args.manifest), docs_service,
+                                use_batches=not args.no_batch, workers=args.workers, poll_seconds=args.poll_seconds)
+    counts = summarizer.run(paths)
+    if stub_server:
+        stub_server.stop()
+    return 1 if counts.get(FAILED) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,24 @@
+import json
 import logging
 import os
-from anthropic import Anthropic
-from tokenizer import count_tokens, count_words
+
+import httpx
+from anthropic import Anthropic, AsyncAnthropic
+
+from metrics import count
+from providers import MAX_RETRIES, SummaryProvider, get_provider
+from rate_limiter import LLMScheduler
 
 ANTHROPIC_MODEL= "claude-3-5-sonnet-20240620"  # FOR MORE https://docs.anthropic.com/en/docs/about-claude/models
+MAX_TOKENS = 180000  # claude 3.5 sonnet has a context window of 200k tokens
+MAX_OUTPUT_TOKENS = 4096
+# rate limits for your Anthropic usage tier, see https://docs.anthropic.com/en/api/rate-limits
+REQUESTS_PER_MINUTE = 1000
+INPUT_TOKENS_PER_MINUTE = 80000
+OUTPUT_TOKENS_PER_MINUTE = 16000
+# Message Batches aren't wrapped by this SDK version, so they are called through the client's raw HTTP methods
+BATCH_REQUEST_OPTIONS = {"headers": {"anthropic-beta": "message-batches-2024-09-24"}}
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
 
 # Configuration for detailed summary role
 DETAILED_SUMMARY_ROLE = """You are a professional assistant tasked with summarizing Zoom meeting transcripts. 
@@ -12,54 +27,138 @@ DETAILED_SUMMARY_ROLE = """You are a professional assistant tasked with summariz
     of discussion.  If people have varying points of view please note that.  If there are timelines discussed, please 
     include dates and deliverables. """
 
-def summarize_transcript_with_claude(transcript_content):
+
+def _api_key():
+    # Retrieve Anthropic (Claude) API key from environment variable
+    claude_api_key = os.environ.get("ANTHROPIC_API_KEY")
+    if not claude_api_key:
+        raise KeyError("Anthropic (Claude) API key not found in environment variable")
+    return claude_api_key
+
+
+class ClaudeProvider(SummaryProvider):
+    """
+    Claude backend with pooled sync and async Anthropic clients.
+    """
+    name = "anthropic"
+    supports_batches = True
+
+    def __init__(self, model=ANTHROPIC_MODEL, max_output_tokens=MAX_OUTPUT_TOKENS):
+        super().__init__(model, max_output_tokens,
+                         LLMScheduler(REQUESTS_PER_MINUTE, INPUT_TOKENS_PER_MINUTE, OUTPUT_TOKENS_PER_MINUTE,
+                                      model_name=model))
+        self.max_input_tokens = MAX_TOKENS
+        self.summary_role = DETAILED_SUMMARY_ROLE
+
+    def create_client(self, http_client):
+        return Anthropic(api_key=_api_key(), http_client=http_client, max_retries=MAX_RETRIES)
+
+    def create_async_client(self, http_client):
+        return AsyncAnthropic(api_key=_api_key(), http_client=http_client, max_retries=MAX_RETRIES)
+
+    def _request(self, text, role):
+        message = f"{role or DETAILED_SUMMARY_ROLE}\n{text}"
+        return {
+            "max_tokens": self.max_output_tokens,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": message
+                }
+            ],
+            "model": self.model,
+        }
+
+    def _view_request(self, text, instructions, role):
+        return {
+            "max_tokens": self.max_output_tokens,
+            # the role and transcript are the same for every view of a meeting, so they are cached as a prefix
+            "system": [
+                {"type": "text", "text": role or DETAILED_SUMMARY_ROLE},
+                {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}},
+            ],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": instructions
+                }
+            ],
+            "model": self.model,
+            "extra_headers": PROMPT_CACHING_HEADERS,
+        }
+
+    def _summarize(self, text, role):
+        response = self.client.messages.create(**self._request(text, role))
+        _record_usage(response.usage)
+        return response.content[0].text
+
+    async def _asummarize(self, text, role):
+        response = await self.async_client.messages.create(**self._request(text, role))
+        _record_usage(response.usage)
+        return response.content[0].text
+
+    def _stream_summary(self, text, role):
+        with self.client.messages.stream(**self._request(text, role)) as stream:
+            yield from stream.text_stream
+            _record_usage(stream.get_final_message().usage)
+
+    def _summarize_view(self, text, instructions, role):
+        response = self.client.messages.create(**self._view_request(text, instructions, role))
+        return response.content[0].text, _record_usage(response.usage)
+
+    def submit_batch(self, requests):
+        body = {"requests": [{"custom_id": custom_id, "params": self._request(text, role)}
+                             for custom_id, text, role in requests]}
+        batch = self.client.post("/v1/messages/batches", body=body, cast_to=httpx.Response,
+                                 options=BATCH_REQUEST_OPTIONS).json()
+        return batch["id"]
+
+    def batch_results(self, batch_id):
+        batch = self.client.get(f"/v1/messages/batches/{batch_id}", cast_to=httpx.Response,
+                                options=BATCH_REQUEST_OPTIONS).json()
+        if batch["processing_status"] != "ended":
+            return None
+        response = self.client.get(f"/v1/messages/batches/{batch_id}/results", cast_to=httpx.Response,
+                                   options=BATCH_REQUEST_OPTIONS)
+        results = {}
+        for line in response.text.splitlines():
+            if line:
+                item = json.loads(line)
+                result = item["result"]
+                results[item["custom_id"]] = result["message"]["content"][0]["text"] \
+                    if result["type"] == "succeeded" else None
+        return results
+
+
+def _record_usage(usage):
+    # the cache fields are only reported for requests with a cache_control prefix, and aren't typed by this SDK
+    tokens = {"input_tokens": usage.input_tokens, "output_tokens": usage.output_tokens,
+              "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+              "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0}
+    for name, amount in tokens.items():
+        if amount or not name.startswith("cache_"):
+            count(name, amount)
+    return tokens
+
+
+def summarize_transcript_with_claude(transcript_content, role=None):
     """
     Summarizes the transcript content using Claude.
 
     Args:
         transcript_content (str): The content of the transcript to summarize.
+        role (str): Instructions placed ahead of the transcript.  Defaults to DETAILED_SUMMARY_ROLE.
 
     Returns:
         str: The comprehensive summary of the transcript.
     """
     logging.info("Summarizing transcript with Claude")
-
-    # Retrieve Anthropic (Claude) API key from environment variable
-    claude_api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not claude_api_key:
-        raise KeyError("Anthropic (Claude) API key not found in environment variable")
-
-    # Initialize the Anthropic client with the API key
-    client = Anthropic(api_key=claude_api_key)
-
-    message = f"{DETAILED_SUMMARY_ROLE}\n{transcript_content}"
-
-    # Create the summarization request
-    # message = "how are you today?"
-    response = client.messages.create(
-        max_tokens=4096,
-        #system={"content": DETAILED_SUMMARY_ROLE},  # Adjust based on the correct usage of 'system'
-        messages=[
-            {
-                "role": "user",
-                "content": message
-            }
-        ],
-        model=ANTHROPIC_MODEL,  # Specify the correct model identifier (claude-instant-1.2, claude-2.1)
-        # stream=True
-    )
-
-    #for attribute_name in dir(response.content[0].text):
-    #    attribute_value = getattr(response.content[0].text, attribute_name, None)
-    #    print(f"{attribute_name}:{attribute_value}")
-    summary=response.content[0].text
-
-    return summary
+    return get_provider("anthropic").summarize(transcript_content, role)
 
 if __name__ == "__main__":
     # Example usage of the Claude summarizer
     with open("test_meeting_transcript.txt") as file:
-        transcript_content=file.readlines()
+        transcript_content=file.read()
     # transcript_content = "Your transcript content goes here."
     summary = summarize_transcript_with_claude(transcript_content)
     print("Claude Summary:", summary)
@@ -0,0 +1,299 @@
+"""
+Background Google Docs output stage.
+
+Summaries are handed to a DocsWriter, which writes them on its own thread so a slow Docs API never delays the next
+summary.  Pending documents are grouped into HTTP batch requests: one batch creates every new document, a second
+appends the pending text of every open document.  Failed operations are retried with backoff.  The Docs service is
+built once from the discovery document bundled with google-api-python-client on a single authorized session.
+While the credentials are unhealthy (their token couldn't be refreshed) documents are held instead of being sent to
+fail, and are written once the credentials recover.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from google_auth import TOKEN_PATH, get_credential_manager, login
+from metrics import current_job
+from save_summary import GOOGLE_DOC_FLUSH_CHARS, GOOGLE_DOC_FLUSH_SECONDS, INCOMPLETE_SUMMARY_NOTE
+
+MAX_BATCH_SIZE = 50  # documents per HTTP batch request
+BATCH_WINDOW_SECONDS = 0.2  # how long to wait for more documents before sending a batch
+MAX_ATTEMPTS = 5  # attempts per operation before the document is given up on
+RETRY_BACKOFF_SECONDS = 1.0  # first retry delay, doubled for each further attempt
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+HTTP_TIMEOUT = 60
+
+
+def build_docs_service(credentials=None, api_endpoint=None):
+    """
+    Builds a Google Docs service on one reusable authorized HTTP session, using the bundled discovery document.
+    Args:
+        credentials: Google credentials, or None for an unauthenticated session (e.g. a FakeDocsServer).
+        api_endpoint: Base URL of the API, e.g. FakeDocsServer.url.  Defaults to the Google endpoint.
+    """
+    http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    if credentials is not None:
+        http = AuthorizedHttp(credentials, http=http)
+    client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+    return build('docs', 'v1', http=http, static_discovery=True, cache_discovery=False,
+                 client_options=client_options)
+
+
+def create_google_docs_writer(token_path=TOKEN_PATH):
+    """
+    Returns a started DocsWriter using the user's Google credentials, which are refreshed in the background and hold
+    the writer while they are unhealthy.  Registered as the "google_docs" sink plugin.
+    Args:
+        token_path: The user's Google token cache, e.g. a tenant's sink_options["token_path"].  Only the default
+            TOKEN_PATH logs in when it has no token; another raises ValueError, since the daemon serving a tenant
+            can't run the browser flow.
+    """
+    interactive = os.path.expanduser(token_path) == os.path.expanduser(TOKEN_PATH)
+    credentials = get_credential_manager(token_path, login_fn=login if interactive else None)
+    writer = DocsWriter(build_docs_service(credentials.credentials))
+    credentials.add_listener(writer.set_healthy)
+    return writer.start()
+
+
+class DocumentHandle:
+    """
+    A Google Doc being written by a DocsWriter.  Has the same write/close/abort interface as
+    save_summary.GoogleDocWriter.
+    done is a Future resolved with the document id once the document is created and all its text is written.
+    """
+
+    def __init__(self, writer, title):
+        self.writer = writer
+        self.title = title
+        self.doc_id = None
+        self.done = Future()
+        self.buffer = []  # text written since the last flush, handed to the writer in one insert
+        self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+        self.pending = []  # text waiting to be appended
+        self.closed = False
+        self.attempts = 0  # consecutive failed attempts
+        self.not_before = 0.0  # monotonic time before which the document isn't retried
+        self.closed_at = None
+        self.job = current_job()  # the transcript's metrics stay open until the document is written
+        if self.job:
+            self.job.hold()
+            self.done.add_done_callback(self._record_metrics)
+
+    def _record_metrics(self, future):
+        self.job.observe("docs_write", time.monotonic() - (self.closed_at or time.monotonic()))
+        self.job.release()
+
+    def write(self, text):
+        self.writer._append(self, text)
+
+    def close(self):
+        self.writer._close(self)
+
+    def abort(self):
+        """Marks the document as incomplete and closes it."""
+        logging.warning(f"Marking incomplete Google Doc {self.title}")
+        self.write(INCOMPLETE_SUMMARY_NOTE)
+        self.close()
+
+
+class DocsWriter:
+    """
+    Writes documents to Google Docs on a background thread using batched, retried requests.  Text streamed into a
+    document is appended once flush_chars have been written or flush_seconds have passed since the last append, as
+    save_summary.GoogleDocWriter does, to stay within the Docs per-user write quota.
+    """
+
+    def __init__(self, service, batch_uri=None, max_batch_size=MAX_BATCH_SIZE, batch_window=BATCH_WINDOW_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, retry_backoff=RETRY_BACKOFF_SECONDS, flush_chars=GOOGLE_DOC_FLUSH_CHARS,
+                 flush_seconds=GOOGLE_DOC_FLUSH_SECONDS):
+        self.service = service
+        self.batch_uri = batch_uri
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.flush_chars = flush_chars
+        self.flush_seconds = flush_seconds
+        self._handles = []
+        self._condition = threading.Condition()
+        self._closing = False
+        self._healthy = True  # False while the credentials can't be used, holding documents until they can
+        self._thread = threading.Thread(target=self._run, name="docs-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def open_document(self, title):
+        """
+        Starts a new document.  Text written to the returned handle is appended in order.
+        """
+        handle = DocumentHandle(self, title)
+        with self._condition:
+            if self._closing:
+                raise RuntimeError("Docs writer is shutting down")
+            self._handles.append(handle)
+            self._condition.notify()
+        return handle
+
+    def submit(self, title, text):
+        """
+        Queues a complete document.  Returns a Future resolved with the document id.
+        """
+        handle = self.open_document(title)
+        handle.write(text)
+        handle.close()
+        return handle.done
+
+    def _append(self, handle, text):
+        with self._condition:
+            handle.buffer.append(text)
+            handle.buffered_chars += len(text)
+            if (handle.buffered_chars >= self.flush_chars
+                    or time.monotonic() - handle.last_flush >= self.flush_seconds):
+                self._flush(handle)
+
+    def _flush(self, handle):
+        if handle.buffer:
+            handle.pending.append(''.join(handle.buffer))
+            handle.buffer = []
+            handle.buffered_chars = 0
+            handle.last_flush = time.monotonic()
+            self._condition.notify()
+
+    def _close(self, handle):
+        with self._condition:
+            self._flush(handle)
+            handle.closed = True
+            handle.closed_at = time.monotonic()
+            self._condition.notify()
+
+    def set_healthy(self, healthy):
+        """
+        Holds documents while healthy is False (e.g. the credentials couldn't be refreshed) and resumes writing when
+        it is True.  Called by google_auth.CredentialManager.
+        """
+        with self._condition:
+            self._healthy = healthy
+            if not healthy and self._handles:
+                logging.warning(f"Holding {len(self._handles)} Google Docs writes until the credentials recover")
+            self._condition.notify()
+
+    def close(self, wait=True):
+        """
+        Stops accepting documents.  With wait, blocks until every queued document is written or has failed.
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+    def _needs_work(self, handle, now):
+        if not self._healthy and not self._closing:  # on close, try held documents rather than wait
+            return False
+        if handle.not_before > now:
+            return False
+        return handle.doc_id is None or bool(handle.pending) or handle.closed
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    ready = [h for h in self._handles if self._needs_work(h, now)]
+                    if ready or (self._closing and not self._handles):
+                        break
+                    retry_at = min((h.not_before for h in self._handles if h.not_before > now), default=None)
+                    self._condition.wait(None if retry_at is None else retry_at - now)
+                if not ready:
+                    return
+            if len(ready) < self.max_batch_size and not self._closing:
+                time.sleep(self.batch_window)  # let more documents join this batch
+                with self._condition:
+                    now = time.monotonic()
+                    ready = [h for h in self._handles if self._needs_work(h, now)]
+            self._write(ready[:self.max_batch_size])
+
+    def _new_batch(self):
+        if self.batch_uri:
+            return BatchHttpRequest(batch_uri=self.batch_uri)
+        return self.service.new_batch_http_request()
+
+    def _execute(self, operations):
+        """
+        Sends (handle, request, on_success) operations as one HTTP batch.  Failed operations are retried later.
+        """
+        if not operations:
+            return
+        batch = self._new_batch()
+        for handle, request, on_success in operations:
+            batch.add(request, callback=functools.partial(self._callback, handle, on_success))
+        try:
+            batch.execute()
+        except Exception as e:  # the whole batch failed, e.g. a connection error
+            for handle, _, _ in operations:
+                self._failed(handle, e)
+
+    def _callback(self, handle, on_success, request_id, response, exception):
+        if exception is not None:
+            self._failed(handle, exception)
+            return
+        with self._condition:
+            handle.attempts = 0
+            on_success(response)
+
+    def _failed(self, handle, exception):
+        retryable = not isinstance(exception, HttpError) or exception.resp.status in RETRYABLE_STATUSES
+        with self._condition:
+            handle.attempts += 1
+            if retryable and handle.attempts < self.max_attempts:
+                handle.not_before = time.monotonic() + min(self.retry_backoff * 2 ** (handle.attempts - 1), 60)
+                logging.warning(f"Google Docs write for {handle.title} failed ({exception}), retrying")
+                return
+            if handle in self._handles:
+                self._handles.remove(handle)
+        logging.error(f"Google Docs write for {handle.title} failed: {exception}")
+        handle.done.set_exception(exception)
+
+    def _write(self, handles):
+        documents = self.service.documents()
+
+        def created(handle, response):
+            handle.doc_id = response.get('documentId')
+
+        self._execute([(h, documents.create(body={'title': h.title}), functools.partial(created, h))
+                       for h in handles if h.doc_id is None])
+
+        inserts = []
+        with self._condition:
+            for handle in handles:
+                if handle.doc_id is None or not handle.pending:
+                    continue
+                sent = len(handle.pending)
+                requests = [{'insertText': {'endOfSegmentLocation': {}, 'text': ''.join(handle.pending)}}]
+
+                def appended(response, handle=handle, sent=sent):
+                    del handle.pending[:sent]  # text written while the request was in flight stays pending
+
+                inserts.append((handle, documents.batchUpdate(documentId=handle.doc_id, body={'requests': requests}),
+                                appended))
+        self._execute(inserts)
+
+        with self._condition:
+            for handle in handles:
+                if handle.closed and handle.doc_id and not handle.pending and handle in self._handles:
+                    self._handles.remove(handle)
+                    logging.info(f"Summary written to Google Docs: {handle.title}")
+                    handle.done.set_result(handle.doc_id)
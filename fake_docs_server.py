@@ -0,0 +1,155 @@
+"""
+Local stand-in for the Google Docs API, used to test and benchmark the Docs output stage offline.
+
+Implements documents.create, documents.get, documents.batchUpdate (insertText) and the multipart/mixed HTTP batch
+endpoint, with configurable latency and injectable failures.  Build a client against it with
+docs_writer.build_docs_service(api_endpoint=server.url).
+"""
+
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DOCUMENT_PATH = re.compile(r'^/v1/documents/([^/:?]+)(:batchUpdate)?')
+
+
+class FakeDocsServer:
+    """
+    In-memory Google Docs API server running on a background thread.
+    Args:
+        latency: Seconds added to every HTTP request (a batch counts as one request).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.latency = latency
+        self.documents = {}  # document id -> {"title": ..., "text": ...}
+        self.http_requests = 0  # HTTP round trips received, with a batch counting once
+        self.api_calls = 0  # API operations executed, counting each part of a batch
+        self._failures = []  # HTTP statuses to return for the next API operations
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-docs-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail_next(self, count=1, status=503):
+        """Makes the next count API operations fail with the given HTTP status."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def text(self, document_id):
+        return self.documents[document_id]["text"]
+
+    def dispatch(self, method, path, body):
+        """
+        Executes one API operation.  Returns (status, response dict).
+        """
+        with self._lock:
+            self.api_calls += 1
+            if self._failures:
+                status = self._failures.pop(0)
+                return status, {"error": {"code": status, "message": "Injected failure"}}
+            if method == "POST" and path.split("?")[0] == "/v1/documents":
+                document_id = uuid.uuid4().hex
+                self.documents[document_id] = {"title": body.get("title", ""), "text": ""}
+                return 200, {"documentId": document_id, "title": body.get("title", "")}
+            match = DOCUMENT_PATH.match(path)
+            if not match or match.group(1) not in self.documents:
+                return 404, {"error": {"code": 404, "message": f"Not found: {path}"}}
+            document_id = match.group(1)
+            document = self.documents[document_id]
+            if method == "GET":
+                return 200, {"documentId": document_id, "title": document["title"],
+                             "body": {"content": [{"paragraph": {"elements": [{"textRun": {
+                                 "content": document["text"]}}]}}]}}
+            for request in body.get("requests", []):
+                insert = request.get("insertText")
+                if insert is None:
+                    return 400, {"error": {"code": 400, "message": "Only insertText is supported"}}
+                if "endOfSegmentLocation" in insert:
+                    document["text"] += insert["text"]
+                else:  # indexes are 1-based in the Docs API
+                    index = insert["location"]["index"] - 1
+                    document["text"] = document["text"][:index] + insert["text"] + document["text"][index:]
+            return 200, {"documentId": document_id, "replies": [{} for _ in body.get("requests", [])]}
+
+    def _batch(self, content_type, body):
+        message = Parser().parsestr(f"Content-Type: {content_type}\r\n\r\n{body}")
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            request_line, serialized = part.get_payload().split("\n", 1)
+            method, path, _ = request_line.split(" ", 2)
+            request_body = serialized.split("\n\n", 1)[1] if "\n\n" in serialized else ""
+            status, response = self.dispatch(method, path, json.loads(request_body) if request_body.strip() else {})
+            content_id = part["Content-ID"].replace("<", "<response-", 1)
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                         f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                         f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(response)}\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(parts) + f"--{boundary}--\r\n"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, status, content_type, body):
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _handle(self, method):
+                with server._lock:
+                    server.http_requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8") if length else ""
+                if self.path.startswith("/batch"):
+                    content_type, response = server._batch(self.headers["Content-Type"], body)
+                    self._respond(200, content_type, response)
+                    return
+                status, response = server.dispatch(method, self.path, json.loads(body) if body else {})
+                self._respond(status, "application/json; charset=UTF-8", json.dumps(response))
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, format, *args):
+                pass  # keep test and benchmark output quiet
+
+        return Handler
+
+
+if __name__ == "__main__":
+    fake_server = FakeDocsServer().start()
+    print(f"Fake Google Docs API listening on {fake_server.url}")
+    try:
+        while True:
+            time.sleep(10)
+    except KeyboardInterrupt:
+        fake_server.stop()
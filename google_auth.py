@@ -1,55 +1,265 @@
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import os
+"""
+Google API credentials shared by every worker and process.
+
+A CredentialManager refreshes the access token on a background thread REFRESH_MARGIN_SECONDS before it expires, so
+Docs requests never wait for a refresh round-trip, and tells listeners (e.g. the DocsWriter) whether the credentials
+are healthy.  The token is cached as JSON in the state directory.  The cache file is replaced atomically, and
+refreshes hold a file lock, so processes sharing it never read a partly written token or refresh it at the same time:
+a process that finds the token already refreshed by another adopts it instead.
+
+The browser consent flow only runs when there is no cached token at all, e.g. on the first run.  Run
+`python google_auth.py [token path]` to log in again if the refresh token has been revoked, or to log a user in for
+the multi-tenant daemon, whose managers never log in themselves.
+"""
+
+import datetime
 import json
-import pickle
 import logging
-from google.auth.exceptions import RefreshError
+import os
+import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+from summary_cache import STATE_DIRECTORY
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes are only serialized within the process
+    fcntl = None
 
 SCOPES = ['https://www.googleapis.com/auth/documents']
+TOKEN_PATH = os.path.join(STATE_DIRECTORY, "google_token.json")
+LEGACY_TOKEN_PATH = 'token.pickle'  # token cache of earlier versions, migrated to TOKEN_PATH
+REFRESH_MARGIN_SECONDS = 300  # the access token is refreshed this long before it expires
+REFRESH_RETRY_SECONDS = 30  # wait before retrying a failed refresh
 
 logger = logging.getLogger(__name__)
 logging.basicConfig( level=logging.INFO)
 
-def get_google_credentials():
-    creds = None
 
-    # Load the OAuth2 credentials from a single environment variable
+def _utcnow():
+    return datetime.datetime.utcnow()  # google.auth keeps expiry as a naive UTC datetime
+
+
+@contextmanager
+def _file_lock(path):
+    """Holds an exclusive lock on path (created if missing) across processes."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_token(path=TOKEN_PATH):
+    """Returns the credentials cached at path, or None if there are none."""
+    try:
+        with open(path) as token_file:
+            return Credentials.from_authorized_user_info(json.load(token_file), SCOPES)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:  # unreadable or missing fields
+        logger.warning(f"Ignoring invalid Google token cache {path}: {e}")
+        return None
+
+
+def write_token(credentials, path=TOKEN_PATH):
+    """
+    Caches credentials at path, replacing the file atomically so readers see either the old or the new token.
+    The file is only readable by the user, since it holds the refresh token.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".google_token.")  # created with mode 0600
+    try:
+        with os.fdopen(fd, 'w') as token_file:
+            token_file.write(credentials.to_json())
+            token_file.flush()
+            os.fsync(token_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _read_legacy_token(path=LEGACY_TOKEN_PATH):
+    if not os.path.exists(path):
+        return None
+    logger.info(f"Migrating Google token from {path}")
+    with open(path, 'rb') as token_file:
+        return pickle.load(token_file)
+
+
+def login():
+    """
+    Runs the browser consent flow with the OAuth client in GOOGLE_DOCS_SUMMARIZER_JSON and returns the credentials.
+    Blocks until the user has logged in.
+    """
     creds_json_str = os.environ.get("GOOGLE_DOCS_SUMMARIZER_JSON")
     if not creds_json_str:
         logger.error("Google Json not available.  Please set environment variable with authentication data.")
         raise ValueError("The GOOGLE_DOCS_SUMMARIZER_JSON environment variable is not set.")
+    logger.info("get new token")
+    flow = InstalledAppFlow.from_client_config(json.loads(creds_json_str), SCOPES)
+    return flow.run_local_server(port=0)
+
+
+class CredentialManager:
+    """
+    Google credentials kept fresh by a background thread and cached in a token file shared between processes.
+    The credentials object is updated in place, so sessions built from it (e.g. build_docs_service) always send the
+    current access token.
+    """
+
+    def __init__(self, token_path=TOKEN_PATH, refresh_margin=REFRESH_MARGIN_SECONDS,
+                 retry_seconds=REFRESH_RETRY_SECONDS, login_fn=login):
+        """
+        Args:
+            token_path: The token cache.  Only the default TOKEN_PATH adopts the token of LEGACY_TOKEN_PATH.
+            login_fn: Returns new credentials when there is no usable cached token, or None to raise instead, e.g. for
+                a tenant of the multi-tenant daemon, who logs in with `python google_auth.py <token path>`.
+        """
+        self.token_path = os.path.expanduser(token_path)
+        self.refresh_margin = refresh_margin
+        self.retry_seconds = retry_seconds
+        self.login_fn = login_fn
+        self.credentials = None
+        self.healthy = None  # not known until started
+        self._failed = False  # the last refresh failed
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="google-credentials", daemon=True)
+
+    def start(self):
+        """
+        Loads the cached token, logging in first if there is none, and starts refreshing it in the background.
+        An expired token is refreshed on the background thread; listeners hear when it is usable.
+        Raises:
+            ValueError: If there is no usable cached token and login_fn is None.
+        """
+        with _file_lock(self.token_path + ".lock"):
+            credentials = read_token(self.token_path)
+            if (credentials is None and self.token_path == os.path.expanduser(TOKEN_PATH)
+                    and (credentials := _read_legacy_token()) is not None):  # the legacy token is the default user's
+                write_token(credentials, self.token_path)
+            if credentials is None or not (credentials.valid or credentials.refresh_token):
+                if self.login_fn is None:
+                    raise ValueError(f"No usable Google token at {self.token_path}.  Run "
+                                     f"`python google_auth.py {self.token_path}` to log in.")
+                credentials = self.login_fn()
+                write_token(credentials, self.token_path)
+        self.credentials = credentials
+        self._set_healthy(credentials.valid and self._seconds_left() > 0)
+        self._thread.start()
+        return self
+
+    def add_listener(self, listener):
+        """
+        Calls listener(healthy) now and whenever the credentials become healthy or unhealthy.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            healthy = bool(self.healthy)
+        listener(healthy)
+
+    def close(self):
+        """Stops refreshing the token."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _seconds_left(self):
+        if self.credentials.expiry is None:  # not known to expire
+            return float("inf")
+        return (self.credentials.expiry - _utcnow()).total_seconds()
+
+    def _seconds_until_refresh(self):
+        if self._failed:
+            return self.retry_seconds
+        return max(0.0, self._seconds_left() - self.refresh_margin)
+
+    def _run(self):
+        while not self._stop.wait(min(self._seconds_until_refresh(), 24 * 60 * 60)):
+            if self._seconds_left() > self.refresh_margin and not self._failed:
+                continue  # woke early for a token not known to expire
+            try:
+                self.refresh()
+            except Exception as e:  # e.g. a network error, or the refresh token was revoked
+                self._failed = True
+                logger.error(f"Google token refresh failed, retrying in {self.retry_seconds}s: {e}  If the refresh "
+                             f"token was revoked, run `python google_auth.py {self.token_path}` to log in again.")
+                self._set_healthy(self._seconds_left() > 0)
+            else:
+                self._failed = False
+                self._set_healthy(True)
+
+    def refresh(self):
+        """
+        Refreshes the access token, or adopts the cached one if another process has just refreshed it, and caches it.
+        """
+        with _file_lock(self.token_path + ".lock"):
+            cached = read_token(self.token_path)
+            if (cached is not None and cached.token != self.credentials.token and cached.expiry is not None
+                    and (cached.expiry - _utcnow()).total_seconds() > self.refresh_margin):
+                self.credentials.token = cached.token
+                self.credentials.expiry = cached.expiry
+                self.credentials._refresh_token = cached.refresh_token  # as Credentials.refresh does, e.g. after login
+                logger.info("Using the Google token refreshed by another process")
+                return
+            self.credentials.refresh(Request())
+            write_token(self.credentials, self.token_path)
+            logger.info(f"Refreshed Google token, valid until {self.credentials.expiry} UTC")
+
+    def _set_healthy(self, healthy):
+        with self._lock:
+            if healthy == self.healthy:
+                return
+            self.healthy = healthy
+            listeners = list(self._listeners)
+        if not healthy:
+            logger.warning("Google credentials are unusable until the token is refreshed")
+        for listener in listeners:
+            listener(healthy)
+
+
+_managers = {}  # token path -> started CredentialManager
+_managers_lock = threading.Lock()
+
+
+def get_credential_manager(token_path=TOKEN_PATH, login_fn=login):
+    """
+    Returns the process's started CredentialManager for a token cache, creating it on first use.
+    Args:
+        token_path: The token cache, e.g. one per user when serving several users.  Defaults to TOKEN_PATH.
+        login_fn: See CredentialManager; used when the manager is created.
+    """
+    token_path = os.path.expanduser(token_path)
+    with _managers_lock:
+        if token_path not in _managers:
+            _managers[token_path] = CredentialManager(token_path, login_fn=login_fn).start()
+        return _managers[token_path]
+
+
+def get_google_credentials():
+    """
+    Returns the process's Google credentials, which are refreshed in the background before they expire.
+    """
+    return get_credential_manager().credentials
+
 
-    creds_info = json.loads(creds_json_str)
-
-    # Check if a token.pickle file exists for storing access and refresh tokens
-    token_path = 'token.pickle'
-    if os.path.exists(token_path):
-        logger.info("pickle file token found")
-        # Read the token from the file
-        with open(token_path, 'rb') as token_file:
-            creds = pickle.load(token_file)
-
-    # Refresh or obtain new credentials if needed
-    if not creds or not creds.valid:
-        logger.info("No valid credentials.  Refreshing token")
-        if creds and creds.expired and creds.refresh_token:
-            logger.info("previous token expired.  Refreshing")
-            try:  # refresh token and check for error
-                creds.refresh(Request())
-            except RefreshError as e:
-                logger.error(f"refresh error: {e}")
-                creds=None  # remove the bad credentials if we can't refresh the token
-                os.remove(token_path)  # clear the pickled token so it doesn't happen again
-
-        if not creds or not creds.valid:  #get new token if we dont have valid credentials
-            logger.info("get new token")
-            flow = InstalledAppFlow.from_client_config(creds_info, SCOPES)
-            creds = flow.run_local_server(port=0)
-
-        # Save the credentials for the next run
-        with open(token_path, 'wb') as token_file:
-            logger.info(f"save pickled token {token_path}")
-            pickle.dump(creds, token_file)
-
-    return creds
+if __name__ == "__main__":
+    import sys
+    token_path = os.path.expanduser(sys.argv[1] if len(sys.argv) > 1 else TOKEN_PATH)
+    with _file_lock(token_path + ".lock"):
+        write_token(login(), token_path)
+    print(f"Saved Google token to {token_path}")
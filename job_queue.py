@@ -0,0 +1,256 @@
+"""
+Bounded job queue and worker pool for transcript processing.
+
+File system events are debounced per file (Zoom fires several created/modified events while it is still writing a
+transcript), then handed to a bounded queue served by a fixed number of worker threads.  The watchdog observer thread
+only records the event, so a slow LLM call never blocks other events.  When one pool serves several tenants, jobs are
+queued per tenant, each tenant's queue is bounded separately, and jobs are handed to the workers in weighted
+round-robin order (see FairQueue).
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from metrics import observe, track_job
+
+NUM_WORKERS = 4  # transcripts processed concurrently; raise to match the concurrency your API quota allows
+MAX_QUEUED_JOBS = 100  # jobs waiting per key (tenant); further files wait in the debounce stage for space
+DEBOUNCE_SECONDS = 5.0  # a file is processed once it has had no events for this long
+MAX_DEBOUNCE_SECONDS = None  # if set, a file that keeps changing is still processed this long after its first event
+
+
+class FairQueue:
+    """
+    Bounded queue of jobs from several tenants, identified by key.  Jobs are handed out in smooth weighted round-robin
+    order across the keys with jobs waiting, so a tenant with many queued jobs can't starve the others, and no key has
+    more than its max_running jobs handed out at once.  Each key's jobs are handed out in the order they were queued,
+    so with a single key it is a FIFO queue.  Each key has at most maxsize jobs waiting (no limit if 0), so one key's
+    backlog never holds up another's jobs.
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize  # per key
+        self._jobs = {}  # key -> deque of queued jobs
+        self._weights = {}  # key -> share of the jobs handed out, relative to the other keys; defaults to 1
+        self._max_running = {}  # key -> most jobs handed out and not yet done; unlimited by default
+        self._running = {}  # key -> jobs handed out and not yet done
+        self._credit = {}  # key -> smooth weighted round-robin credit
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def configure(self, key, weight=1, max_running=None):
+        """Sets a key's weight and the most of its jobs that may run at once (None for no limit)."""
+        with self._condition:
+            self._weights[key] = weight
+            self._max_running[key] = max_running
+            self._condition.notify_all()
+
+    def qsize(self):
+        with self._condition:
+            return self._size
+
+    def _full(self, key):
+        return bool(self.maxsize) and len(self._jobs.get(key, ())) >= self.maxsize
+
+    def full(self, key):
+        """Returns True if key has maxsize jobs waiting."""
+        with self._condition:
+            return self._full(key)
+
+    def put(self, key, job, block=True):
+        """
+        Queues a job, blocking while its key is full.  With block=False, returns False instead of waiting.
+        """
+        with self._condition:
+            while self._full(key):
+                if not block:
+                    return False
+                self._condition.wait()
+            self._jobs.setdefault(key, deque()).append(job)
+            self._size += 1
+            self._condition.notify_all()
+            return True
+
+    def _ready_keys(self):
+        return [key for key, jobs in self._jobs.items()
+                if jobs and (self._max_running.get(key) is None or self._running.get(key, 0) < self._max_running[key])]
+
+    def get(self):
+        """
+        Blocks until a job may run and returns (key, job), or returns None once the queue is closed and empty.
+        Call task_done(key) when the job is finished.
+        """
+        with self._condition:
+            while not (ready := self._ready_keys()):
+                if self._closed and not self._size:
+                    return None
+                self._condition.wait()
+            for key in ready:
+                self._credit[key] = self._credit.get(key, 0) + self._weights.get(key, 1)
+            key = max(ready, key=self._credit.get)
+            self._credit[key] -= sum(self._weights.get(k, 1) for k in ready)
+            self._size -= 1
+            self._running[key] = self._running.get(key, 0) + 1
+            self._condition.notify_all()  # a put may be waiting for space
+            return key, self._jobs[key].popleft()
+
+    def task_done(self, key):
+        with self._condition:
+            self._running[key] -= 1
+            self._condition.notify_all()  # the key may be below its max_running again
+
+    def close(self):
+        """Lets get return None once the queued jobs have been handed out."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class TranscriptJobQueue:
+    """
+    Debounces file events and runs process_fn(path) for each file on a pool of worker threads.  A path is processed
+    by one worker at a time: events for a path that is being processed run it once more after the job finishes.
+    With key_fn, files are queued under key_fn(path) (e.g. their tenant) and the keys share the workers fairly.  A file
+    whose key already has max_queued_jobs waiting stays in the debounce stage until a worker takes one of them, so the
+    other keys' files are still queued.
+    """
+
+    def __init__(self, process_fn, num_workers=NUM_WORKERS, max_queued_jobs=MAX_QUEUED_JOBS,
+                 debounce_seconds=DEBOUNCE_SECONDS, max_debounce_seconds=MAX_DEBOUNCE_SECONDS, key_fn=None):
+        self.process_fn = process_fn
+        self.num_workers = num_workers
+        self.debounce_seconds = debounce_seconds
+        self.max_debounce_seconds = max_debounce_seconds
+        self.key_fn = key_fn
+        self._jobs = FairQueue(maxsize=max_queued_jobs)
+        self._pending = {}  # path -> time at which the debounce window for the path closes, or closed while held back
+        self._pending_since = {}  # path -> time of the first event in the path's debounce window
+        self._queued = {}  # path -> time queued, for paths waiting in the job queue so events don't queue duplicates
+        self._running = set()  # paths being processed
+        self._deferred = set()  # running paths with new events, queued again once their job finishes
+        self._condition = threading.Condition()
+        self._closing = False
+        self._threads = []
+
+    def start(self):
+        """
+        Starts the debounce thread and the worker threads.
+        """
+        self._threads.append(threading.Thread(target=self._debounce_loop, name="transcript-debouncer", daemon=True))
+        for i in range(self.num_workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f"transcript-worker-{i}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def configure_key(self, key, weight=1, max_running=None):
+        """
+        Sets the share of the workers a key returned by key_fn gets while other keys have jobs waiting (its weight),
+        and the most of its jobs that may run at once.
+        """
+        self._jobs.configure(key, weight, max_running)
+
+    def submit(self, path, delay=None):
+        """
+        Schedules path for processing once no further events arrive for it within the debounce window, or at most
+        max_debounce_seconds after its first event.
+        Args:
+            path: The path of the transcript file.
+            delay: Seconds to wait before queueing the path, unless it is already due sooner.  Defaults to restarting
+                the debounce window.
+        """
+        with self._condition:
+            if self._closing:
+                raise RuntimeError("job queue is shutting down")
+            now = time.monotonic()
+            if delay is not None:
+                self._pending[path] = min(self._pending.get(path, float("inf")), now + delay)
+            else:
+                deadline = now + self.debounce_seconds
+                if self.max_debounce_seconds is not None:
+                    deadline = min(deadline, self._pending_since.setdefault(path, now) + self.max_debounce_seconds)
+                self._pending[path] = deadline
+            self._condition.notify()
+
+    def _key(self, path):
+        return self.key_fn(path) if self.key_fn else None
+
+    def _debounce_loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    due, deadlines = [], []
+                    for path, deadline in self._pending.items():
+                        if deadline > now and not self._closing:
+                            deadlines.append(deadline)
+                        elif not self._jobs.full(self._key(path)):  # held back until a worker takes one of the key's
+                            due.append(path)
+                    if due or (self._closing and not self._pending and not self._deferred):
+                        break
+                    self._condition.wait(min(deadlines) - now if deadlines else None)
+                for path in due:
+                    del self._pending[path]
+                    self._pending_since.pop(path, None)
+
+            for path in due:
+                with self._condition:
+                    if path in self._queued:
+                        continue
+                    if path in self._running:  # one job per path at a time: run again after this one
+                        self._deferred.add(path)
+                        continue
+                    if not self._jobs.put(self._key(path), path, block=False):  # the key filled up in this batch
+                        self._pending[path] = time.monotonic()
+                        continue
+                    self._queued[path] = time.monotonic()
+                logging.info(f"Queued {path} ({self._jobs.qsize()} jobs waiting)")
+
+            with self._condition:
+                if self._closing and not self._pending and not self._deferred:
+                    return
+
+    def _worker_loop(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:  # shut down and drained
+                return
+            key, path = job
+            try:
+                with self._condition:
+                    queued_at = self._queued.pop(path)
+                    self._running.add(path)
+                    self._condition.notify()  # the key has space for a held back file
+                with track_job(path):
+                    observe("queue_wait", time.monotonic() - queued_at)
+                    self.process_fn(path)
+            except Exception:
+                logging.exception(f"Failed to process {path}")
+            finally:
+                with self._condition:
+                    self._running.discard(path)
+                    if path in self._deferred:  # events arrived while it ran
+                        self._deferred.discard(path)
+                        self._pending[path] = time.monotonic()
+                    self._condition.notify()
+                self._jobs.task_done(key)
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting jobs, flushes debounced files into the queue and lets the workers drain it.
+        Args:
+            wait: Block until all queued jobs have finished.
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if not self._threads:  # never started
+            return
+        self._threads[0].join()  # debounce thread exits after flushing pending and deferred files
+        self._jobs.close()
+        if wait:
+            for thread in self._threads[1:]:
+                thread.join()
@@ -0,0 +1,109 @@
+"""
+Hierarchical (map-reduce) summarization for transcripts that are too long to summarize well in a single request.
+
+The transcript is chunked by tokens (on speaker turns when it has been parsed into a Transcript), the chunks are
+summarized in parallel, and the partial summaries are then combined in a tree until a single summary is left.  The
+engine works with any summarize function that takes the text to summarize and an optional role prompt, so it is
+shared by the OpenAI and Claude backends.
+"""
+
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import stage
+from tokenizer import chunk_text_by_tokens, count_tokens
+from transcript_parser import Transcript, iter_turn_chunks
+
+CHUNK_TOKENS = 12000  # size of each chunk summarized in the map step
+CHUNK_OVERLAP_TOKENS = 200  # context repeated between neighbouring chunks so nothing is cut mid-thought
+MAX_CONCURRENCY = 4  # number of summarization requests in flight at once
+COMBINE_SUMMARIES_ROLE = """You are a professional assistant combining partial summaries of consecutive sections of 
+    one Zoom meeting transcript into a single summary for an executive.  Merge duplicate points, keep decisions, 
+    action items, owners, dates and deliverables, and note where people held differing points of view.  Keep the 
+    result concise and clear and do not mention that it was assembled from parts."""
+
+
+def group_by_tokens(summaries, max_tokens):
+    """
+    Groups consecutive summaries so that each group fits in max_tokens.
+    Every group holds at least two summaries (when available) so each reduce round shrinks the list.
+    """
+    groups = []
+    current_group = []
+    current_tokens = 0
+    for summary in summaries:
+        summary_tokens = count_tokens(summary)
+        if len(current_group) >= 2 and current_tokens + summary_tokens > max_tokens:
+            groups.append(current_group)
+            current_group = []
+            current_tokens = 0
+        current_group.append(summary)
+        current_tokens += summary_tokens
+    if len(current_group) == 1 and groups:  # never leave a lone summary to be re-summarized by itself
+        groups[-1].append(current_group[0])
+    elif current_group:
+        groups.append(current_group)
+    return groups
+
+
+def _map(executor, fn, items):
+    """Like executor.map, but each call runs in a copy of the caller's context so metrics follow the job."""
+    futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
+def split_transcript(transcript_content, single_pass_tokens=CHUNK_TOKENS, chunk_tokens=CHUNK_TOKENS):
+    """
+    Returns the texts to summarize in the map step: the whole transcript when it fits in single_pass_tokens,
+    otherwise its chunks of up to chunk_tokens tokens.
+    Args:
+        transcript_content (str or Transcript): The transcript to summarize.
+        single_pass_tokens (int): Transcripts up to this many tokens are summarized with one request.
+        chunk_tokens (int): Maximum tokens per chunk.
+    Returns:
+        list: The texts to summarize.
+    """
+    is_transcript = isinstance(transcript_content, Transcript)
+    with stage("tokenization"):
+        if is_transcript:
+            fits_single_pass = transcript_content.token_count() <= single_pass_tokens
+        else:
+            fits_single_pass = count_tokens(transcript_content) <= single_pass_tokens
+        if fits_single_pass:
+            return [transcript_content.text() if is_transcript else transcript_content]
+        if is_transcript:  # chunks end on speaker turns, reusing the turns' cached token counts
+            return [chunk.text for chunk in iter_turn_chunks(transcript_content, max_tokens=chunk_tokens,
+                                                             overlap_tokens=CHUNK_OVERLAP_TOKENS)]
+        return chunk_text_by_tokens(transcript_content, max_tokens=chunk_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS)
+
+
+def summarize_long_transcript(transcript_content, summarize_fn, single_pass_tokens=CHUNK_TOKENS,
+                              chunk_tokens=CHUNK_TOKENS, max_workers=MAX_CONCURRENCY):
+    """
+    Summarizes a transcript, using map-reduce when it is longer than single_pass_tokens.
+    Args:
+        transcript_content (str or Transcript): The transcript to summarize.
+        summarize_fn: Backend function called as summarize_fn(text) or summarize_fn(text, role=...).
+        single_pass_tokens (int): Transcripts up to this many tokens are summarized with one request.
+        chunk_tokens (int): Maximum tokens per chunk (and per group of partial summaries) in the map-reduce path.
+        max_workers (int): Maximum number of concurrent summarization requests.
+    Returns:
+        str: The summary of the transcript.
+    """
+    chunks = split_transcript(transcript_content, single_pass_tokens, chunk_tokens)
+    if len(chunks) == 1:
+        return summarize_fn(chunks[0])
+    logging.info(f"Transcript split into {len(chunks)} chunks of up to {chunk_tokens} tokens")
+
+    def combine(group):
+        return summarize_fn("\n\n".join(group), role=COMBINE_SUMMARIES_ROLE)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = _map(executor, summarize_fn, chunks)  # map: summarize every chunk in parallel
+        while len(summaries) > 1:  # reduce: combine partial summaries until one is left
+            groups = group_by_tokens(summaries, chunk_tokens)
+            logging.info(f"Combining {len(summaries)} partial summaries into {len(groups)}")
+            summaries = _map(executor, combine, groups)
+
+    return summaries[0]
@@ -0,0 +1,225 @@
+"""
+Per-transcript pipeline instrumentation.
+
+Each transcript is tracked as a job.  Code anywhere in the pipeline records stage timings and counters against the
+current job (held in a context variable, so it follows the job across worker threads and asyncio tasks that copy the
+context).  Observations feed process-wide histograms and counters served in the Prometheus text format, and a summary
+line per job can be appended to a JSONL log.  Jobs can optionally be profiled with cProfile.
+
+Stages: file_read, queue_wait, preprocess, tokenization, tenant_quota_wait, rate_limit_wait, llm, time_to_first_token,
+docs_write, local_save.
+Counters: input_tokens (not read from a prompt cache), output_tokens, cache_read_input_tokens,
+cache_creation_input_tokens, llm_requests, cache_hits, cache_misses, preprocessing_tokens_saved, hedged_requests,
+hedge_wins.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from summary_cache import STATE_DIRECTORY
+
+METRICS_PORT = 9464  # local port for the Prometheus endpoint, None to disable
+METRICS_LOG_PATH = os.path.join(STATE_DIRECTORY, "metrics.jsonl")  # one JSON line per transcript, None to disable
+PROFILE_JOBS = False  # profile each transcript with cProfile
+PROFILE_DIRECTORY = os.path.join(STATE_DIRECTORY, "profiles")
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class MetricsRegistry:
+    """
+    Process-wide stage histograms and counters, with the JSONL log and profiling settings.
+    """
+
+    def __init__(self, log_path=None, profile_directory=None):
+        self.log_path = log_path
+        self.profile_directory = profile_directory
+        self.histograms = {}  # stage -> [bucket counts, sum, count]
+        self.counters = {"transcripts": 0}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.setdefault(stage, [[0] * len(HISTOGRAM_BUCKETS), 0.0, 0])
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def job_finished(self, job):
+        self.count("transcripts")
+        if not self.log_path:
+            return
+        line = json.dumps(job.as_dict())
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.expanduser(self.log_path)), exist_ok=True)
+            with open(os.path.expanduser(self.log_path), 'a') as file:
+                file.write(line + "\n")
+
+    def prometheus_text(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = ["# TYPE summarizer_stage_seconds histogram"]
+        with self._lock:
+            for stage, (buckets, total, count) in sorted(self.histograms.items()):
+                for bound, bucket_count in zip(HISTOGRAM_BUCKETS, buckets):
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'summarizer_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {bucket_count}')
+                lines.append(f'summarizer_stage_seconds_sum{{stage="{stage}"}} {total}')
+                lines.append(f'summarizer_stage_seconds_count{{stage="{stage}"}} {count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE summarizer_{name}_total counter")
+                lines.append(f"summarizer_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class JobMetrics:
+    """
+    Stage timings and counters for one transcript.  The job is finished, logged and profiled when the outermost
+    track_job exits and every hold (e.g. a Google Doc still being written in the background) has been released.
+    """
+
+    def __init__(self, name, registry=REGISTRY):
+        self.name = name
+        self.registry = registry
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self._holds = 1
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """Adds seconds to a stage; stages that run several times (e.g. one LLM call per chunk) accumulate."""
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.registry.observe(stage, seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        self.registry.count(name, amount)
+
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        with self._lock:
+            self._holds -= 1
+            finished = self._holds == 0
+        if finished:
+            self.registry.job_finished(self)
+
+    def as_dict(self):
+        with self._lock:
+            return {"transcript": self.name, "started": self.started, "wall_seconds": time.time() - self.started,
+                    "stages": dict(self.stages), "counters": dict(self.counters)}
+
+
+def current_job():
+    """Returns the JobMetrics of the transcript being processed in this context, or None."""
+    return _current_job.get()
+
+
+@contextlib.contextmanager
+def track_job(name):
+    """
+    Records metrics in the block against a job for the named transcript.  Nested calls reuse the outer job.
+    """
+    job = _current_job.get()
+    if job is not None:
+        yield job
+        return
+    job = JobMetrics(name, REGISTRY)
+    token = _current_job.set(job)
+    profiler = cProfile.Profile() if REGISTRY.profile_directory else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield job
+    finally:
+        if profiler:
+            profiler.disable()
+            _dump_profile(profiler, name)
+        _current_job.reset(token)
+        job.release()
+
+
+def _dump_profile(profiler, name):
+    directory = os.path.expanduser(REGISTRY.profile_directory)
+    os.makedirs(directory, exist_ok=True)
+    meeting = os.path.basename(os.path.dirname(name)) or os.path.basename(name)
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{meeting}.prof")
+    profiler.dump_stats(path)
+    logging.info(f"Profile written to {path}")
+
+
+def observe(stage, seconds):
+    """Adds seconds to a stage of the current job, if there is one."""
+    job = _current_job.get()
+    if job is not None:
+        job.observe(stage, seconds)
+
+
+def count(name, amount=1):
+    """Increments a counter of the current job, if there is one."""
+    job = _current_job.get()
+    if job is not None:
+        job.count(name, amount)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times the block as a stage of the current job."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def configure_metrics(port=METRICS_PORT, log_path=METRICS_LOG_PATH, profile_directory=None):
+    """
+    Enables the JSONL log and profiling, and starts the Prometheus endpoint on a background thread.
+    Returns the HTTP server, or None if port is None.
+    """
+    REGISTRY.log_path = log_path
+    REGISTRY.profile_directory = profile_directory
+    if port is None:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = REGISTRY.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Metrics available at http://127.0.0.1:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,80 @@
+"""
+Several views of one meeting (executive summary, action items, decisions and follow-ups per person) from a single
+transcript.
+
+Every view is requested with the same role prompt and transcript ahead of a short view-specific instruction, so the
+backend can cache that prefix (Anthropic prompt caching with cache_control, OpenAI's automatic prefix caching).  The
+first view writes the cache and the other views are then requested concurrently, reading the transcript from the
+cache, so each extra view costs little more than its instruction and output.  The cache read and write tokens are
+logged and counted against the current job.
+"""
+
+import contextvars
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+SUMMARY_VIEWS = {  # heading -> instructions for each view of the meeting
+    "Executive Summary": """Write a concise executive summary of the meeting: its purpose, the key points discussed
+        and the outcome.  Provide context and names of folks who are the subject of discussion.""",
+    "Action Items": """List every action item agreed in the meeting, one per line, with its owner and due date
+        when they were mentioned.""",
+    "Decisions": """List every decision made in the meeting, one per line, with the reasoning given and any
+        differing points of view.""",
+    "Follow-ups by Person": """For each participant with something to follow up on, list their name and then their
+        follow-ups, including commitments they made and questions left for them to answer.""",
+}
+VIEWS_ROLE = """You are a professional assistant preparing notes on a Zoom meeting for an executive.  The meeting's
+    transcript follows.  Answer only the request that comes after it, concisely and clearly, and include dates and
+    deliverables where timelines were discussed."""
+MAX_CONCURRENCY = 4  # views requested at once after the first has written the prompt cache
+
+# The text of each view, by heading, and the token usage of all the view requests
+ViewSummaries = namedtuple("ViewSummaries", ["summaries", "usage"])
+
+
+def views_prompt(views=None, role=VIEWS_ROLE):
+    """Returns the role and view instructions as one string, e.g. for summary cache keys."""
+    views = SUMMARY_VIEWS if views is None else views
+    return "\n".join([role, *(f"{name}: {instructions}" for name, instructions in views.items())])
+
+
+def summarize_views(transcript_content, provider, views=None, role=VIEWS_ROLE, max_concurrency=MAX_CONCURRENCY):
+    """
+    Produces every view of a transcript that fits in one request.
+    Args:
+        transcript_content (str): The transcript.
+        provider (SummaryProvider): The backend to use.
+        views (dict): Heading -> instructions for each view.  Defaults to SUMMARY_VIEWS.
+        role (str): The instructions ahead of the transcript, shared by all views.
+        max_concurrency (int): Views requested at once after the first.
+    Returns:
+        ViewSummaries: The views, in the order given, and the total token usage.
+    """
+    views = SUMMARY_VIEWS if views is None else views
+    names = list(views)
+
+    def summarize_view(name):
+        return provider.summarize_view(transcript_content, views[name], role)
+
+    results = {}
+    if names:  # the first request writes the prompt cache that the concurrent requests read
+        results[names[0]] = summarize_view(names[0])
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {name: executor.submit(contextvars.copy_context().run, summarize_view, name) for name in names[1:]}
+        results.update((name, future.result()) for name, future in futures.items())
+
+    usage = {}
+    for _, view_usage in results.values():
+        for name, tokens in view_usage.items():
+            usage[name] = usage.get(name, 0) + tokens
+    logging.info(f"Summarized {len(names)} views: {usage.get('input_tokens', 0)} input tokens, "
+                 f"{usage.get('cache_read_input_tokens', 0)} read from and "
+                 f"{usage.get('cache_creation_input_tokens', 0)} written to the prompt cache, "
+                 f"{usage.get('output_tokens', 0)} output tokens")
+    return ViewSummaries({name: results[name][0] for name in names}, usage)
+
+
+def format_views(summaries):
+    """Returns the views as one document with a heading above each view."""
+    return "\n\n".join(f"{name}\n{summary.strip()}" for name, summary in summaries.items())
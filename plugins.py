@@ -0,0 +1,66 @@
+"""
+Registry of summarization providers and summary sinks, imported on first use.
+
+A plugin is registered by name with the "module:attribute" path of its factory, so the plugin's module, and the SDK
+it wraps (anthropic, openai, googleapiclient), is only imported when the plugin is first loaded.  The watcher and the
+CLIs choose plugins by name from configuration, so they start without importing backends they don't use.
+"""
+
+import importlib
+import threading
+
+PROVIDERS = "providers"  # factories returning a providers.SummaryProvider
+# factories taking a tenant's sink_options as keyword arguments and returning a started writer with
+# submit(title, summary) and close(), like DocsWriter
+SINKS = "sinks"
+
+_registry = {
+    PROVIDERS: {
+        "anthropic": "claude_summarizer:ClaudeProvider",
+        "openai": "summarize:OpenAIProvider",
+        "router": "router:SummaryRouter",
+    },
+    SINKS: {
+        "google_docs": "docs_writer:create_google_docs_writer",
+    },
+}
+_lock = threading.Lock()
+
+
+def register(kind, name, factory):
+    """
+    Registers a plugin, replacing any plugin of the same kind and name.
+    Args:
+        kind: PROVIDERS or SINKS.
+        name: The name the plugin is chosen by in configuration.
+        factory: The factory, or the "module:attribute" path to import it from when it is first loaded.
+    """
+    with _lock:
+        _registry[kind][name] = factory
+
+
+def names(kind):
+    """Returns the sorted names of the registered plugins of a kind."""
+    with _lock:
+        return sorted(_registry[kind])
+
+
+def load(kind, name):
+    """
+    Returns a plugin's factory, importing its module the first time.
+    Args:
+        kind: PROVIDERS or SINKS.
+        name: The plugin's name.
+    Returns:
+        The factory.
+    """
+    with _lock:
+        factory = _registry[kind].get(name)
+    if factory is None:
+        raise ValueError(f"Unknown {kind[:-1]} plugin: {name} (choose from {', '.join(names(kind))})")
+    if isinstance(factory, str):
+        module_name, _, attribute = factory.partition(":")
+        factory = getattr(importlib.import_module(module_name), attribute)
+        with _lock:
+            _registry[kind][name] = factory
+    return factory
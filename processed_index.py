@@ -0,0 +1,160 @@
+"""
+Persistent index of processed transcripts, used to backfill transcripts that arrived while the watcher was down.
+
+At startup the transcript directory is scanned with cheap stat calls.  Only files whose size or modification time
+changed since they were last recorded are hashed, so restarting on a directory with years of meetings takes seconds.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from summary_cache import STATE_DIRECTORY
+
+PROCESSED_INDEX_PATH = os.path.join(STATE_DIRECTORY, "processed_index.sqlite3")
+TRANSCRIPT_SUFFIXES = (".txt", ".vtt", ".srt")  # files considered transcripts when scanning
+BACKFILL_MAX_AGE_DAYS = 7  # older unprocessed transcripts are recorded as skipped instead of being summarized
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def file_hash(path):
+    """
+    Returns the SHA-256 hex digest of a file's contents, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_transcript_files(directory, suffixes=TRANSCRIPT_SUFFIXES):
+    """
+    Recursively yields (path, stat) for transcript files under directory using os.scandir.
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as e:
+        logging.warning(f"Unable to scan {directory}: {e}")
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_transcript_files(entry.path, suffixes)
+        elif entry.is_file() and entry.name.lower().endswith(suffixes):
+            yield entry.path, entry.stat()
+
+
+class ProcessedIndex:
+    """
+    SQLite table of transcripts with their size, mtime, content hash and processing status.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=PROCESSED_INDEX_PATH):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                                path TEXT PRIMARY KEY,
+                                size INTEGER NOT NULL,
+                                mtime_ns INTEGER NOT NULL,
+                                content_hash TEXT,
+                                status TEXT NOT NULL,
+                                updated REAL NOT NULL)""")
+        self._conn.commit()
+
+    def _record(self, path, stat, content_hash, status):
+        self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                           (path, stat.st_size, stat.st_mtime_ns, content_hash, status, time.time()))
+
+    def mark(self, path, status):
+        """
+        Records the current size, mtime and content hash of path along with its processing status.
+        Files that no longer exist are removed from the index.
+        """
+        try:
+            stat = os.stat(path)
+            content_hash = file_hash(path) if status == DONE else None
+        except FileNotFoundError:
+            with self._lock:
+                self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                self._conn.commit()
+            return
+        with self._lock:
+            self._record(path, stat, content_hash, status)
+            self._conn.commit()
+
+    def status(self, path):
+        """
+        Returns the recorded status of path, or None if it has never been seen.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM files WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def scan(self, directory, max_age_days=BACKFILL_MAX_AGE_DAYS):
+        """
+        Incrementally scans directory and returns the transcripts that are new, changed or previously failed.
+        Args:
+            directory: The directory to scan recursively.
+            max_age_days: Unprocessed transcripts older than this are recorded as skipped.  None backfills all.
+        Returns:
+            list: Paths of the transcripts that need processing.
+        """
+        started = time.monotonic()
+        cutoff = None if max_age_days is None else time.time() - max_age_days * 24 * 60 * 60
+        with self._lock:
+            known = {row[0]: row[1:] for row in
+                     self._conn.execute("SELECT path, size, mtime_ns, content_hash, status FROM files")}
+
+        # stat and hash files without the lock, so workers marking transcripts aren't held up by a large backfill
+        records = []  # (path, stat, content_hash, status, the row the decision was based on)
+        hashed = 0
+        for path, stat in iter_transcript_files(directory):
+            row = known.get(path, (None, None, None, None))
+            size, mtime_ns, content_hash, status = row
+            if status in (DONE, SKIPPED) and (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                continue  # unchanged since it was last recorded
+            if status == DONE:  # stat changed (e.g. the file was touched or copied), compare contents
+                hashed += 1
+                try:
+                    unchanged = file_hash(path) == content_hash
+                except FileNotFoundError:
+                    continue
+                if unchanged:
+                    records.append((path, stat, content_hash, DONE, row))
+                    continue
+            if status is None and cutoff is not None and stat.st_mtime < cutoff:
+                records.append((path, stat, None, SKIPPED, row))
+                continue
+            records.append((path, stat, None, PENDING, row))
+
+        needs_processing = []
+        with self._lock:
+            for path, stat, content_hash, status, row in records:
+                current = self._conn.execute("SELECT size, mtime_ns, content_hash, status FROM files WHERE path = ?",
+                                             (path,)).fetchone()
+                if (current or (None, None, None, None)) != row:  # marked by a worker since the scan started
+                    continue
+                self._record(path, stat, content_hash, status)
+                if status == PENDING:
+                    needs_processing.append(path)
+            self._conn.commit()
+
+        logging.info(f"Scanned {directory} in {time.monotonic() - started:.2f}s: {len(known)} known files, "
+                     f"{hashed} hashed, {len(needs_processing)} to process")
+        return needs_processing
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
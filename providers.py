@@ -0,0 +1,193 @@
+"""
+Long-lived, connection pooled LLM provider clients.
+
+Each backend is wrapped in a SummaryProvider that lazily builds one sync and one async SDK client on first use and
+keeps them for the life of the process, so HTTP keep-alive connections and TLS sessions are reused across requests
+and shared by every worker thread.  get_provider returns the shared instance for a backend, loading the backend's
+plugin (see plugins.py) on first use.
+"""
+
+import abc
+import threading
+
+from plugins import PROVIDERS, load
+from rate_limiter import LLMScheduler
+
+MAX_CONNECTIONS = 20  # pooled connections per client; should be at least the number of concurrent requests
+REQUEST_TIMEOUT = 600.0  # seconds; long transcripts can take minutes to summarize
+MAX_RETRIES = 0  # retries and backoff are handled by rate_limiter.LLMScheduler so throttling is seen by the scheduler
+
+_providers = {}
+_providers_lock = threading.RLock()  # reentrant: a provider plugin may be built from others, e.g. router
+
+
+def _http_limits():
+    import httpx  # imported with the first client, to keep startup fast
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+
+
+class SummaryProvider(abc.ABC):
+    """
+    Base class for a summarization backend with shared sync and async clients.  Every request is admitted through
+    the provider's LLMScheduler.  Subclasses implement create_client, create_async_client, _summarize, _asummarize,
+    _stream_summary and _summarize_view.  A backend with a batch API also sets supports_batches and implements
+    submit_batch and batch_results.
+    """
+    name = None
+    supports_batches = False  # whether submit_batch and batch_results are implemented
+    max_input_tokens = None  # the largest prompt the backend summarizes in one request
+    summary_role = None  # the backend's default instructions for a summary
+
+    def __init__(self, model, max_output_tokens=4096, scheduler=None):
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.scheduler = scheduler or LLMScheduler()
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The shared synchronous SDK client, created on first use."""
+        import httpx
+        with self._lock:
+            if self._client is None:
+                self._client = self.create_client(httpx.Client(limits=_http_limits(), timeout=REQUEST_TIMEOUT))
+            return self._client
+
+    @property
+    def async_client(self):
+        """
+        The shared asynchronous SDK client, created on first use.
+        Its connection pool belongs to the event loop it is first used on, so use it from a single event loop.
+        """
+        import httpx
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = self.create_async_client(
+                    httpx.AsyncClient(limits=_http_limits(), timeout=REQUEST_TIMEOUT))
+            return self._async_client
+
+    @abc.abstractmethod
+    def create_client(self, http_client):
+        """Returns the backend's synchronous SDK client, sending its requests through http_client."""
+
+    @abc.abstractmethod
+    def create_async_client(self, http_client):
+        """Returns the backend's asynchronous SDK client, sending its requests through http_client."""
+
+    def summarize(self, text, role=None):
+        """
+        Summarizes text, blocking until the summary is complete.
+        Args:
+            text (str): The text to summarize.
+            role (str): The instructions for the summary.  Defaults to the backend's DETAILED_SUMMARY_ROLE.
+        Returns:
+            str: The summary.
+        """
+        return self.scheduler.call(lambda: self._summarize(text, role), text, self.max_output_tokens)
+
+    async def asummarize(self, text, role=None):
+        """
+        Coroutine version of summarize.
+        """
+        return await self.scheduler.acall(lambda: self._asummarize(text, role), text, self.max_output_tokens)
+
+    def stream_summary(self, text, role=None, retry=True):
+        """
+        Summarizes text, yielding the summary in pieces as the model generates it.
+        Args:
+            text (str): The text to summarize.
+            role (str): The instructions for the summary.  Defaults to the backend's DETAILED_SUMMARY_ROLE.
+            retry (bool): Whether failures before the first piece are retried.  Pass False when the caller fails
+                over to another provider instead.
+        Returns:
+            generator: str pieces of the summary.
+        """
+        return self.scheduler.stream(lambda: self._stream_summary(text, role), text, self.max_output_tokens,
+                                     max_attempts=None if retry else 1)
+
+    def summarize_view(self, text, instructions, role=None):
+        """
+        Answers one request about a transcript, e.g. "List the action items".  The role and the transcript come first
+        in the prompt and the instructions last, so requests for several views of the same transcript share a prefix
+        the backend can cache.
+        Args:
+            text (str): The transcript.
+            instructions (str): What to produce from the transcript.
+            role (str): The instructions ahead of the transcript.  Defaults to the backend's DETAILED_SUMMARY_ROLE.
+        Returns:
+            tuple: The answer and a dict of the request's input_tokens (not read from the cache), output_tokens,
+            cache_read_input_tokens and cache_creation_input_tokens.
+        """
+        usage = {}
+
+        def request():  # the scheduler counts output tokens from the text it is handed
+            summary, usage["tokens"] = self._summarize_view(text, instructions, role)
+            return summary
+
+        return self.scheduler.call(request, text, self.max_output_tokens), usage["tokens"]
+
+    def submit_batch(self, requests):
+        """
+        Submits summarization requests to the backend's batch API, which processes them asynchronously at a lower
+        price and outside the per-minute rate limits.
+        Args:
+            requests: List of (custom_id, text, role) tuples.
+        Returns:
+            str: The batch id.
+        Raises:
+            NotImplementedError: If the backend has no batch API; check supports_batches first.
+        """
+        raise NotImplementedError(f"The {self.name} provider doesn't support batches")
+
+    def batch_results(self, batch_id):
+        """
+        Checks on a batch submitted with submit_batch.
+        Args:
+            batch_id (str): The batch id.
+        Returns:
+            dict: None while the batch is still processing, then a dict of custom_id to summary, with None for
+            requests that failed.
+        """
+        raise NotImplementedError(f"The {self.name} provider doesn't support batches")
+
+    @abc.abstractmethod
+    def _summarize(self, text, role):
+        """Makes one summary request; see summarize."""
+
+    @abc.abstractmethod
+    async def _asummarize(self, text, role):
+        """Coroutine version of _summarize."""
+
+    @abc.abstractmethod
+    def _stream_summary(self, text, role):
+        """Makes one streaming summary request; see stream_summary."""
+
+    @abc.abstractmethod
+    def _summarize_view(self, text, instructions, role):
+        """Makes one view request and returns the answer and its token usage; see summarize_view."""
+
+    def close(self):
+        """
+        Closes the sync client.  The async client is left to its event loop.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+def get_provider(name):
+    """
+    Returns the shared provider for a backend, creating it on first use.
+    Args:
+        name (str): The name of a provider plugin: "anthropic" for Claude, "openai" for OpenAI, or one added with
+            plugins.register(PROVIDERS, ...).
+    Returns:
+        SummaryProvider: The provider shared by all callers in this process.
+    """
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = load(PROVIDERS, name)()
+        return _providers[name]
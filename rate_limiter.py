@@ -0,0 +1,283 @@
+"""
+Token-budget-aware admission control for LLM requests.
+
+LLMScheduler estimates each request's input tokens from its length with a calibrated tokenizer.TokenCounter, without
+encoding it, and admits it through token buckets for requests per minute, input tokens per minute and output tokens
+per minute.  An AIMD concurrency limit is tuned from observed latency and errors, and rate limit / overload
+responses are retried with backoff via tenacity, honouring the provider's retry-after header.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from metrics import count, observe
+from tokenizer import get_token_counter
+
+MAX_ATTEMPTS = 6  # attempts per request, including the first
+MAX_BACKOFF_SECONDS = 60
+THROTTLE_STATUS_CODES = (429, 529)  # rate limited / overloaded: back off and halve concurrency
+RETRYABLE_STATUS_CODES = THROTTLE_STATUS_CODES + (408, 409, 500, 502, 503, 504)
+RETRYABLE_ERROR_NAMES = ("APIConnectionError", "APITimeoutError")  # SDK connection errors have no status code
+
+
+def is_throttle_error(exc):
+    return getattr(exc, "status_code", None) in THROTTLE_STATUS_CODES
+
+
+def is_retryable_error(exc):
+    return getattr(exc, "status_code", None) in RETRYABLE_STATUS_CODES or type(exc).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def _retry_after_seconds(exc):
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+_backoff = wait_random_exponential(multiplier=1, max=MAX_BACKOFF_SECONDS)
+
+
+def _wait(retry_state):
+    """Waits as long as the provider asked in retry-after, otherwise exponential backoff with jitter."""
+    retry_after = _retry_after_seconds(retry_state.outcome.exception())
+    return min(retry_after, MAX_BACKOFF_SECONDS) if retry_after is not None else _backoff(retry_state)
+
+
+def _log_retry(retry_state):
+    logging.warning(f"LLM request failed ({retry_state.outcome.exception()!r}), "
+                    f"retrying in {retry_state.next_action.sleep:.1f}s")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at per_minute tokens per minute, holding at most one minute of tokens.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount):
+        """
+        Blocks until amount tokens are available and removes them.  Returns the seconds spent waiting.
+        """
+        amount = min(amount, self.capacity)  # a request larger than the bucket waits for a full bucket
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def give_back(self, amount):
+        """Returns tokens that were reserved but not used."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def pause(self, seconds):
+        """Empties the bucket so no requests are admitted for roughly the given number of seconds."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Additive-increase/multiplicative-decrease limit on requests in flight.  The limit grows by about one per round
+    trip while latency stays near the best seen, shrinks when latency degrades, and halves on throttling.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, latency_tolerance=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._latency = None  # EWMA of seconds per 1k tokens
+        self._best_latency = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, tokens=None, error=None):
+        """
+        Frees a slot and adjusts the limit from the outcome of the request.
+        Args:
+            latency: Seconds the request took, if it succeeded.
+            tokens: Input plus output tokens of the request, used to normalize latency.
+            error: The exception the request failed with, if any.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if error is not None:
+                self.limit = max(self.minimum, self.limit * (0.5 if is_throttle_error(error) else 0.75))
+            elif latency is not None:
+                normalized = latency / max(tokens or 1, 1) * 1000
+                self._latency = normalized if self._latency is None else 0.8 * self._latency + 0.2 * normalized
+                self._best_latency = min(self._best_latency or self._latency, self._latency)
+                if self._latency > self.latency_tolerance * self._best_latency:
+                    self.limit = max(self.minimum, self.limit * 0.9)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class LLMScheduler:
+    """
+    Admits LLM requests within requests/tokens per minute budgets and an adaptive concurrency limit, retrying
+    throttled and transient failures with backoff.  Limits of None are not enforced.  For providers that budget
+    input and output tokens together, pass tokens_per_minute instead of the separate input and output limits.
+    Input tokens are budgeted with an upper bound estimate for model_name, so admission never encodes the prompt.
+    """
+
+    def __init__(self, requests_per_minute=None, input_tokens_per_minute=None, output_tokens_per_minute=None,
+                 tokens_per_minute=None, initial_concurrency=4, max_concurrency=32, max_attempts=MAX_ATTEMPTS,
+                 model_name="gpt-3.5-turbo"):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.input_tokens = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute else None
+        self.output_tokens = TokenBucket(output_tokens_per_minute) if output_tokens_per_minute else None
+        if tokens_per_minute:
+            self.input_tokens = self.output_tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimit(initial_concurrency, maximum=max_concurrency)
+        self.max_attempts = max_attempts
+        self.model_name = model_name
+
+    @property
+    def token_counter(self):
+        """The TokenCounter for the model, looked up on first use so creating a scheduler doesn't load an encoding."""
+        return get_token_counter(self.model_name)
+
+    def _retry_kwargs(self, max_attempts=None):
+        return {"retry": retry_if_exception(is_retryable_error), "wait": _wait,
+                "stop": stop_after_attempt(max_attempts or self.max_attempts), "before_sleep": _log_retry,
+                "reraise": True}
+
+    def _admit(self, input_tokens, max_output_tokens):
+        started = time.monotonic()
+        for bucket, amount in ((self.requests, 1), (self.input_tokens, input_tokens),
+                               (self.output_tokens, max_output_tokens)):
+            if bucket:
+                bucket.take(amount)
+        self.concurrency.acquire()
+        admitted = time.monotonic()
+        observe("rate_limit_wait", admitted - started)
+        if admitted - started > 1:
+            logging.info(f"LLM request waited {admitted - started:.1f}s for rate limit budget")
+        return admitted
+
+    def _finish(self, started, input_tokens, max_output_tokens, output_text=None, error=None):
+        observe("llm", time.monotonic() - started)
+        count("llm_requests")
+        if isinstance(error, (GeneratorExit, asyncio.CancelledError)):  # abandoned by the caller, not a failure
+            self.concurrency.release()
+            return
+        if error is not None:
+            self.concurrency.release(error=error)
+            if is_throttle_error(error) and self.requests:
+                retry_after = _retry_after_seconds(error)
+                self.requests.pause(1 if retry_after is None else retry_after)  # hold back every caller
+            return
+        output_tokens = self.token_counter.estimate(output_text) if output_text else 0
+        if self.output_tokens:
+            self.output_tokens.give_back(max(0, max_output_tokens - output_tokens))
+        self.concurrency.release(latency=time.monotonic() - started, tokens=input_tokens + output_tokens)
+
+    def call(self, fn, text, max_output_tokens):
+        """
+        Calls fn() once the request fits the budgets, retrying on rate limits and transient errors.
+        Args:
+            fn: Function making the request and returning the generated text.
+            text: The prompt text, used to estimate input tokens.
+            max_output_tokens: Output tokens reserved for the request.
+        Returns:
+            The result of fn().
+        """
+        input_tokens = self.token_counter.estimate(text, upper_bound=True)
+
+        def attempt():
+            started = self._admit(input_tokens, max_output_tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                self._finish(started, input_tokens, max_output_tokens, error=e)
+                raise
+            self._finish(started, input_tokens, max_output_tokens, output_text=result)
+            return result
+
+        return Retrying(**self._retry_kwargs())(attempt)
+
+    async def acall(self, coroutine_fn, text, max_output_tokens):
+        """
+        Coroutine version of call.  Waiting for budget happens on a worker thread so the event loop keeps running.
+        """
+        input_tokens = self.token_counter.estimate(text, upper_bound=True)
+
+        async def attempt():
+            started = await asyncio.to_thread(self._admit, input_tokens, max_output_tokens)
+            try:
+                result = await coroutine_fn()
+            except BaseException as e:
+                self._finish(started, input_tokens, max_output_tokens, error=e)
+                raise
+            self._finish(started, input_tokens, max_output_tokens, output_text=result)
+            return result
+
+        return await AsyncRetrying(**self._retry_kwargs())(attempt)
+
+    def stream(self, stream_fn, text, max_output_tokens, max_attempts=None):
+        """
+        Generator version of call for streamed responses.  Failures before the first piece arrives are retried;
+        the concurrency slot is held until the stream is finished.
+        Args:
+            stream_fn: Function starting the request and returning an iterator of str pieces.
+            max_attempts: Attempts to start the stream, including the first.  Defaults to the scheduler's max_attempts.
+        """
+        input_tokens = self.token_counter.estimate(text, upper_bound=True)
+
+        def start():
+            started = self._admit(input_tokens, max_output_tokens)
+            try:
+                pieces = iter(stream_fn())
+                first = next(pieces, None)
+            except Exception as e:
+                self._finish(started, input_tokens, max_output_tokens, error=e)
+                raise
+            observe("time_to_first_token", time.monotonic() - started)
+            return started, pieces, first
+
+        started, pieces, first = Retrying(**self._retry_kwargs(max_attempts))(start)
+        output = []
+        try:
+            if first is not None:
+                output.append(first)
+                yield first
+            for piece in pieces:
+                output.append(piece)
+                yield piece
+        except BaseException as e:
+            self._finish(started, input_tokens, max_output_tokens, error=e)
+            raise
+        self._finish(started, input_tokens, max_output_tokens, output_text="".join(output))
@@ -0,0 +1,113 @@
+"""
+Incremental (rolling) summarization of transcripts that grow while a meeting is in progress.
+
+For each transcript the byte offset read so far and a rolling summary of everything before it are kept in SQLite.
+When the file changes only the appended tail is read, and once enough new content has built up it is summarized
+together with the rolling summary, so each update costs about one summary plus the new content instead of the whole
+transcript.  When the file stops growing the last tail is merged and the rolling summary is the final summary.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from map_reduce_summarizer import COMBINE_SUMMARIES_ROLE, summarize_long_transcript
+from summary_cache import STATE_DIRECTORY
+from tokenizer import count_tokens
+
+ROLLING_SUMMARY_PATH = os.path.join(STATE_DIRECTORY, "rolling_summaries.sqlite3")
+UPDATE_SECONDS = 60.0  # a transcript that keeps growing is read at least this often
+MIN_DELTA_TOKENS = 1000  # new content is merged into the rolling summary once it has this many tokens
+FINALIZE_SECONDS = 30.0  # a transcript that hasn't changed for this long is finished and its summary saved
+ROLLING_SUMMARY_ROLE = """You are a professional assistant keeping a running summary of a Zoom meeting for an
+    executive while the meeting is in progress.  You are given the summary of the meeting so far and the next part
+    of the transcript.  Return the updated summary of the whole meeting: keep everything from the summary so far
+    that still matters, add new decisions, action items, owners, dates and key points, and note where people held
+    differing points of view.  Keep it concise and clear and do not mention that it was updated."""
+
+
+def read_tail(path, offset, complete_only=True):
+    """
+    Reads the text appended to a transcript since offset.
+    Args:
+        path: The path of the transcript file.
+        offset: The byte offset read so far.
+        complete_only: Stop after the last blank line, leaving a cue or turn that is still being written for later.
+    Returns:
+        tuple: (text, offset after the text)
+    """
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read()
+    if complete_only:
+        ends = [index + len(separator) for separator in (b"\n\n", b"\n\r\n")
+                if (index := data.rfind(separator)) >= 0]
+        data = data[:max(ends)] if ends else b""
+    return data.decode("utf-8-sig" if offset == 0 else "utf-8", errors="replace"), offset + len(data)
+
+
+def merge_delta(summary, delta, summarize_fn, single_pass_tokens):
+    """
+    Returns the rolling summary updated with a new part of the transcript.
+    Args:
+        summary (str): The rolling summary so far, or None for the first part.
+        delta (Transcript): The new part of the transcript.
+        summarize_fn: Backend function called as summarize_fn(text) or summarize_fn(text, role=...).
+        single_pass_tokens (int): The most tokens the backend summarizes in one request.
+    Returns:
+        str: The updated summary.
+    """
+    if summary is None:
+        return summarize_long_transcript(delta, summarize_fn, single_pass_tokens=single_pass_tokens)
+    if count_tokens(summary) + delta.token_count() <= single_pass_tokens:
+        text = f"Summary of the meeting so far:\n{summary}\n\nNext part of the transcript:\n{delta.text()}"
+        return summarize_fn(text, role=ROLLING_SUMMARY_ROLE)
+    # a long gap between updates (e.g. the watcher was down): summarize the new part by itself, then combine
+    delta_summary = summarize_long_transcript(delta, summarize_fn, single_pass_tokens=single_pass_tokens)
+    return summarize_fn(f"{summary}\n\n{delta_summary}", role=COMBINE_SUMMARIES_ROLE)
+
+
+def is_finished(path, finalize_seconds=FINALIZE_SECONDS):
+    """Returns True if the transcript hasn't changed for finalize_seconds."""
+    return time.time() - os.path.getmtime(path) >= finalize_seconds
+
+
+class RollingSummaryStore:
+    """
+    SQLite table of the rolling summary of each transcript and the byte offset it covers.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=ROLLING_SUMMARY_PATH):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS rolling_summaries (
+                                path TEXT PRIMARY KEY,
+                                offset INTEGER NOT NULL,
+                                summary TEXT,
+                                updated REAL NOT NULL)""")
+        self._conn.commit()
+
+    def get(self, path):
+        """
+        Returns (offset, summary) for a transcript, or (0, None) if nothing has been summarized yet.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT offset, summary FROM rolling_summaries WHERE path = ?",
+                                     (path,)).fetchone()
+        return row if row else (0, None)
+
+    def put(self, path, offset, summary):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO rolling_summaries VALUES (?, ?, ?, ?)",
+                               (path, offset, summary, time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
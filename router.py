@@ -0,0 +1,268 @@
+"""
+Size-aware, hedged routing of summary requests across providers.
+
+A SummaryRouter sends each request to the provider expected to start answering soonest.  It only considers providers
+whose context window fits the prompt, skips those that have failed often recently, and ranks the rest by their recent
+median time to first token for prompts of about that size.  If the first piece of the summary hasn't arrived by the
+HEDGE_PERCENTILE time to first token seen from that provider at that size, the request is also sent to the next
+provider.  Whichever answers first is used and the other is cancelled.  A provider that fails before its first piece
+is hedged at once: while another provider is left to try, requests are sent without the scheduler's retries, so a
+throttled or failing provider hands over to the next instead of backing off.  This bounds tail latency while a
+provider is slow or overloaded, at the cost of sending roughly 1 - HEDGE_PERCENTILE of prompts twice while latency is
+steady.
+
+Each provider's stream is read on its own thread.  A cancelled stream is closed at its next piece.  A request still
+waiting for its first piece can't be interrupted through the sync SDK clients, so it is closed when its first piece
+arrives.  Choose the router with SUMMARY_PROVIDER=router.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import logging
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import count
+from providers import get_provider
+from tokenizer import estimate_tokens
+
+ROUTES = ("anthropic", "openai")  # provider plugins to route between, in order of preference when latency is equal
+SIZE_BUCKETS = (4000, 16000, 64000)  # prompt token boundaries; latency is tracked separately for each size range
+HEDGE_PERCENTILE = 0.95  # hedge once the first piece is later than this percentile of recent times to first token
+MIN_SAMPLES = 10  # times to first token needed, per provider and size, before the percentile sets the deadline
+DEFAULT_HEDGE_SECONDS = 30.0  # hedge deadline until then
+MIN_HEDGE_SECONDS = 1.0
+MAX_SAMPLES = 200  # recent times to first token kept per provider and size
+MAX_ERROR_RATE = 0.5  # providers failing more often than this are only used as a hedge
+ERROR_RATE_DECAY = 0.9  # weight of the previous error rate in its moving average
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class ProviderStats:
+    """
+    Recent times to first token, by prompt size, and the moving average error rate of one provider.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.time_to_first_token = [deque(maxlen=max_samples) for _ in range(len(SIZE_BUCKETS) + 1)]
+        self.error_rate = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def size_bucket(tokens):
+        return bisect.bisect(SIZE_BUCKETS, tokens)
+
+    def record(self, bucket, time_to_first_token=None, error=False):
+        """Records a request that produced its first piece after time_to_first_token seconds, or failed."""
+        with self._lock:
+            self.error_rate = ERROR_RATE_DECAY * self.error_rate + (1 - ERROR_RATE_DECAY) * error
+            if time_to_first_token is not None:
+                self.time_to_first_token[bucket].append(time_to_first_token)
+
+    def percentile(self, bucket, fraction, min_samples=1):
+        """Returns the percentile of recent times to first token, or None with fewer than min_samples."""
+        with self._lock:
+            samples = list(self.time_to_first_token[bucket])
+        return percentile(samples, fraction) if len(samples) >= max(min_samples, 1) else None
+
+
+class _Attempt:
+    """
+    One provider's stream of a routed request, read on its own thread into the router's event queue as
+    (attempt, kind, value) tuples, where kind is "piece", "end" or "error".
+    """
+
+    def __init__(self, provider, stats, bucket, events):
+        self.provider = provider
+        self.stats = stats
+        self.bucket = bucket
+        self.events = events
+        self.cancelled = threading.Event()
+        self.started = None
+
+    def start(self, text, role, retry):
+        self.started = time.monotonic()
+        # the job's metrics context follows the request, so both attempts' tokens are counted against the job
+        threading.Thread(target=contextvars.copy_context().run, args=(self._run, text, role, retry),
+                         name=f"summary-{self.provider.name}", daemon=True).start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _run(self, text, role, retry):
+        stream = self.provider.stream_summary(text, role, retry=retry)
+        first = True
+        try:
+            for piece in stream:
+                if first:
+                    first = False
+                    self.stats.record(self.bucket, time_to_first_token=time.monotonic() - self.started)
+                if self.cancelled.is_set():
+                    break
+                self.events.put((self, "piece", piece))
+            else:
+                self.events.put((self, "end", None))
+        except Exception as e:
+            if first and not self.cancelled.is_set():
+                self.stats.record(self.bucket, error=True)
+            self.events.put((self, "error", e))
+        finally:
+            stream.close()
+
+
+class SummaryRouter:
+    """
+    Routes summary requests to the provider expected to answer first, hedging slow requests to the next provider.
+    Has the SummaryProvider interface the pipeline uses, so it can stand in for a provider.
+    """
+    name = "router"
+
+    def __init__(self, providers=None, hedge_percentile=HEDGE_PERCENTILE, default_hedge_seconds=DEFAULT_HEDGE_SECONDS,
+                 min_hedge_seconds=MIN_HEDGE_SECONDS, min_samples=MIN_SAMPLES):
+        """
+        Args:
+            providers: SummaryProviders to route between, in order of preference.  Defaults to the ROUTES plugins.
+            hedge_percentile: Percentile of recent times to first token after which a request is hedged.
+            default_hedge_seconds: Hedge deadline until a provider has min_samples times to first token for the size.
+            min_hedge_seconds: The shortest hedge deadline.
+            min_samples: Times to first token needed before the percentile sets the deadline.
+        """
+        self.providers = list(providers) if providers is not None else [get_provider(name) for name in ROUTES]
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_seconds = default_hedge_seconds
+        self.min_hedge_seconds = min_hedge_seconds
+        self.min_samples = min_samples
+        self.stats = {provider.name: ProviderStats() for provider in self.providers}
+        self.model = ",".join(f"{provider.name}:{provider.model}" for provider in self.providers)
+        self.max_input_tokens = max(provider.max_input_tokens for provider in self.providers)
+        self.max_output_tokens = self.providers[0].max_output_tokens
+        self.summary_role = self.providers[0].summary_role
+        self.supports_batches = self.providers[0].supports_batches  # batches go to the first provider
+
+    def candidates(self, tokens):
+        """
+        Returns the providers to try for a prompt of the given size, best first.
+        """
+        bucket = ProviderStats.size_bucket(tokens)
+        fitting = [p for p in self.providers if tokens <= p.max_input_tokens]
+        if not fitting:  # the largest window fails the request as a single provider would
+            fitting = [max(self.providers, key=lambda p: p.max_input_tokens)]
+
+        def rank(provider):
+            stats = self.stats[provider.name]
+            median = stats.percentile(bucket, 0.5)
+            # a provider without samples for this size ranks first, so every provider gets measured
+            return stats.error_rate > MAX_ERROR_RATE, median or 0.0, self.providers.index(provider)
+
+        return sorted(fitting, key=rank)
+
+    def hedge_seconds(self, provider, bucket):
+        """Returns how long to wait for a provider's first piece before hedging."""
+        deadline = self.stats[provider.name].percentile(bucket, self.hedge_percentile, self.min_samples)
+        return self.default_hedge_seconds if deadline is None else max(self.min_hedge_seconds, deadline)
+
+    def stream_summary(self, text, role=None):
+        """
+        Summarizes text with the best provider, hedging to the next one if its first piece is late or it fails.
+        Args:
+            text (str): The text to summarize.
+            role (str): The instructions for the summary.  Defaults to each provider's own DETAILED_SUMMARY_ROLE.
+        Returns:
+            generator: str pieces of the summary, all from the provider that answered first.
+        """
+        tokens = estimate_tokens(text)
+        bucket = ProviderStats.size_bucket(tokens)
+        candidates = self.candidates(tokens)
+        events = queue.Queue()
+        attempts = []
+
+        def launch():
+            provider = candidates[len(attempts)]
+            last = len(attempts) == len(candidates) - 1  # only the last provider left retries its own failures
+            attempts.append(_Attempt(provider, self.stats[provider.name], bucket, events).start(text, role, last))
+            return time.monotonic() + self.hedge_seconds(provider, bucket)
+
+        hedge_at = launch()
+        winner = None
+        failed = 0
+        try:
+            while True:
+                hedging = winner is None and len(attempts) < len(candidates)
+                try:
+                    attempt, kind, value = events.get(timeout=max(0.0, hedge_at - time.monotonic()) if hedging
+                                                      else None)
+                except queue.Empty:
+                    logging.warning(f"No summary from {attempts[-1].provider.name} after "
+                                    f"{time.monotonic() - attempts[-1].started:.1f}s, "
+                                    f"hedging with {candidates[len(attempts)].name}")
+                    count("hedged_requests")
+                    hedge_at = launch()
+                    continue
+                if winner is None and kind != "error":
+                    winner = attempt
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancel()
+                    if winner is not attempts[0]:
+                        logging.info(f"Hedged request to {winner.provider.name} answered first")
+                        count("hedge_wins")
+                if winner is None:  # failed before any provider answered
+                    failed += 1
+                    if len(attempts) < len(candidates):
+                        logging.warning(f"Summary from {attempt.provider.name} failed ({value!r}), "
+                                        f"trying {candidates[len(attempts)].name}")
+                        count("hedged_requests")
+                        hedge_at = launch()
+                    elif failed == len(attempts):
+                        raise value
+                    continue
+                if attempt is not winner:
+                    continue
+                if kind == "piece":
+                    yield value
+                elif kind == "end":
+                    return
+                else:
+                    raise value
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def summarize(self, text, role=None):
+        """
+        Summarizes text, blocking until the summary is complete.  Hedged like stream_summary.
+        """
+        return "".join(self.stream_summary(text, role))
+
+    async def asummarize(self, text, role=None):
+        """
+        Coroutine version of summarize.
+        """
+        return await asyncio.to_thread(self.summarize, text, role)
+
+    def summarize_view(self, text, instructions, role=None):
+        """
+        Answers one request about a transcript with the best provider for its size.  Views aren't hedged, so every
+        view of a meeting goes to the provider holding its cached transcript prefix.
+        """
+        return self.candidates(estimate_tokens(text))[0].summarize_view(text, instructions, role)
+
+    def submit_batch(self, requests):
+        """
+        Submits requests to the first provider's batch API.  Batches aren't latency sensitive, so they aren't routed.
+        """
+        return self.providers[0].submit_batch(requests)
+
+    def batch_results(self, batch_id):
+        return self.providers[0].batch_results(batch_id)
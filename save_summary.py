@@ -1,42 +1,174 @@
 import logging
 import os
+import time
 from datetime import datetime
 
-from tokenizer import count_tokens, count_words
+from metrics import observe
+from tokenizer import count_words, estimate_tokens
 
+GOOGLE_DOC_FLUSH_CHARS = 2000  # streamed text is appended to the Google Doc in batches of about this size
+GOOGLE_DOC_FLUSH_SECONDS = 2.0  # ...or at least this often while text is arriving
+# appended to a Google Doc whose summary failed partway through, since the Docs scope can't delete it
+INCOMPLETE_SUMMARY_NOTE = "\n\n[Incomplete: the summary failed while it was being written and will be retried.]"
 
-def save_google_doc(service, summary, transcript_file):
+
+def summary_title(transcript_file):
+    """
+    Returns the title for a transcript's summary: the meeting name (last directory of the file path) and the time.
+    """
     formatted_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    last_directory = os.path.basename(os.path.dirname(transcript_file))
-    doc_title = f"{last_directory}_{formatted_date}"
-    # Create a new Google Doc
-    document = service.documents().create(body={'title': doc_title}).execute()
-    doc_id = document.get('documentId')
-    # Insert the summary text into the document
-    requests = [
-        {'insertText': {'location': {'index': 1}, 'text': summary}}
-    ]
-    service.documents().batchUpdate(documentId=doc_id, body={'requests': requests}).execute()
-    logging.info(f"Summary written to Google Docs: {doc_title}")
+    last_directory = os.path.basename(os.path.dirname(transcript_file))  # last directory of file path is meeting name
+    return f"{last_directory}_{formatted_date}"
+
+
+class GoogleDocWriter:
+    """
+    Writes a summary into a new Google Doc, batching appended text into insertText requests.
+    The document is created when the first batch is written.
+    """
 
+    def __init__(self, service, transcript_file, flush_chars=GOOGLE_DOC_FLUSH_CHARS,
+                 flush_seconds=GOOGLE_DOC_FLUSH_SECONDS):
+        self.service = service
+        self.doc_title = summary_title(transcript_file)
+        self.doc_id = None
+        self.flush_chars = flush_chars
+        self.flush_seconds = flush_seconds
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
 
-def format_and_save_summary(summary, transcript_file):
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        if self._buffered_chars >= self.flush_chars or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self.doc_id is None:
+            # Create a new Google Doc
+            document = self.service.documents().create(body={'title': self.doc_title}).execute()
+            self.doc_id = document.get('documentId')
+        # Append the buffered text to the end of the document
+        requests = [
+            {'insertText': {'endOfSegmentLocation': {}, 'text': ''.join(self._buffer)}}
+        ]
+        self.service.documents().batchUpdate(documentId=self.doc_id, body={'requests': requests}).execute()
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        logging.info(f"Summary written to Google Docs: {self.doc_title}")
+
+    def abort(self):
+        """Marks a partly written document as incomplete.  A document that hasn't been created yet never is."""
+        if self.doc_id is None:
+            self._buffer = []
+            return
+        self._buffer.append(INCOMPLETE_SUMMARY_NOTE)
+        self.flush()
+        logging.warning(f"Marked incomplete Google Doc {self.doc_title}")
+
+
+class SummaryFileWriter:
+    """
+    Writes a summary to a local file in save_to_path (default SAVE_TO_PATH).  The text goes to path + ".partial",
+    flushing each piece so readers see it immediately, and the file is renamed to path once it is complete.
+    """
+
+    def __init__(self, transcript_file, save_to_path=None):
+        filename = f"{summary_title(transcript_file)}.txt"
+        directory = os.path.expanduser(save_to_path or SAVE_TO_PATH)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, filename)
+        self.partial_path = self.path + ".partial"
+        self._file = open(self.partial_path, 'w')
+
+    def write(self, text):
+        started = time.perf_counter()
+        self._file.write(text)
+        self._file.flush()
+        observe("local_save", time.perf_counter() - started)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+        logging.info(f"Summary written to {self.path}")
+
+    def abort(self):
+        """Removes the partly written file."""
+        self._file.close()
+        os.unlink(self.partial_path)
+
+
+def save_google_doc(service, summary, transcript_file):
+    writer = GoogleDocWriter(service, transcript_file, flush_chars=len(summary) + 1)  # one insert for the summary
+    writer.write(summary)
+    writer.close()
+
+
+def format_and_save_summary(summary, transcript_file, save_to_path=None):
     """
     Formats the summary and saves it to a file.
     Args:
         summary: The summary text to be formatted and saved.
         transcript_file: The path to the original transcript file for reference.
+        save_to_path: The directory to save it in.  Defaults to SAVE_TO_PATH.
     """
-    logging.info(f"summary size {count_tokens(summary)} tokens, {count_words(summary)} words")
-    formatted_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    last_directory = os.path.basename(
-        os.path.dirname(transcript_file))  # last directory of file path is meeting name
-    filename = f"{last_directory}_{formatted_date}.txt"
-    save_to_path = os.path.join(os.path.expanduser(SAVE_TO_PATH), filename)
-    with open(save_to_path, 'w') as file:
-        file.write(summary)
-    logging.info(f"Summary written to {save_to_path}")
+    logging.info(f"summary size {count_words(summary)} words")
+    writer = SummaryFileWriter(transcript_file, save_to_path)
+    writer.write(summary)
+    writer.close()
     logging.info(summary)
 
 
-SAVE_TO_PATH = "~/Documents/Zoom_Summaries"  # this is where summaries will be saved to local machine
\ No newline at end of file
+def stream_and_save_summary(summary_pieces, transcript_file, service=None, docs_writer=None, save_to_path=None):
+    """
+    Writes a summary to the local file and, if service or docs_writer is given, a Google Doc while it is being
+    generated.
+    Args:
+        summary_pieces: Iterable of str pieces of the summary, e.g. SummaryProvider.stream_summary(...).
+        transcript_file: The path to the original transcript file for reference.
+        service: Google Docs service to write to directly from this thread.
+        docs_writer: docs_writer.DocsWriter to write the Google Doc in the background instead.
+        save_to_path: The directory to save the local file in.  Defaults to SAVE_TO_PATH.
+    Returns:
+        tuple: The full summary text and the seconds until the first piece arrived (None if the summary is empty).
+    """
+    started = time.monotonic()
+    time_to_first_token = None
+    pieces = []
+    writers = [SummaryFileWriter(transcript_file, save_to_path)]
+    if docs_writer:
+        writers.append(docs_writer.open_document(summary_title(transcript_file)))
+    elif service:
+        writers.append(GoogleDocWriter(service, transcript_file))
+    try:
+        for piece in summary_pieces:
+            if time_to_first_token is None:
+                time_to_first_token = time.monotonic() - started
+                logging.info(f"First summary token after {time_to_first_token:.2f}s")
+            pieces.append(piece)
+            for writer in writers:
+                writer.write(piece)
+    except BaseException:  # don't leave a truncated summary that looks finished; the job is retried
+        for writer in writers:
+            try:
+                writer.abort()
+            except Exception:
+                logging.exception("Unable to discard the incomplete summary")
+        raise
+    for writer in writers:
+        writer.close()
+    summary = ''.join(pieces)
+    # this stream's own output, estimated as the scheduler does; the job's counters also hold its other requests
+    logging.info(f"summary size ~{estimate_tokens(summary)} tokens, {count_words(summary)} words, "
+                 f"streamed in {time.monotonic() - started:.2f}s")
+    return summary, time_to_first_token
+
+
+SAVE_TO_PATH = "~/Documents/Zoom_Summaries"  # this is where summaries will be saved to local machine
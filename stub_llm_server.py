@@ -0,0 +1,307 @@
+"""
+Local stand-in for the Anthropic Messages and OpenAI Chat Completions APIs, used for benchmarks and offline tests.
+
+Both endpoints support regular and streamed (server-sent events) responses with configurable time to first token
+and per-piece delay, and report prompt cache reads and writes for repeated prompt prefixes.  Both batch APIs
+(Anthropic Message Batches, and OpenAI Files and Batches) are served with batches that end after a configurable
+delay.  Point the SDKs at it with ANTHROPIC_BASE_URL=server.url and
+OPENAI_BASE_URL=server.url + "v1".
+"""
+
+import itertools
+import json
+import re
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUMMARY_WORDS = ("The team agreed to ship the release on Friday. Emily owns the DNA extraction report, Alex will "
+                 "benchmark the sequencer upgrade, and Li raised concerns about the gene editing timeline.").split()
+OPENAI_MIN_CACHED_TOKENS = 1024  # OpenAI only caches prompts at least this long
+
+
+def _input_tokens(body):
+    prompt = json.dumps(body.get("messages", [])) + json.dumps(body.get("system", ""))
+    return len(prompt) // 4  # rough estimate; the stub doesn't tokenize
+
+
+def _cached_prefix(body):
+    """Returns the Anthropic system blocks up to the last one marked with cache_control, or None."""
+    system = body.get("system")
+    marked = [index for index, block in enumerate(system) if block.get("cache_control")] \
+        if isinstance(system, list) else []
+    return json.dumps(system[:marked[-1] + 1]) if marked else None
+
+
+def anthropic_message(body, pieces):
+    """Returns an Anthropic Messages API response for a request body."""
+    return {"id": "msg_stub", "type": "message", "role": "assistant", "model": body.get("model"),
+            "content": [{"type": "text", "text": "".join(pieces)}], "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": _input_tokens(body), "output_tokens": len(pieces)}}
+
+
+def openai_completion(body, pieces):
+    """Returns an OpenAI Chat Completions API response for a request body."""
+    input_tokens = _input_tokens(body)
+    return {"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": len(pieces),
+                      "total_tokens": input_tokens + len(pieces)},
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "".join(pieces)}}]}
+
+
+class StubLLMServer:
+    """
+    Minimal Anthropic and OpenAI compatible LLM server running on a background thread.
+    Args:
+        latency: Seconds before the first token (or the whole response, when not streaming).
+        piece_delay: Seconds between streamed pieces.
+        summary_words: Number of words in every generated summary.
+        batch_seconds: Seconds from a batch being submitted until it has ended.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, piece_delay=0.0, summary_words=200, batch_seconds=0.0):
+        self.latency = latency
+        self.piece_delay = piece_delay
+        self.summary_words = summary_words
+        self.batch_seconds = batch_seconds
+        self.requests = 0
+        self.batch_requests = 0  # requests submitted through the batch APIs
+        self.batches = {}  # batch id -> {"created": time, "results": JSONL lines, "requests": count}
+        self.files = {}  # OpenAI file id -> content
+        self.cached_prefixes = set()  # prompt prefixes seen so far, for prompt cache usage
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="stub-llm-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def summary_pieces(self):
+        words = itertools.islice(itertools.cycle(SUMMARY_WORDS), self.summary_words)
+        return [word + " " for word in words]
+
+    def _prompt_cache(self, prefix):
+        """Returns True if an earlier request cached prefix, caching it otherwise."""
+        with self._lock:
+            hit = prefix in self.cached_prefixes
+            self.cached_prefixes.add(prefix)
+        return hit
+
+    def _add_batch(self, prefix, results):
+        with self._lock:
+            batch_id = f"{prefix}_{next(self._ids)}"
+            self.batch_requests += len(results)
+            self.batches[batch_id] = {"created": time.time(), "results": results, "requests": len(results)}
+        return batch_id
+
+    def _batch_ended(self, batch_id):
+        return time.time() >= self.batches[batch_id]["created"] + self.batch_seconds
+
+    def _anthropic_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        ended = self._batch_ended(batch_id)
+        counts = {"processing": 0 if ended else batch["requests"], "succeeded": batch["requests"] if ended else 0,
+                  "errored": 0, "canceled": 0, "expired": 0}
+        return {"id": batch_id, "type": "message_batch", "processing_status": "ended" if ended else "in_progress",
+                "request_counts": counts, "created_at": batch["created"],
+                "results_url": f"{self.url}v1/messages/batches/{batch_id}/results" if ended else None}
+
+    def _openai_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        ended = self._batch_ended(batch_id)
+        return {"id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions", "completion_window": "24h",
+                "input_file_id": batch["input_file_id"], "created_at": int(batch["created"]),
+                "status": "completed" if ended else "in_progress",
+                "output_file_id": batch["output_file_id"] if ended else None, "error_file_id": None,
+                "request_counts": {"total": batch["requests"], "completed": batch["requests"] if ended else 0,
+                                   "failed": 0}}
+
+    def _file(self, file_id, purpose):
+        return {"id": file_id, "object": "file", "bytes": len(self.files[file_id]), "created_at": int(time.time()),
+                "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed"}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, response):
+                payload = json.dumps(response).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_events(self, events):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for index, event in enumerate(events):
+                    if index and server.piece_delay:
+                        time.sleep(server.piece_delay)
+                    data = event.encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _send_text(self, text):
+                payload = text.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/binary")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.startswith("/v1/messages/batches"):
+                    self._create_anthropic_batch(json.loads(payload))
+                    return
+                if self.path.startswith("/v1/files"):
+                    self._upload_file(payload)
+                    return
+                if self.path.startswith("/v1/batches"):
+                    self._create_openai_batch(json.loads(payload))
+                    return
+                with server._lock:
+                    server.requests += 1
+                body = json.loads(payload or b"{}")
+                pieces = server.summary_pieces()
+                if server.latency:
+                    time.sleep(server.latency)
+                if self.path.startswith("/v1/messages"):
+                    self._anthropic(body, pieces)
+                elif self.path.startswith("/v1/chat/completions"):
+                    self._openai(body, pieces)
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                match = re.fullmatch(r"/v1/(messages/batches|batches|files)/([\w-]+)(/results|/content)?", path)
+                if not match or (match.group(1) == "files") != (match.group(3) == "/content"):
+                    self.send_error(404)
+                    return
+                kind, object_id, suffix = match.groups()
+                if kind == "files":
+                    self._send_text(server.files[object_id])
+                elif object_id not in server.batches:
+                    self.send_error(404)
+                elif suffix == "/results":
+                    self._send_text("\n".join(server.batches[object_id]["results"]) + "\n")
+                elif kind == "batches":
+                    self._send_json(server._openai_batch(object_id))
+                else:
+                    self._send_json(server._anthropic_batch(object_id))
+
+            def _create_anthropic_batch(self, body):
+                results = [json.dumps({"custom_id": request["custom_id"], "result": {
+                    "type": "succeeded", "message": anthropic_message(request["params"], server.summary_pieces())}})
+                    for request in body["requests"]]
+                self._send_json(server._anthropic_batch(server._add_batch("msgbatch", results)))
+
+            def _upload_file(self, payload):
+                headers = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+                form = {part.get_param("name", header="Content-Disposition"): part.get_payload(decode=True)
+                        for part in BytesParser().parsebytes(headers + payload).get_payload()}
+                with server._lock:
+                    file_id = f"file-{next(server._ids)}"
+                    server.files[file_id] = form["file"].decode("utf-8")
+                self._send_json(server._file(file_id, form["purpose"].decode("utf-8")))
+
+            def _create_openai_batch(self, body):
+                requests = [json.loads(line) for line in server.files[body["input_file_id"]].splitlines() if line]
+                results = [json.dumps({"id": f"batch_req_{index}", "custom_id": request["custom_id"], "error": None,
+                                       "response": {"status_code": 200, "request_id": f"req_{index}",
+                                                    "body": openai_completion(request["body"],
+                                                                              server.summary_pieces())}})
+                           for index, request in enumerate(requests)]
+                with server._lock:
+                    output_file_id = f"file-{next(server._ids)}"
+                    server.files[output_file_id] = "\n".join(results) + "\n"
+                batch_id = server._add_batch("batch", results)
+                server.batches[batch_id].update(input_file_id=body["input_file_id"], output_file_id=output_file_id)
+                self._send_json(server._openai_batch(batch_id))
+
+            def _anthropic(self, body, pieces):
+                message = anthropic_message(body, pieces)
+                usage = message["usage"]
+                prefix = _cached_prefix(body)
+                if prefix:
+                    tokens = min(len(prefix) // 4, usage["input_tokens"])
+                    usage["input_tokens"] -= tokens
+                    usage["cache_read_input_tokens" if server._prompt_cache(prefix) else
+                          "cache_creation_input_tokens"] = tokens
+                if not body.get("stream"):
+                    self._send_json(message)
+                    return
+
+                def event(name, data):
+                    return f"event: {name}\ndata: {json.dumps(dict(data, type=name))}\n\n"
+
+                start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=0))
+                events = [event("message_start", {"message": start}),
+                          event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})]
+                events += [event("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": piece}})
+                           for piece in pieces]
+                events += [event("content_block_stop", {"index": 0}),
+                           event("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                                   "usage": {"output_tokens": len(pieces)}}),
+                           event("message_stop", {})]
+                self._send_events(events)
+
+            def _openai(self, body, pieces):
+                completion = openai_completion(body, pieces)
+                usage, created = completion["usage"], completion["created"]
+                prefix = json.dumps(body.get("messages", [])[:1])
+                if len(prefix) // 4 >= OPENAI_MIN_CACHED_TOKENS:  # OpenAI caches long prompt prefixes automatically
+                    cached = len(prefix) // 4 if server._prompt_cache(prefix) else 0
+                    usage["prompt_tokens_details"] = {"cached_tokens": cached}
+                if not body.get("stream"):
+                    self._send_json(completion)
+                    return
+
+                def chunk(delta, finish_reason=None):
+                    data = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                            "model": body.get("model"),
+                            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                    return f"data: {json.dumps(data)}\n\n"
+
+                events = [chunk({"role": "assistant", "content": ""})]
+                events += [chunk({"content": piece}) for piece in pieces]
+                events.append(chunk({}, "stop"))
+                if body.get("stream_options", {}).get("include_usage"):
+                    events.append(f"data: {json.dumps(dict(json.loads(chunk({})[6:]), choices=[], usage=usage))}\n\n")
+                events.append("data: [DONE]\n\n")
+                self._send_events(events)
+
+            def log_message(self, format, *args):
+                pass  # keep test and benchmark output quiet
+
+        return Handler
+
+
+if __name__ == "__main__":
+    stub_server = StubLLMServer().start()
+    print(f"Stub LLM API listening on {stub_server.url}")
+    try:
+        while True:
+            time.sleep(10)
+    except KeyboardInterrupt:
+        stub_server.stop()
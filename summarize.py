@@ -1,40 +1,151 @@
+import json
 import logging
+import os
 
-import openai
+from openai import AsyncOpenAI, OpenAI
+
+from metrics import count
+from providers import MAX_RETRIES, SummaryProvider, get_provider
+from rate_limiter import LLMScheduler
+from tokenizer import count_words
+
+
+def _api_key():
+    openai_api_key = os.environ.get("OPENAI_API_KEY", None)
+    if openai_api_key is None:
+        raise KeyError("Open AI key not found in environment variable")
+    return openai_api_key
+
+
+class OpenAIProvider(SummaryProvider):
+    """
+    OpenAI backend with pooled sync and async OpenAI clients.
+    """
+    name = "openai"
+    supports_batches = True
+
+    def __init__(self, model=None, max_output_tokens=4096):
+        super().__init__(model or MODEL_NAME, max_output_tokens,
+                         LLMScheduler(REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                                      model_name=model or MODEL_NAME))
+        self.max_input_tokens = MAX_TOKENS
+        self.summary_role = DETAILED_SUMMARY_ROLE
+
+    def create_client(self, http_client):
+        return OpenAI(api_key=_api_key(), http_client=http_client, max_retries=MAX_RETRIES)
+
+    def create_async_client(self, http_client):
+        return AsyncOpenAI(api_key=_api_key(), http_client=http_client, max_retries=MAX_RETRIES)
+
+    def _request(self, text, role):
+        return {
+            "model": self.model,
+            "max_tokens": self.max_output_tokens,
+            "messages": [
+                {"role": "system", "content": role or DETAILED_SUMMARY_ROLE},
+                {"role": "user", "content": text},
+            ],
+        }
+
+    def _view_request(self, text, instructions, role):
+        # OpenAI caches long prompt prefixes automatically, so the role and transcript go first
+        return {
+            "model": self.model,
+            "max_tokens": self.max_output_tokens,
+            "messages": [
+                {"role": "system", "content": f"{role or DETAILED_SUMMARY_ROLE}\n\n{text}"},
+                {"role": "user", "content": instructions},
+            ],
+        }
+
+    def _summarize(self, text, role):
+        response = self.client.chat.completions.create(**self._request(text, role))
+        _record_usage(response.usage)
+        return response.choices[0].message.content.strip()
+
+    async def _asummarize(self, text, role):
+        response = await self.async_client.chat.completions.create(**self._request(text, role))
+        _record_usage(response.usage)
+        return response.choices[0].message.content.strip()
+
+    def _stream_summary(self, text, role):
+        stream = self.client.chat.completions.create(stream=True, stream_options={"include_usage": True},
+                                                     **self._request(text, role))
+        try:
+            for chunk in stream:
+                if chunk.usage:  # the last chunk carries the usage for the whole response
+                    _record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
+    def _summarize_view(self, text, instructions, role):
+        response = self.client.chat.completions.create(**self._view_request(text, instructions, role))
+        return response.choices[0].message.content.strip(), _record_usage(response.usage)
+
+    def submit_batch(self, requests):
+        lines = [json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                             "body": self._request(text, role)}) for custom_id, text, role in requests]
+        batch_file = self.client.files.create(file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+        batch = self.client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        return batch.id
+
+    def batch_results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line:
+                    item = json.loads(line)
+                    response = item.get("response") or {}
+                    results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip() \
+                        if response.get("status_code") == 200 else None
+        return results
 
-from tokenizer import count_tokens, count_words
-import os
 
-# Replace with your actual OpenAI API key
-openai.api_key = os.environ.get("OPENAI_API_KEY", None)
-if openai.api_key is None:
-    raise KeyError("Open AI key not found in environment variable")
+def _record_usage(usage):
+    if not usage:
+        return None
+    # cached prompt tokens are reported in prompt_tokens_details, which this SDK leaves as an untyped dict
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (details.get("cached_tokens") or 0) if isinstance(details, dict) else 0
+    tokens = {"input_tokens": usage.prompt_tokens - cached if cached else usage.prompt_tokens,
+              "output_tokens": usage.completion_tokens,
+              "cache_read_input_tokens": cached, "cache_creation_input_tokens": 0}
+    count("input_tokens", tokens["input_tokens"])
+    count("output_tokens", tokens["output_tokens"])
+    if cached:
+        count("cache_read_input_tokens", cached)
+    return tokens
 
 
-def summarize_transcript(transcript_content):
+def summarize_transcript(transcript_content, role=None):
     """
     Generates a summary of the transcript content.
     Args:
         transcript_content: The content of the transcript to summarize.
+        role: System prompt for the request.  Defaults to DETAILED_SUMMARY_ROLE.
     Returns:
         str: The comprehensive summary of the transcript.
     """
     logging.info("Summarizing transcript")
-    role_chunk = DETAILED_SUMMARY_ROLE
-    response = openai.ChatCompletion.create(
-        model=MODEL_NAME,
-        messages=[
-            {"role": "system", "content": role_chunk},
-            {"role": "user", "content": transcript_content},
-        ]
-    )
-    logging.info(f"transcript {count_tokens(transcript_content) } tokens, {count_words(transcript_content)} words")
-    return response.choices[0].message['content'].strip()
+    summary = get_provider("openai").summarize(transcript_content, role)
+    logging.info(f"transcript {count_words(transcript_content)} words")
+    return summary
 
 
 MODEL_NAME = "gpt-4-0125-preview"   # options include: gpt-4, gpt-3.5-turbo, gpt-3.5-turbo-16k
 MAX_TOKENS = 125000  # model gpt-4-1106-preview has context window of 128k tokens
+# rate limits for your OpenAI usage tier, see https://platform.openai.com/account/limits
+REQUESTS_PER_MINUTE = 5000
+TOKENS_PER_MINUTE = 600000
 DETAILED_SUMMARY_ROLE = """You are a professional assistant tasked with summarizing Zoom meeting transcripts. 
     The summaries are intended for my boss, so they should be concise, clear, and cover only essential points discussed, 
     including decisions, action items, and key takeaways. Focus on providing a clear understanding of the meeting's 
-    content and outcomes, as if explaining to a senior executive."""
\ No newline at end of file
+    content and outcomes, as if explaining to a senior executive."""
@@ -0,0 +1,115 @@
+"""
+On-disk cache of summaries keyed by a hash of the normalized transcript, provider, model and prompt.
+
+Zoom often rewrites or copies the same transcript, and restarting the watcher re-triggers events for files that were
+already summarized.  Looking the transcript up here first means the LLM is only called once per distinct transcript.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+STATE_DIRECTORY = "~/.zoom_transcript_summarizer"  # local state (caches, indexes) for the summarizer
+SUMMARY_CACHE_PATH = os.path.join(STATE_DIRECTORY, "summary_cache.sqlite3")
+MAX_CACHE_BYTES = 256 * 1024 * 1024  # least recently used summaries are evicted above this size
+MAX_CACHE_AGE_SECONDS = 90 * 24 * 60 * 60  # summaries older than this are evicted
+
+
+def normalize_transcript(transcript_content):
+    """
+    Normalizes line endings and whitespace so trivially different copies of a transcript share a cache entry.
+    """
+    lines = (" ".join(line.split()) for line in transcript_content.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def summary_cache_key(transcript_content, provider, model, prompt):
+    """
+    Returns the cache key for a transcript summarized by the given provider, model and prompt.
+    """
+    digest = hashlib.sha256()
+    for part in (provider, model, prompt, normalize_transcript(transcript_content)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")  # separator so parts can't run into each other
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """
+    SQLite backed summary cache with size-based and age-based eviction and hit/miss counters.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=SUMMARY_CACHE_PATH, max_bytes=MAX_CACHE_BYTES, max_age_seconds=MAX_CACHE_AGE_SECONDS):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS summaries (
+                                key TEXT PRIMARY KEY,
+                                summary TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                created REAL NOT NULL,
+                                last_access REAL NOT NULL)""")
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Returns the cached summary for key, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT summary, created FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE summaries SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        logging.info(f"Summary cache hit {key[:12]} ({self.hits} hits, {self.misses} misses)")
+        return row[0]
+
+    def put(self, key, summary):
+        """
+        Stores a summary and evicts old or least recently used entries if the cache is over its limits.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?)",
+                               (key, summary, len(summary.encode("utf-8")), now, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM summaries WHERE created < ?", (now - self.max_age_seconds,))
+        total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM summaries ORDER BY last_access").fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+            total_bytes -= size
+            logging.info(f"Evicted summary {key[:12]} from cache")
+
+    def stats(self):
+        """
+        Returns a dict of hit/miss counters and the number and total size of cached summaries.
+        """
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,188 @@
+"""
+Serves many users' Zoom transcript directories from one daemon.
+
+The users (tenants) are read from a JSON file (see tenants.py).  Each daemon process watches every tenant's directory
+with one watchdog observer and processes their transcripts on one pool of worker threads.  Jobs are queued per tenant
+and handed to the workers in weighted round-robin order, and each tenant has at most max_concurrent_jobs transcripts
+in progress, so a user with a backlog of meetings can't starve the others.  Summaries go to each tenant's own
+directory and sink (e.g. Google Docs with the tenant's own token, logged in beforehand with
+`python google_auth.py <token path>`), and each tenant's LLM requests are held to its quota.  The summary cache,
+processed index and rolling summaries are shared by the tenants.
+
+With --shards N the tenants are divided between N worker processes by a stable hash of their names, to use more
+cores.  Shard i serves metrics on METRICS_PORT + i, and a shard that exits unexpectedly is restarted.
+
+    python tenant_daemon.py --tenants ~/.zoom_transcript_summarizer/tenants.json --shards 4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import zlib
+
+from watchdog.observers import Observer
+
+import zoom_transcript_summarizer
+from job_queue import NUM_WORKERS, TranscriptJobQueue
+from metrics import configure_metrics, METRICS_LOG_PATH, METRICS_PORT, PROFILE_DIRECTORY, PROFILE_JOBS
+from processed_index import ProcessedIndex
+from rolling_summarizer import RollingSummaryStore, UPDATE_SECONDS
+from summary_cache import SummaryCache
+from tenants import TENANTS_PATH, load_tenants
+from zoom_transcript_summarizer import TranscriptHandler
+
+RESTART_DELAY_SECONDS = 10  # a shard that exited unexpectedly is restarted after this long
+
+
+def shard_of(tenant_name, shards):
+    """Returns the shard serving a tenant, the same in every process and across restarts."""
+    return zlib.crc32(tenant_name.encode("utf-8")) % shards
+
+
+class TenantDaemon:
+    """
+    Watches the directories of several tenants and summarizes their transcripts on one fairly shared worker pool.
+    """
+
+    def __init__(self, tenants, num_workers=NUM_WORKERS, summary_cache=None, processed_index=None):
+        """
+        Args:
+            tenants: The tenants.Tenants to serve.
+            num_workers: Worker threads shared by the tenants.
+            summary_cache: SummaryCache to use.  Defaults to the cache in the summarizer's state directory.
+            processed_index: ProcessedIndex to use.  Defaults to the index in the summarizer's state directory.
+        """
+        rolling = zoom_transcript_summarizer.ROLLING_SUMMARIES
+        self.summary_cache = summary_cache or SummaryCache()
+        self.processed_index = processed_index or ProcessedIndex()
+        self.rolling_summaries = RollingSummaryStore() if rolling else None
+        self.jobs = TranscriptJobQueue(self.process_file, num_workers, key_fn=self.tenant_of,
+                                       max_debounce_seconds=UPDATE_SECONDS if rolling else None)
+        self.tenants = []
+        self.handlers = {}  # tenant name -> TranscriptHandler
+        for tenant in tenants:
+            try:
+                handler = TranscriptHandler(summary_cache=self.summary_cache, processed_index=self.processed_index,
+                                            rolling_summaries=self.rolling_summaries, jobs=self.jobs, tenant=tenant)
+            except Exception:  # e.g. the tenant's Google token is missing; the other tenants are still served
+                logging.exception(f"Unable to set up tenant {tenant.name}, skipping it")
+                continue
+            self.jobs.configure_key(tenant.name, tenant.weight, tenant.max_concurrent_jobs)
+            self.tenants.append(tenant)
+            self.handlers[tenant.name] = handler
+        self._by_watch_path = sorted(self.tenants, key=lambda t: len(t.watch_path), reverse=True)  # nested roots
+        self.observer = None
+
+    def tenant_of(self, path):
+        """Returns the name of the tenant whose watch path holds path, or None."""
+        path = os.path.abspath(path)
+        for tenant in self._by_watch_path:
+            if path == tenant.watch_path or path.startswith(tenant.watch_path + os.sep):
+                return tenant.name
+        return None
+
+    def process_file(self, transcript_file):
+        """Processes a transcript with its tenant's handler."""
+        tenant = self.tenant_of(transcript_file)
+        if tenant is None:
+            raise ValueError(f"{transcript_file} isn't in any tenant's watch path")
+        self.handlers[tenant].process_file(transcript_file)
+
+    def start(self):
+        """
+        Starts the workers and the observer, and queues transcripts that arrived while the daemon wasn't running.
+        """
+        self.jobs.start()
+        self.observer = Observer()
+        watched = []
+        for tenant in self.tenants:
+            if not os.path.isdir(tenant.watch_path):
+                logging.error(f"Watch path of tenant {tenant.name} doesn't exist: {tenant.watch_path}")
+                continue
+            self.observer.schedule(self.handlers[tenant.name], path=tenant.watch_path, recursive=True)
+            watched.append(tenant)
+        self.observer.start()
+        for tenant in watched:
+            for transcript_file in self.processed_index.scan(tenant.watch_path):
+                self.jobs.submit(transcript_file, delay=0)
+        logging.info(f"Serving {len(watched)} tenants: {', '.join(tenant.name for tenant in watched)}")
+        return self
+
+    def stop(self):
+        """Stops watching, finishes the queued transcripts and closes the sinks."""
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+        self.jobs.shutdown()
+        for handler in self.handlers.values():
+            if handler.docs_writer:
+                handler.docs_writer.close()
+
+
+def run_shard(tenants_path, shard=0, shards=1, num_workers=NUM_WORKERS):
+    """
+    Serves the tenants of one shard until interrupted or terminated.
+    """
+    tenants = [tenant for tenant in load_tenants(tenants_path) if shard_of(tenant.name, shards) == shard]
+    if not tenants:
+        logging.info(f"Shard {shard} has no tenants")
+        return
+    configure_metrics(METRICS_PORT + shard if METRICS_PORT else None, METRICS_LOG_PATH,
+                      PROFILE_DIRECTORY if PROFILE_JOBS else None)
+    daemon = TenantDaemon(tenants, num_workers).start()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(10):
+            pass
+    except KeyboardInterrupt:
+        pass
+    logging.info(f"Shard {shard}: finishing queued transcripts...")
+    daemon.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the Zoom transcripts of many users from one daemon.")
+    parser.add_argument("--tenants", default=TENANTS_PATH, help="JSON file listing the tenants (see tenants.py)")
+    parser.add_argument("--shards", type=int, default=1, help="worker processes to divide the tenants between")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="worker threads per process")
+    args = parser.parse_args(argv)
+
+    load_tenants(args.tenants)  # a bad configuration fails here rather than in every shard
+    if args.shards <= 1:
+        run_shard(args.tenants, num_workers=args.workers)
+        return 0
+
+    context = multiprocessing.get_context("spawn")  # forking a process with running threads isn't safe
+    processes = {}
+
+    def launch(shard):
+        processes[shard] = context.Process(target=run_shard, args=(args.tenants, shard, args.shards, args.workers),
+                                           name=f"tenant-shard-{shard}")
+        processes[shard].start()
+
+    for shard in range(args.shards):
+        launch(shard)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(RESTART_DELAY_SECONDS):
+            for shard, process in list(processes.items()):
+                if process.exitcode not in (None, 0):
+                    logging.error(f"Shard {shard} exited with code {process.exitcode}, restarting it")
+                    launch(shard)
+        for process in processes.values():
+            process.terminate()  # shards finish their queued transcripts on SIGTERM
+    except KeyboardInterrupt:
+        pass  # the shards are interrupted too, and finish their queued transcripts
+    for process in processes.values():
+        process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Configuration of the users (tenants) served by the multi-tenant daemon (see tenant_daemon.py).
+
+Tenants are listed in a JSON file, by default TENANTS_PATH:
+
+    {"tenants": [
+        {"name": "alice", "watch_path": "/Users/alice/Documents/Zoom",
+         "save_to_path": "/Users/alice/Documents/Zoom_Summaries",
+         "sink_options": {"token_path": "~/.zoom_transcript_summarizer/tokens/alice.json"},
+         "tokens_per_minute": 40000},
+        {"name": "bob", "watch_path": "/Users/bob/Documents/Zoom", "sink": null, "weight": 2}
+    ]}
+
+Only name and watch_path are required.  Each tenant's requests share the process-wide provider clients and rate limits
+but are also held to the tenant's own requests and tokens per minute, so one user can't use up the quota of everyone.
+"""
+
+import asyncio
+import json
+import os
+import threading
+
+from metrics import observe
+from providers import get_provider
+from rate_limiter import TokenBucket
+from summary_cache import STATE_DIRECTORY
+from tokenizer import estimate_tokens
+
+TENANTS_PATH = os.path.join(STATE_DIRECTORY, "tenants.json")
+MAX_CONCURRENT_JOBS = 2  # transcripts of one tenant processed at once, leaving workers free for the other tenants
+
+
+class Tenant:
+    """
+    One user served by the daemon: the directory watched for their transcripts, where summaries are saved, the sink
+    they are also written to, and the provider and quota used to summarize them.
+    """
+
+    def __init__(self, name, watch_path, save_to_path=None, sink="google_docs", sink_options=None,
+                 provider="anthropic", requests_per_minute=None, tokens_per_minute=None, weight=1,
+                 max_concurrent_jobs=MAX_CONCURRENT_JOBS):
+        """
+        Args:
+            name: Unique name of the tenant.
+            watch_path: The directory Zoom saves the tenant's transcripts to.
+            save_to_path: The directory summaries are saved to.  Defaults to save_summary.SAVE_TO_PATH.
+            sink: The sink plugin summaries are also written to, or None to only save them locally.
+            sink_options: Keyword arguments for the sink's factory, e.g. {"token_path": ...} for the tenant's Google
+                token with the "google_docs" sink.
+            provider: The provider plugin used for the tenant's summaries.
+            requests_per_minute: The tenant's LLM request quota, or None for no limit of its own.
+            tokens_per_minute: The tenant's LLM token quota (input plus reserved output), or None for no limit.
+            weight: The tenant's share of the worker threads while other tenants have work waiting.
+            max_concurrent_jobs: The most of the tenant's transcripts processed at once.
+        """
+        self.name = name
+        self.watch_path = os.path.abspath(os.path.expanduser(watch_path))
+        self.save_to_path = save_to_path
+        self.sink = sink
+        self.sink_options = sink_options or {}
+        self.provider_name = provider
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.weight = weight
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self._provider = None
+        self._lock = threading.Lock()
+
+    def provider(self):
+        """Returns the tenant's provider, held to the tenant's quota, importing its plugin on first use."""
+        with self._lock:
+            if self._provider is None:
+                self._provider = TenantProvider(get_provider(self.provider_name), self.requests_per_minute,
+                                                self.tokens_per_minute)
+            return self._provider
+
+    def __repr__(self):
+        return f"Tenant({self.name!r}, {self.watch_path!r})"
+
+
+def load_tenants(path=TENANTS_PATH):
+    """
+    Reads the tenants from a JSON configuration file.
+    Returns:
+        list: The Tenants.
+    Raises:
+        ValueError: If the file isn't a valid configuration.
+    """
+    with open(os.path.expanduser(path)) as file:
+        config = json.load(file)
+    tenants = []
+    for entry in config.get("tenants", []):
+        try:
+            tenants.append(Tenant(**entry))
+        except TypeError as e:  # missing or unknown settings
+            raise ValueError(f"Invalid tenant {entry.get('name')!r} in {path}: {e}") from e
+    names = [tenant.name for tenant in tenants]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate tenant names in {path}: {', '.join(duplicates)}")
+    return tenants
+
+
+class TenantProvider:
+    """
+    A shared SummaryProvider seen through a tenant's quota.  Every billable call (summarize, asummarize, stream_summary,
+    summarize_view and submit_batch) first takes one request per prompt and the prompts' estimated input tokens plus
+    reserved output tokens from the tenant's token buckets.  Unused output tokens are given back when the summary
+    arrives, and all of a request's tokens if it fails; batches are settled when their results are read.  Other
+    attributes (name, model, max_input_tokens, ...) are the provider's.
+    """
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None):
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._batches = {}  # batch id to the tokens reserved for each custom_id, until its results are read
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def _admit(self, texts):
+        """Takes the quota for a request per text.  Returns the tokens reserved for each, for _give_back."""
+        reserved = [estimate_tokens(text, upper_bound=True) + self.provider.max_output_tokens for text in texts]
+        waited = 0.0
+        if self.requests:
+            waited += self.requests.take(len(texts))
+        if self.tokens:
+            waited += self.tokens.take(sum(reserved))
+        if waited:
+            observe("tenant_quota_wait", waited)
+        return reserved
+
+    def _give_back(self, reserved, output_text=None):
+        """Gives back the unused output tokens of a request that returned output_text, or all of a failed one's."""
+        if self.tokens:
+            self.tokens.give_back(reserved if output_text is None else
+                                  max(0, self.provider.max_output_tokens - estimate_tokens(output_text)))
+
+    def summarize(self, text, role=None):
+        [reserved] = self._admit([text])
+        try:
+            summary = self.provider.summarize(text, role)
+        except Exception:
+            self._give_back(reserved)
+            raise
+        self._give_back(reserved, summary)
+        return summary
+
+    async def asummarize(self, text, role=None):
+        [reserved] = await asyncio.to_thread(self._admit, [text])  # the event loop keeps running while waiting
+        try:
+            summary = await self.provider.asummarize(text, role)
+        except Exception:
+            self._give_back(reserved)
+            raise
+        self._give_back(reserved, summary)
+        return summary
+
+    def stream_summary(self, text, role=None):
+        [reserved] = self._admit([text])
+        pieces = []
+        try:
+            for piece in self.provider.stream_summary(text, role):
+                pieces.append(piece)
+                yield piece
+        finally:  # a stream failing or closed before its first piece used nothing
+            self._give_back(reserved, "".join(pieces) if pieces else None)
+
+    def summarize_view(self, text, instructions, role=None):
+        [reserved] = self._admit([text])
+        try:
+            summary, usage = self.provider.summarize_view(text, instructions, role)
+        except Exception:
+            self._give_back(reserved)
+            raise
+        self._give_back(reserved, summary)
+        return summary, usage
+
+    def submit_batch(self, requests):
+        reserved = self._admit([text for _, text, _ in requests])
+        try:
+            batch_id = self.provider.submit_batch(requests)
+        except Exception:
+            self._give_back(sum(reserved))
+            raise
+        self._batches[batch_id] = {custom_id: tokens for (custom_id, _, _), tokens in zip(requests, reserved)}
+        return batch_id
+
+    def batch_results(self, batch_id):
+        results = self.provider.batch_results(batch_id)
+        if results is not None:
+            for custom_id, tokens in self._batches.pop(batch_id, {}).items():
+                self._give_back(tokens, results.get(custom_id))
+        return results
@@ -3,11 +3,46 @@ This test module contains unittests for the zoom_transcript_summarizer script. I
 token counting, text chunking, reading and writing transcripts, and the summarization process.
 """
 
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import Mock, mock_open, patch
+from unittest.mock import AsyncMock, Mock, mock_open, patch
 
-from summarize import summarize_transcript
-from tokenizer import chunk_text_by_tokens, count_tokens
+from docs_writer import DocsWriter, build_docs_service, create_google_docs_writer
+from fake_docs_server import FakeDocsServer
+from google_auth import CredentialManager, read_token, write_token
+from job_queue import FairQueue, TranscriptJobQueue
+from processed_index import DONE, FAILED, SKIPPED, ProcessedIndex
+import plugins
+import processed_index
+
+from benchmark import generate_vtt_transcript, percentile, time_calls
+from bulk_summarize import BulkManifest, BulkSummarizer, find_transcripts, prepare_transcript
+from claude_summarizer import ClaudeProvider
+from map_reduce_summarizer import COMBINE_SUMMARIES_ROLE, summarize_long_transcript
+from multi_view_summarizer import SUMMARY_VIEWS, format_views, summarize_views
+from metrics import MetricsRegistry, count, current_job, observe, track_job
+from providers import get_provider
+from router import ProviderStats, SummaryRouter
+from rolling_summarizer import ROLLING_SUMMARY_ROLE, RollingSummaryStore, read_tail
+from rate_limiter import AdaptiveConcurrencyLimit, LLMScheduler, TokenBucket
+from save_summary import INCOMPLETE_SUMMARY_NOTE, GoogleDocWriter, stream_and_save_summary
+from stub_llm_server import StubLLMServer
+from summarize import OpenAIProvider, summarize_transcript
+from summary_cache import SummaryCache, summary_cache_key
+from tenant_daemon import TenantDaemon, shard_of
+from tenants import Tenant, TenantProvider, load_tenants
+from tokenizer import ERROR_WINDOW, TokenCounter, chunk_text_by_tokens, count_tokens, get_encoding, \
+    get_token_counter, iter_chunks_by_tokens
+from transcript_parser import Transcript, iter_turn_chunks
+from transcript_preprocessor import is_backchannel, preprocess_transcript, remove_fillers
 
 
 from zoom_transcript_summarizer import TranscriptHandler  # Assuming your script file is named "script_file.py"
@@ -69,6 +104,1226 @@ class TestChunkTextByTokens(unittest.TestCase):
         # Assert that the result matches the expected chunks
         self.assertEqual(result_chunks, expected_chunks)
 
+    def test_oversized_sentence_is_hard_split(self):
+        text = "word " * 250 + "end."
+        chunks = list(iter_chunks_by_tokens(text, max_tokens=100))
+        self.assertTrue(all(chunk.end_token - chunk.start_token <= 100 for chunk in chunks))
+        self.assertEqual(chunks[-1].end_token, count_tokens(text))
+
+    def test_chunk_offsets_and_overlap(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(40))
+        chunks = list(iter_chunks_by_tokens(text, max_tokens=30, overlap_tokens=8))
+        self.assertEqual(chunks[0].start_token, 0)
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertLess(current.start_token, previous.end_token)  # overlapping windows
+            self.assertTrue(current.text.startswith(previous.text.split(". ")[-1]))
+
+
+class TestTokenCounter(unittest.TestCase):
+    """
+    Test cases for the memoized TokenCounter and its calibrated estimator.
+    """
+    TEXTS = [" ".join(f"Speaker {i} said item {j} of the agenda was approved." for j in range(20)) for i in range(30)]
+
+    def setUp(self):
+        self.counter = TokenCounter(get_encoding("gpt-3.5-turbo"), cache_size=8)
+
+    def test_counts_are_exact_and_memoized(self):
+        text = self.TEXTS[0]
+        expected = len(self.counter.encoding.encode(text))
+        self.assertEqual([self.counter.count(text), self.counter.count(text)], [expected, expected])
+        self.assertEqual((self.counter.hits, self.counter.misses), (1, 1))
+        for other in self.TEXTS[1:10]:  # evicts the first text from the 8 entry cache
+            self.counter.count(other)
+        self.counter.count(text)
+        self.assertEqual(self.counter.misses, 11)
+
+    def test_count_many_matches_count(self):
+        texts = self.TEXTS[:5] + self.TEXTS[:2] + ["", "<|endoftext|>"]
+        counts = self.counter.count_many(texts, num_threads=4)
+        self.assertEqual(counts, [len(self.counter.encoding.encode(text, disallowed_special=())) for text in texts])
+        self.assertEqual(self.counter.misses, 7)  # repeated texts are encoded once
+
+    def test_estimator_is_calibrated_with_error_bounds(self):
+        self.assertEqual(self.counter.calibration().samples, 0)
+        for text in self.TEXTS[:20]:
+            self.counter.count(text)
+        calibration = self.counter.calibration()
+        self.assertEqual(calibration.samples, 19)
+        self.assertLessEqual(calibration.mean_error, max(calibration.error_bound, 1e-9))
+        for text in self.TEXTS[20:]:
+            exact = len(self.counter.encoding.encode(text))
+            self.assertLessEqual(abs(self.counter.estimate(text) - exact), exact * calibration.error_bound + 1)
+            self.assertGreaterEqual(self.counter.estimate(text, upper_bound=True), exact)
+
+    def test_error_bound_recovers_from_outliers(self):
+        self.counter.calibrate(1000, 250)
+        self.counter.calibrate(1000, 1000)  # e.g. a transcript in another script
+        outlier_bound = self.counter.calibration().error_bound
+        for _ in range(2 * ERROR_WINDOW):  # the chars per token ratio recovers, then the window forgets
+            self.counter.calibrate(1000, 250)
+        self.assertLess(self.counter.calibration().error_bound, outlier_bound / 10)
+
+    def test_models_share_counters_by_encoding(self):
+        self.assertIs(get_token_counter("claude-3-5-sonnet-20240620"), get_token_counter("gpt-4-0125-preview"))
+        self.assertEqual(count_tokens("Hello world", "claude-3-5-sonnet-20240620"), count_tokens("Hello world"))
+
+
+class TestTranscriptParser(unittest.TestCase):
+    """
+    Test cases for parsing Zoom transcripts into speaker turns and chunking them on turn boundaries.
+    """
+    VTT = ("WEBVTT\n\nNOTE generated by Zoom\n\n1\n00:00:01.000 --> 00:00:04.500\nSmith, John: Let's start.\n\n"
+           "2\n00:00:05.000 --> 00:00:09.000\nJones, Emily: The budget\nis approved.\n\n"
+           "3\n01:00:10.250 --> 01:00:12.000\nSmith, John: Thanks.\n")
+
+    def test_parse_vtt(self):
+        transcript = Transcript.parse(self.VTT.splitlines(keepends=True))
+        self.assertEqual(transcript.speakers, ["Smith, John", "Jones, Emily"])
+        self.assertEqual([(t.speaker, t.start, t.end, t.text) for t in transcript],
+                         [(0, 1.0, 4.5, "Let's start."), (1, 5.0, 9.0, "The budget is approved."),
+                          (0, 3610.25, 3612.0, "Thanks.")])
+        self.assertEqual(transcript.text().splitlines()[1], "[00:00:05] Jones, Emily: The budget is approved.")
+
+    def test_parse_srt_and_zoom_text(self):
+        srt = Transcript.parse("1\n00:00:01,000 --> 00:00:02,000\nLi Wang: Hello\n\n2\n00:00:03,000 --> 00:00:04,000\n"
+                               "No speaker here\n".splitlines())
+        self.assertEqual([(t.speaker, t.start, t.text) for t in srt],
+                         [(0, 1.0, "Hello"), (None, 3.0, "No speaker here")])
+        with open("test_meeting_transcript.txt") as file:
+            zoom = Transcript.parse(file)
+        self.assertEqual(zoom.speakers[0], "Smith, John {SCI}")
+        self.assertEqual(zoom.turns[1].start, 15 * 3600 + 70)
+        self.assertTrue(zoom.render(zoom.turns[1]).startswith("[15:01:10] Jones, Emily {RES}: Thank you, Dr. Smith."))
+
+    def test_plain_text_is_kept(self):
+        transcript = Transcript.parse(["This is a test transcript.\n", "\n", "42\n"])
+        self.assertEqual(transcript.text(), "This is a test transcript.\n42")
+
+    def test_turn_chunks_end_on_turn_boundaries(self):
+        with open("test_meeting_transcript.txt") as file:
+            transcript = Transcript.parse(file)
+        rendered = [transcript.render(turn) for turn in transcript]
+        chunks = list(iter_turn_chunks(transcript, max_tokens=200, overlap_tokens=40))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.end_token - chunk.start_token, 200)
+            self.assertTrue(all(line in rendered for line in chunk.text.split("\n")))
+            self.assertLessEqual(chunk.start_time, chunk.end_time)
+        self.assertEqual(chunks[-1].end_token, transcript.token_count())
+        self.assertTrue(chunks[0].text.split("\n")[-1] in chunks[1].text)  # overlap repeats the last turn
+
+    def test_turn_chunks_split_on_time(self):
+        transcript = Transcript.parse(self.VTT.splitlines())
+        chunks = list(iter_turn_chunks(transcript, max_tokens=1000, max_seconds=600))
+        self.assertEqual([(chunk.start_time, chunk.end_time) for chunk in chunks], [(1.0, 9.0), (3610.25, 3612.0)])
+
+
+class TestTranscriptPreprocessor(unittest.TestCase):
+    """
+    Test cases for the token-reduction preprocessing of parsed transcripts.
+    """
+    VTT = ("WEBVTT\n\n1\n00:00:01.000 --> 00:00:04.000\nSmith, John: Um, so, you know, the budget is approved.\n\n"
+           "2\n00:00:04.000 --> 00:00:05.000\nJones, Emily: Mm-hmm.\n\n"
+           "3\n00:00:05.000 --> 00:00:08.000\nSmith, John: We ship, uh, on Friday.\n\n"
+           "4\n00:00:08.000 --> 00:00:09.000\nJones, Emily: Do you know the date?\n")
+
+    def test_remove_fillers(self):
+        self.assertEqual(remove_fillers("Um, so, you know, the budget is fine."), "So, the budget is fine.")
+        self.assertEqual(remove_fillers("We should, uh."), "We should.")
+        self.assertEqual(remove_fillers("Um."), "")
+        self.assertEqual(remove_fillers("Do you know the date? I like it."), "Do you know the date? I like it.")
+        self.assertEqual(remove_fillers("Uh-huh, that works"), "Uh-huh, that works")
+        self.assertEqual(remove_fillers("Mm-hmm, let us ship it"), "Mm-hmm, let us ship it")
+        self.assertEqual(remove_fillers("Er, what is the ER wait time?"), "What is the ER wait time?")
+        self.assertEqual(remove_fillers("Fine. Uh, next item."), "Fine. Next item.")
+        self.assertEqual(remove_fillers("iPhone sales are up, um, a lot."), "iPhone sales are up, a lot.")
+        self.assertEqual(remove_fillers("so the plan is fine."), "so the plan is fine.")  # nothing removed up front
+        self.assertEqual(remove_fillers("Um, eBay is next."), "eBay is next.")
+
+    def test_is_backchannel(self):
+        self.assertTrue(is_backchannel("Mm-hmm."))
+        self.assertTrue(is_backchannel("Okay, got it, thanks."))
+        self.assertFalse(is_backchannel("Okay, ship it on Friday."))
+        self.assertFalse(is_backchannel(""))
+        self.assertTrue(is_backchannel("Uh-huh, thank you"))
+        self.assertFalse(is_backchannel("Right, you got it?"))
+        self.assertFalse(is_backchannel("Right?"))
+
+    def test_preprocess_transcript(self):
+        transcript = Transcript.parse(self.VTT.splitlines())
+        with patch("transcript_preprocessor.count") as mock_count:
+            result = preprocess_transcript(transcript)
+        self.assertEqual(result.text(), "Smith, John: So, the budget is approved. We ship, on Friday.\n"
+                                         "Jones, Emily: Do you know the date?")
+        self.assertEqual((result.turns[0].start, result.turns[0].end), (1.0, 8.0))
+        saved = mock_count.call_args.args[1]
+        self.assertEqual(saved, transcript.token_count() - result.token_count())
+        self.assertGreater(saved, 0)
+
+    def test_speaker_aliases(self):
+        transcript = Transcript.parse(self.VTT.splitlines())
+        result = preprocess_transcript(transcript, strip_timestamps=False, alias_speakers=True)
+        lines = result.text().splitlines()
+        self.assertEqual(lines[0], "Speakers: S1 = Smith, John; S2 = Jones, Emily")
+        self.assertEqual(lines[2], "[00:00:08] S2: Do you know the date?")
+        chunks = list(iter_turn_chunks(result, max_tokens=30))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(chunk.text.startswith(lines[0] + "\n") for chunk in chunks))
+
+
+class TestMapReduceSummarizer(unittest.TestCase):
+    """
+    Test cases for the hierarchical summarize_long_transcript function.
+    """
+    def test_short_transcript_single_request(self):
+        summarize_fn = Mock(return_value="Summary")
+        result = summarize_long_transcript("A short meeting.", summarize_fn, single_pass_tokens=100)
+        self.assertEqual(result, "Summary")
+        summarize_fn.assert_called_once_with("A short meeting.")
+
+    def test_long_transcript_is_mapped_and_reduced(self):
+        calls = []
+
+        def summarize_fn(text, role=None):
+            calls.append(role)
+            return "Combined summary" if role == COMBINE_SUMMARIES_ROLE else f"Part {len(calls)}."
+
+        transcript = " ".join(f"Speaker {i} made point number {i}." for i in range(300))
+        result = summarize_long_transcript(transcript, summarize_fn, single_pass_tokens=100, chunk_tokens=500)
+        self.assertEqual(result, "Combined summary")
+        self.assertGreater(calls.count(None), 1)  # map step ran once per chunk
+        self.assertEqual(calls.count(COMBINE_SUMMARIES_ROLE), 1)
+
+
+class TestSummaryCache(unittest.TestCase):
+    """
+    Test cases for the content-addressed SummaryCache.
+    """
+    def setUp(self):
+        self.cache = SummaryCache(":memory:")
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_key_ignores_whitespace_but_not_model(self):
+        key = summary_cache_key("Hello  there.\r\n\r\nBye.", "openai", "gpt-4", "role")
+        self.assertEqual(key, summary_cache_key("Hello there.\nBye.\n", "openai", "gpt-4", "role"))
+        self.assertNotEqual(key, summary_cache_key("Hello there.\nBye.", "openai", "gpt-3.5-turbo", "role"))
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get("key"))
+        self.cache.put("key", "Summary")
+        self.assertEqual(self.cache.get("key"), "Summary")
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "entries": 1, "bytes": 7})
+
+    def test_eviction_by_size_and_age(self):
+        self.cache.max_bytes = 10
+        self.cache.put("old", "12345678")
+        self.cache.put("new", "12345678")
+        self.assertIsNone(self.cache.get("old"))
+        self.assertEqual(self.cache.get("new"), "12345678")
+        self.cache.max_age_seconds = -1
+        self.assertIsNone(self.cache.get("new"))
+
+
+class TestRollingSummarizer(unittest.TestCase):
+    """
+    Test cases for incremental summarization of transcripts that are still being written.
+    """
+    CUES = ["WEBVTT\n\n",
+            "1\n00:00:01.000 --> 00:00:04.000\nSmith, John: The budget is approved.\n\n",
+            "2\n00:00:05.000 --> 00:00:08.000\nJones, Emily: We ship on Friday.\n\n",
+            "3\n00:00:09.000 --> 00:00:12.000\nSmith, John: Emily owns the launch email.\n\n"]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "meeting", "closed_caption.vtt")
+        os.makedirs(os.path.dirname(self.path))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def append(self, text, age=0):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(text)
+        modified = time.time() - age
+        os.utime(self.path, (modified, modified))
+
+    def test_read_tail_stops_at_last_complete_cue(self):
+        self.append(self.CUES[0] + self.CUES[1] + "2\n00:00:05.000 --> 00:00:08.000\nJones, Emily: We")
+        text, offset = read_tail(self.path, 0)
+        self.assertEqual(text, self.CUES[0] + self.CUES[1])
+        rest, end = read_tail(self.path, offset, complete_only=False)
+        self.assertTrue(rest.startswith("2\n") and end == os.path.getsize(self.path))
+
+    def test_store_round_trip(self):
+        store = RollingSummaryStore(":memory:")
+        self.assertEqual(store.get(self.path), (0, None))
+        store.put(self.path, 120, "Summary so far")
+        self.assertEqual(store.get(self.path), (120, "Summary so far"))
+        store.close()
+
+    @patch("zoom_transcript_summarizer.format_and_save_summary")
+    @patch("zoom_transcript_summarizer.MIN_DELTA_TOKENS", 1)
+    def test_summary_is_updated_from_the_appended_tail(self, mock_save):
+        requests = []
+
+        def summarize_fn(text, role=None):
+            requests.append((text, role))
+            return f"Summary {len(requests)}"
+
+        handler = TranscriptHandler(docs_writer=Mock(), summary_cache=SummaryCache(":memory:"),
+                                    processed_index=ProcessedIndex(":memory:"),
+                                    rolling_summaries=RollingSummaryStore(":memory:"))
+        handler.jobs.shutdown()
+        handler.jobs = Mock()
+        handler.summarize_fn = lambda: summarize_fn
+
+        self.append(self.CUES[0] + self.CUES[1])
+        self.assertFalse(handler.update_rolling_summary(self.path))
+        self.append(self.CUES[2])
+        self.assertFalse(handler.update_rolling_summary(self.path))
+        self.append(self.CUES[3], age=60)  # Zoom has stopped writing
+        self.assertTrue(handler.update_rolling_summary(self.path))
+
+        self.assertEqual(len(requests), 3)  # each part of the transcript is sent once
+        self.assertIn("The budget is approved.", requests[0][0])
+        self.assertIn("Summary 1", requests[1][0])
+        self.assertNotIn("The budget is approved.", requests[1][0])
+        self.assertEqual(requests[2][1], ROLLING_SUMMARY_ROLE)
+        self.assertIn("Emily owns the launch email.", requests[2][0])
+        self.assertEqual(handler.jobs.submit.call_count, 2)  # finalization is scheduled while the file grows
+        mock_save.assert_called_once_with("Summary 3", self.path, None)  # no tenant: the default save path
+        handler.docs_writer.submit.assert_called_once()
+        self.assertEqual(handler.rolling_summaries.get(self.path), (os.path.getsize(self.path), "Summary 3"))
+
+    @patch("zoom_transcript_summarizer.format_and_save_summary")
+    def test_update_arriving_mid_job_runs_after_it(self, mock_save):
+        requests = []
+        running = []
+        most_running = []
+        started, release = threading.Event(), threading.Event()
+
+        def summarize_fn(text, role=None):
+            running.append(text)
+            most_running.append(len(running))
+            requests.append(text)
+            started.set()
+            release.wait(5)
+            running.pop()
+            return f"Summary {len(requests)}"
+
+        handler = TranscriptHandler(docs_writer=Mock(), summary_cache=SummaryCache(":memory:"),
+                                    processed_index=ProcessedIndex(":memory:"),
+                                    rolling_summaries=RollingSummaryStore(":memory:"), jobs=Mock())
+        handler.summarize_fn = lambda: summarize_fn
+        handler.jobs = TranscriptJobQueue(handler.update_rolling_summary, num_workers=2, debounce_seconds=0).start()
+
+        self.append(self.CUES[0] + self.CUES[1], age=60)
+        handler.jobs.submit(self.path)
+        self.assertTrue(started.wait(5))
+        self.append(self.CUES[2], age=60)
+        handler.jobs.submit(self.path)  # arrives while the first update is summarizing
+        time.sleep(0.1)  # long enough for the idle worker to pick it up if it weren't held back
+        release.set()
+        handler.jobs.shutdown()
+
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(max(most_running), 1)  # never two updates of the transcript at once
+        self.assertIn("Summary 1", requests[1])  # merged into the first update's summary
+        self.assertNotIn("The budget is approved.", requests[1])
+        self.assertEqual(handler.rolling_summaries.get(self.path), (os.path.getsize(self.path), "Summary 2"))
+
+
+class TestTranscriptJobQueue(unittest.TestCase):
+    """
+    Test cases for the debounced TranscriptJobQueue.
+    """
+    def test_repeated_events_are_debounced(self):
+        process_fn = Mock()
+        jobs = TranscriptJobQueue(process_fn, num_workers=2, debounce_seconds=60).start()
+        for _ in range(5):
+            jobs.submit("meeting/transcript.txt")
+        jobs.submit("other/transcript.txt")
+        jobs.shutdown()  # flushes pending files and drains the queue
+        self.assertEqual(sorted(call.args[0] for call in process_fn.call_args_list),
+                         ["meeting/transcript.txt", "other/transcript.txt"])
+
+    def test_jobs_run_concurrently_and_failures_are_isolated(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def process_fn(path):
+            barrier.wait()  # only passes if three jobs are running at the same time
+            if path == "bad.txt":
+                raise RuntimeError("LLM failure")
+
+        jobs = TranscriptJobQueue(process_fn, num_workers=3, debounce_seconds=0).start()
+        for path in ("a.txt", "b.txt", "bad.txt"):
+            jobs.submit(path)
+        jobs.shutdown()
+        self.assertFalse(barrier.broken)
+        with self.assertRaises(RuntimeError):
+            jobs.submit("late.txt")
+
+    def test_events_during_a_job_run_it_again_afterwards(self):
+        runs = []
+
+        def process_fn(path):
+            runs.append([time.monotonic()])
+            time.sleep(0.3)
+            runs[-1].append(time.monotonic())
+
+        jobs = TranscriptJobQueue(process_fn, num_workers=2, debounce_seconds=0).start()
+        jobs.submit("a.vtt")
+        time.sleep(0.1)
+        jobs.submit("a.vtt")  # arrives while the first job is running
+        jobs.submit("a.vtt")
+        jobs.shutdown()
+        self.assertEqual(len(runs), 2)
+        self.assertGreaterEqual(runs[1][0], runs[0][1])
+
+    def test_full_tenant_queue_does_not_hold_up_others(self):
+        started = []
+
+        def process_fn(path):
+            started.append(path)
+            time.sleep(0.02)
+
+        jobs = TranscriptJobQueue(process_fn, num_workers=2, max_queued_jobs=3, debounce_seconds=0,
+                                  key_fn=lambda path: path.split("/")[0])
+        jobs.configure_key("a", max_running=1)
+        jobs.configure_key("b", max_running=1)
+        jobs.start()
+        for i in range(12):
+            jobs.submit(f"a/{i}.vtt")
+        time.sleep(0.01)
+        jobs.submit("b/0.vtt")
+        jobs.shutdown()
+        self.assertEqual(sorted(started), sorted([f"a/{i}.vtt" for i in range(12)] + ["b/0.vtt"]))
+        self.assertLessEqual(started.index("b/0.vtt"), 2)  # not after the rest of a's backlog
+
+    def test_handler_only_queues_transcripts(self):
+        handler = TranscriptHandler(docs_writer=Mock(), summary_cache=SummaryCache(":memory:"),
+                                    processed_index=ProcessedIndex(":memory:"), jobs=Mock())
+        for path in ("Zoom/Meeting/video1.mp4", "Zoom/Meeting/audio1.m4a", "Zoom/Meeting/meeting.json",
+                     "Zoom/Meeting/closed_caption.VTT"):
+            handler.on_created(Mock(is_directory=False, src_path=path))
+            handler.on_modified(Mock(is_directory=False, src_path=path))
+        self.assertEqual([call.args for call in handler.jobs.submit.call_args_list],
+                         [("Zoom/Meeting/closed_caption.VTT",)] * 2)
+
+    def test_max_debounce_processes_a_growing_file(self):
+        process_fn = Mock()
+        jobs = TranscriptJobQueue(process_fn, debounce_seconds=60, max_debounce_seconds=0.2).start()
+        for _ in range(3):
+            jobs.submit("meeting/transcript.vtt")  # keeps restarting the debounce window
+            time.sleep(0.05)
+        time.sleep(0.5)
+        process_fn.assert_called_once_with("meeting/transcript.vtt")
+        jobs.shutdown()
+
+    def test_fair_queue_interleaves_tenants_by_weight(self):
+        jobs = FairQueue()
+        jobs.configure("heavy", weight=2)
+        for i in range(6):
+            jobs.put("heavy", f"h{i}")
+        jobs.put("light", "l0")
+        jobs.put("light", "l1")
+        order = [jobs.get()[1] for _ in range(8)]
+        self.assertEqual(order, ["h0", "l0", "h1", "h2", "l1", "h3", "h4", "h5"])
+
+    def test_fair_queue_limits_running_jobs_per_tenant(self):
+        jobs = FairQueue()
+        jobs.configure("heavy", max_running=1)
+        jobs.put("heavy", "h0")
+        jobs.put("heavy", "h1")
+        jobs.put("light", "l0")
+        self.assertEqual([jobs.get(), jobs.get()], [("heavy", "h0"), ("light", "l0")])
+        jobs.close()
+        threading.Timer(0.1, jobs.task_done, args=("heavy",)).start()
+        self.assertEqual(jobs.get(), ("heavy", "h1"))  # waits for h0 to finish
+        self.assertIsNone(jobs.get())  # closed and drained
+
+
+class TestProcessedIndex(unittest.TestCase):
+    """
+    Test cases for the startup backfill scan of ProcessedIndex.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = ProcessedIndex(":memory:")
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+
+    def write_transcript(self, name, content="[Smith, John] 15:01:00\nHello."):
+        path = os.path.join(self.directory.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_scan_returns_new_and_failed_transcripts(self):
+        done = self.write_transcript("Meeting A/meeting_saved_closed_caption.txt")
+        failed = self.write_transcript("Meeting B/meeting_saved_closed_caption.txt")
+        new = self.write_transcript("Meeting C/meeting_saved_closed_caption.vtt")
+        self.write_transcript("Meeting C/recording.m4a")
+        self.index.mark(done, DONE)
+        self.index.mark(failed, FAILED)
+        self.assertEqual(sorted(self.index.scan(self.directory.name)), sorted([failed, new]))
+
+    def test_touched_file_is_rehashed_not_reprocessed(self):
+        path = self.write_transcript("Meeting/transcript.txt")
+        self.index.mark(path, DONE)
+        os.utime(path, (time.time() + 60, time.time() + 60))
+        self.assertEqual(self.index.scan(self.directory.name), [])
+        self.write_transcript("Meeting/transcript.txt", "[Smith, John] 15:01:00\nChanged.")
+        self.assertEqual(self.index.scan(self.directory.name), [path])
+
+    def test_scan_hashes_without_holding_the_index(self):
+        touched = self.write_transcript("Meeting A/transcript.txt")
+        self.index.mark(touched, DONE)
+        os.utime(touched, (time.time() + 60, time.time() + 60))
+        new = self.write_transcript("Meeting B/transcript.txt")
+        real_file_hash = processed_index.file_hash
+
+        def file_hash(path):  # a worker finishes the new transcript while the scan is hashing
+            if path == touched:
+                worker = threading.Thread(target=self.index.mark, args=(new, DONE))
+                worker.start()
+                worker.join(2)
+                self.assertFalse(worker.is_alive())
+            return real_file_hash(path)
+
+        with patch("processed_index.file_hash", side_effect=file_hash):
+            self.assertEqual(self.index.scan(self.directory.name), [])
+        self.assertEqual(self.index.status(new), DONE)  # not overwritten with the scan's stale decision
+
+    def test_old_transcripts_are_skipped(self):
+        path = self.write_transcript("Old Meeting/transcript.txt")
+        os.utime(path, (0, 0))
+        self.assertEqual(self.index.scan(self.directory.name, max_age_days=7), [])
+        self.assertEqual(self.index.status(path), SKIPPED)
+
+
+class TestProviders(unittest.TestCase):
+    """
+    Test cases for the pooled summarization providers.
+    """
+    def test_get_provider_returns_shared_instance(self):
+        self.assertIs(get_provider("anthropic"), get_provider("anthropic"))
+        self.assertIsInstance(get_provider("anthropic"), ClaudeProvider)
+        self.assertIsInstance(get_provider("openai"), OpenAIProvider)
+        self.assertIsInstance(get_provider("router"), SummaryRouter)  # built from the other shared providers
+        with self.assertRaises(ValueError):
+            get_provider("unknown")
+
+    def test_provider_plugins_are_imported_on_first_use(self):
+        plugins.register(plugins.PROVIDERS, "azure_openai", "summarize:OpenAIProvider")
+        self.addCleanup(plugins._registry[plugins.PROVIDERS].pop, "azure_openai")
+        self.assertIn("azure_openai", plugins.names(plugins.PROVIDERS))
+        self.assertIs(plugins.load(plugins.PROVIDERS, "azure_openai"), OpenAIProvider)
+        with self.assertRaises(ValueError):
+            plugins.load(plugins.SINKS, "unknown")
+
+    def test_watcher_starts_without_importing_sdks(self):
+        script = ("import sys, zoom_transcript_summarizer, bulk_summarize; "
+                  "print(sorted(name for name in ('anthropic', 'openai', 'googleapiclient', 'tiktoken', 'httpx') "
+                  "if name in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    @patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"})
+    def test_client_is_created_once_and_reused(self):
+        provider = OpenAIProvider()
+        self.assertIs(provider.client, provider.client)
+        provider.close()
+
+    def test_missing_key_raises_on_first_use(self):
+        provider = ClaudeProvider()
+        with patch.dict(os.environ, {}, clear=True), self.assertRaises(KeyError):
+            provider.client
+
+    def test_openai_summarize(self):
+        provider = OpenAIProvider()
+        provider._client = Mock()
+        provider._client.chat.completions.create.return_value = Mock(
+            choices=[Mock(message=Mock(content=" Summary "))])
+        self.assertEqual(provider.summarize("Transcript", role="Role"), "Summary")
+        messages = provider._client.chat.completions.create.call_args.kwargs["messages"]
+        self.assertEqual(messages[0], {"role": "system", "content": "Role"})
+
+
+class FakeStreamingProvider:
+    """
+    Provider streaming a fixed summary after first_token_seconds, or failing with error before its first piece.
+    """
+    def __init__(self, name, max_input_tokens=1000, first_token_seconds=0.0, error=None):
+        self.name = name
+        self.model = f"{name}-model"
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = 100
+        self.summary_role = f"{name} role"
+        self.supports_batches = False
+        self.first_token_seconds = first_token_seconds
+        self.error = error
+        self.requests = 0
+        self.closed = threading.Event()
+
+    def stream_summary(self, text, role=None, retry=True):
+        self.requests += 1
+        try:
+            time.sleep(self.first_token_seconds)
+            if self.error:
+                raise self.error
+            for piece in [f"{self.name} ", "summary"]:
+                yield piece
+        finally:
+            self.closed.set()
+
+
+class TestSummaryRouter(unittest.TestCase):
+    """
+    Test cases for size-aware, hedged routing across providers.
+    """
+    def test_routes_by_prompt_size(self):
+        router = SummaryRouter([FakeStreamingProvider("claude", 1000), FakeStreamingProvider("openai", 10)])
+        self.assertEqual([p.name for p in router.candidates(5)], ["claude", "openai"])
+        self.assertEqual([p.name for p in router.candidates(500)], ["claude"])
+        self.assertEqual(router.max_input_tokens, 1000)
+
+    def test_ranks_by_recent_latency_and_errors(self):
+        claude, openai = FakeStreamingProvider("claude", 100000), FakeStreamingProvider("openai", 100000)
+        router = SummaryRouter([claude, openai])
+        for _ in range(5):
+            router.stats["claude"].record(0, time_to_first_token=3.0)
+            router.stats["openai"].record(0, time_to_first_token=1.0)
+        self.assertEqual(router.candidates(5), [openai, claude])
+        self.assertEqual(router.candidates(50000), [claude, openai])  # no samples yet for large prompts
+        for _ in range(10):
+            router.stats["openai"].record(0, error=True)
+        self.assertEqual(router.candidates(5), [claude, openai])
+
+    def test_hedge_deadline_follows_latency_percentile(self):
+        router = SummaryRouter([FakeStreamingProvider("claude")], hedge_percentile=0.9, min_samples=10)
+        self.assertEqual(router.hedge_seconds(router.providers[0], 0), router.default_hedge_seconds)
+        for seconds in range(1, 21):
+            router.stats["claude"].record(0, time_to_first_token=float(seconds))
+        self.assertEqual(router.hedge_seconds(router.providers[0], 0), 18.0)
+        self.assertEqual(ProviderStats.size_bucket(100000), 3)
+
+    def test_slow_request_is_hedged_and_loser_cancelled(self):
+        slow, fast = FakeStreamingProvider("claude", first_token_seconds=1.0), FakeStreamingProvider("openai")
+        router = SummaryRouter([slow, fast], default_hedge_seconds=0.1, min_hedge_seconds=0.1)
+        started = time.monotonic()
+        self.assertEqual(router.summarize("Transcript"), "openai summary")
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertTrue(slow.closed.wait(5))  # closed at its first piece
+        self.assertEqual(len(router.stats["claude"].time_to_first_token[0]), 1)
+
+    def test_failed_request_falls_back_immediately(self):
+        failing = FakeStreamingProvider("claude", error=RateLimitError(529))
+        router = SummaryRouter([failing, FakeStreamingProvider("openai")], default_hedge_seconds=30)
+        self.assertEqual(router.summarize("Transcript"), "openai summary")
+        self.assertGreater(router.stats["claude"].error_rate, 0)
+        router.providers[1].error = RuntimeError("down")
+        with self.assertRaisesRegex(RuntimeError, "down"):  # every provider failed
+            router.summarize("Transcript")
+
+    def test_throttled_provider_fails_over_without_retrying(self):
+        class OverloadedError(RateLimitError):
+            status_code = 529
+            response = Mock(headers={"retry-after": "5"})
+
+        class OverloadedProvider(ClaudeProvider):
+            requests = 0
+
+            def _stream_summary(self, text, role):
+                self.requests += 1
+                raise OverloadedError()
+
+        overloaded = OverloadedProvider()
+        router = SummaryRouter([overloaded, FakeStreamingProvider("openai")], default_hedge_seconds=30)
+        started = time.monotonic()
+        self.assertEqual(router.summarize("Transcript"), "openai summary")
+        self.assertLess(time.monotonic() - started, 2)  # the scheduler would have backed off 5s before each retry
+        self.assertEqual(overloaded.requests, 1)
+
+
+class TestTenantDaemon(unittest.TestCase):
+    """
+    Test cases for serving several tenants from one TenantDaemon.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        plugins.register(plugins.PROVIDERS, "tenant_test", lambda: FakeStreamingProvider("fake", 100000))
+        self.addCleanup(plugins._registry[plugins.PROVIDERS].pop, "tenant_test")
+
+    def tenant(self, name, **settings):
+        root = os.path.join(self.directory.name, name)
+        os.makedirs(os.path.join(root, "zoom", "Standup"))
+        return Tenant(name, os.path.join(root, "zoom"), save_to_path=os.path.join(root, "summaries"), sink=None,
+                      provider="tenant_test", **settings)
+
+    def test_load_tenants(self):
+        path = os.path.join(self.directory.name, "tenants.json")
+        with open(path, 'w') as file:
+            json.dump({"tenants": [{"name": "alice", "watch_path": "~/zoom", "tokens_per_minute": 1000},
+                                   {"name": "bob", "watch_path": "/zoom/bob", "sink": None, "weight": 2}]}, file)
+        alice, bob = load_tenants(path)
+        self.assertEqual((alice.watch_path, alice.sink, alice.tokens_per_minute),
+                         (os.path.expanduser("~/zoom"), "google_docs", 1000))
+        self.assertEqual((bob.sink, bob.weight), (None, 2))
+        with open(path, 'w') as file:
+            json.dump({"tenants": [{"name": "alice", "watch_path": "/a", "colour": "blue"}]}, file)
+        with self.assertRaisesRegex(ValueError, "alice"):
+            load_tenants(path)
+
+    def test_shards_are_stable_and_balanced(self):
+        shards = [shard_of(f"user{i}", 4) for i in range(400)]
+        self.assertEqual(shards, [shard_of(f"user{i}", 4) for i in range(400)])
+        self.assertTrue(all(60 < shards.count(shard) < 140 for shard in range(4)))
+
+    def test_transcripts_are_summarized_for_their_tenant(self):
+        alice, bob = self.tenant("alice"), self.tenant("bob")
+        daemon = TenantDaemon([alice, bob], num_workers=2, summary_cache=SummaryCache(":memory:"),
+                              processed_index=ProcessedIndex(":memory:"))
+        transcript = os.path.join(bob.watch_path, "Standup", "meeting_saved_closed_caption.txt")
+        with open(transcript, 'w') as file:
+            file.write("[Bob] 10:00:00\nWe ship on Friday.\n")
+        self.assertEqual(daemon.tenant_of(transcript), "bob")
+        self.assertIsNone(daemon.tenant_of(os.path.join(self.directory.name, "elsewhere.txt")))
+        daemon.process_file(transcript)
+        self.assertFalse(os.path.exists(alice.save_to_path))
+        [summary_file] = os.listdir(bob.save_to_path)
+        with open(os.path.join(bob.save_to_path, summary_file)) as file:
+            self.assertEqual(file.read(), "fake summary")
+        self.assertEqual(daemon.processed_index.status(transcript), DONE)
+
+    def test_tenant_quota_is_charged_per_request(self):
+        provider = TenantProvider(FakeStreamingProvider("fake"), requests_per_minute=60, tokens_per_minute=600)
+        self.assertEqual("".join(provider.stream_summary("Transcript")), "fake summary")
+        self.assertEqual(provider.name, "fake")
+        self.assertLess(provider.requests.tokens, 60)
+        self.assertLess(provider.tokens.tokens, 600 - 2)  # the prompt and output, with unused output given back
+        self.assertGreater(provider.tokens.tokens, 600 - provider.max_output_tokens)
+
+    def test_tenant_quota_charges_async_and_batch_requests(self):
+        shared = Mock(max_output_tokens=100, asummarize=AsyncMock(return_value="Summary"),
+                      submit_batch=Mock(return_value="batch-1"))
+        shared.batch_results.return_value = {"a": "Summary", "b": None}
+        provider = TenantProvider(shared, requests_per_minute=60, tokens_per_minute=600)
+        self.assertEqual(asyncio.run(provider.asummarize("Transcript")), "Summary")
+        self.assertAlmostEqual(provider.requests.tokens, 59, delta=0.1)
+        self.assertTrue(600 - shared.max_output_tokens < provider.tokens.tokens < 600 - 2)
+        provider.tokens.tokens = 600
+        self.assertEqual(provider.submit_batch([("a", "Transcript", None), ("b", "Transcript", None)]), "batch-1")
+        self.assertAlmostEqual(provider.requests.tokens, 57, delta=0.1)  # one request per prompt
+        self.assertLess(provider.tokens.tokens, 600 - 2 * shared.max_output_tokens)
+        self.assertEqual(provider.batch_results("batch-1"), {"a": "Summary", "b": None})
+        # the failed request is given back in full and the other's unused output
+        self.assertTrue(600 - shared.max_output_tokens < provider.tokens.tokens < 600 - 2)
+
+    def test_tenant_tokens_are_given_back_when_a_request_fails(self):
+        shared = FakeStreamingProvider("fake", error=RuntimeError("down"))
+        shared.summarize = Mock(side_effect=RuntimeError("down"))
+        provider = TenantProvider(shared, requests_per_minute=60, tokens_per_minute=600)
+        with self.assertRaisesRegex(RuntimeError, "down"):
+            provider.summarize("Transcript")
+        self.assertAlmostEqual(provider.tokens.tokens, 600, delta=1)
+        with self.assertRaisesRegex(RuntimeError, "down"):
+            "".join(provider.stream_summary("Transcript"))
+        self.assertAlmostEqual(provider.tokens.tokens, 600, delta=1)
+        self.assertAlmostEqual(provider.requests.tokens, 58, delta=0.1)  # the failed requests were still made
+
+
+class TestStreamingSummary(unittest.TestCase):
+    """
+    Test cases for writing a summary to the local file and Google Docs while it streams.
+    """
+    def test_google_doc_writer_batches_inserts(self):
+        service = Mock()
+        service.documents().create().execute.return_value = {"documentId": "doc-1"}
+        writer = GoogleDocWriter(service, "Zoom/Meeting/transcript.txt", flush_chars=10, flush_seconds=60)
+        for piece in ["Action ", "items: ", "ship ", "it."]:
+            writer.write(piece)
+        writer.close()
+        inserted = [call.kwargs["body"]["requests"][0]["insertText"]["text"]
+                    for call in service.documents().batchUpdate.call_args_list]
+        self.assertEqual(inserted, ["Action items: ", "ship it."])
+        self.assertTrue(writer.doc_title.startswith("Meeting_"))
+
+    def test_stream_and_save_summary(self):
+        service = Mock()
+        service.documents().create().execute.return_value = {"documentId": "doc-1"}
+        with tempfile.TemporaryDirectory() as directory, patch("save_summary.SAVE_TO_PATH", directory):
+            summary, time_to_first_token = stream_and_save_summary(iter(["Decisions: ", "ship it."]),
+                                                                   "Zoom/Meeting/transcript.txt", service)
+            with open(os.path.join(directory, os.listdir(directory)[0])) as file:
+                self.assertEqual(file.read(), "Decisions: ship it.")
+        self.assertEqual(summary, "Decisions: ship it.")
+        self.assertIsNotNone(time_to_first_token)
+        service.documents().batchUpdate.assert_called()
+
+    def test_failed_stream_leaves_no_finished_looking_summary(self):
+        def pieces():
+            yield "A" * 2500  # enough to create the Google Doc
+            yield "B"
+            raise RuntimeError("stream interrupted")
+
+        service = Mock()
+        service.documents().create().execute.return_value = {"documentId": "doc-1"}
+        with tempfile.TemporaryDirectory() as directory, patch("save_summary.SAVE_TO_PATH", directory):
+            with self.assertRaisesRegex(RuntimeError, "stream interrupted"):
+                stream_and_save_summary(pieces(), "Zoom/Meeting/transcript.txt", service)
+            self.assertEqual(os.listdir(directory), [])
+        inserted = [call.kwargs["body"]["requests"][0]["insertText"]["text"]
+                    for call in service.documents().batchUpdate.call_args_list]
+        self.assertEqual(inserted, ["A" * 2500, "B" + INCOMPLETE_SUMMARY_NOTE])
+
+    def test_stream_and_save_summary_logs_its_own_tokens(self):
+        with tempfile.TemporaryDirectory() as directory, patch("save_summary.SAVE_TO_PATH", directory), \
+                patch("metrics.REGISTRY", MetricsRegistry()), track_job("transcript.txt"):
+            count("output_tokens", 5000)  # e.g. the map step's requests
+            with self.assertLogs(level="INFO") as logs:
+                stream_and_save_summary(iter(["Decisions: ", "ship it."]), "Zoom/Meeting/transcript.txt")
+        size = next(line for line in logs.output if "summary size" in line)
+        self.assertIn("summary size ~", size)
+        self.assertNotIn("5000", size)
+
+
+class RateLimitError(Exception):
+    """Stands in for an SDK error carrying an HTTP status code and response headers."""
+    status_code = 429
+    response = Mock(headers={"retry-after": "0"})
+
+
+class TestRateLimiter(unittest.TestCase):
+    """
+    Test cases for the token buckets, adaptive concurrency limit and LLMScheduler.
+    """
+    def test_token_bucket_waits_for_refill(self):
+        bucket = TokenBucket(per_minute=6000)  # 100 tokens per second
+        self.assertEqual(bucket.take(6000), 0.0)
+        started = time.monotonic()
+        bucket.take(10)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_concurrency_limit_adapts(self):
+        limit = AdaptiveConcurrencyLimit(initial=8)
+        limit.acquire()
+        limit.release(error=RateLimitError())
+        self.assertEqual(limit.limit, 4)
+        for _ in range(4):
+            limit.acquire()
+            limit.release(latency=1.0, tokens=1000)
+        self.assertGreater(limit.limit, 4)
+
+    def test_scheduler_retries_throttled_requests(self):
+        scheduler = LLMScheduler(requests_per_minute=600, input_tokens_per_minute=100000,
+                                 output_tokens_per_minute=10000)
+        fn = Mock(side_effect=[RateLimitError(), "Summary"])
+        self.assertEqual(scheduler.call(fn, "Transcript", max_output_tokens=100), "Summary")
+        self.assertEqual(fn.call_count, 2)
+        self.assertEqual(scheduler.concurrency.in_flight, 0)
+
+    def test_scheduler_stream_retries_before_first_piece(self):
+        scheduler = LLMScheduler()
+        attempts = []
+
+        def stream_fn():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RateLimitError()
+            return iter(["Summary ", "text"])
+
+        self.assertEqual("".join(scheduler.stream(stream_fn, "Transcript", 100)), "Summary text")
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(scheduler.concurrency.in_flight, 0)
+
+
+class TestDocsWriter(unittest.TestCase):
+    """
+    Test cases for the background, batched DocsWriter against a FakeDocsServer.
+    """
+    def setUp(self):
+        self.server = FakeDocsServer().start()
+        self.writer = DocsWriter(build_docs_service(api_endpoint=self.server.url),
+                                 batch_uri=self.server.url + "batch", batch_window=0.1).start()
+
+    def tearDown(self):
+        self.writer.close()
+        self.server.stop()
+
+    def test_documents_are_batched(self):
+        futures = [self.writer.submit(f"Meeting {i}", f"Summary {i}") for i in range(5)]
+        doc_ids = [future.result(timeout=10) for future in futures]
+        self.assertEqual([self.server.text(doc_id) for doc_id in doc_ids], [f"Summary {i}" for i in range(5)])
+        self.assertEqual(self.server.http_requests, 2)  # one batch of creates, one batch of inserts
+
+    def test_streamed_text_is_appended_in_order(self):
+        handle = self.writer.open_document("Meeting")
+        for piece in ["Decisions: ", "ship ", "it."]:
+            handle.write(piece)
+            time.sleep(0.05)
+        handle.close()
+        self.assertEqual(self.server.text(handle.done.result(timeout=10)), "Decisions: ship it.")
+
+    def test_slow_stream_is_appended_in_batches(self):
+        self.writer.flush_seconds = 0.5
+        handle = self.writer.open_document("Meeting")
+        for i in range(40):  # about a second of streaming
+            handle.write(f"piece {i} ")
+            time.sleep(0.025)
+        handle.close()
+        text = self.server.text(handle.done.result(timeout=10))
+        self.assertEqual(text, "".join(f"piece {i} " for i in range(40)))
+        self.assertLessEqual(self.server.api_calls, 4)  # the create, and an insert every flush_seconds and on close
+
+    def test_aborted_document_is_marked_incomplete(self):
+        handle = self.writer.open_document("Meeting")
+        handle.write("Decisions: ")
+        handle.abort()
+        self.assertEqual(self.server.text(handle.done.result(timeout=10)), "Decisions: " + INCOMPLETE_SUMMARY_NOTE)
+
+    def test_failed_operations_are_retried(self):
+        self.server.fail_next(1, status=503)
+        self.writer.retry_backoff = 0.01
+        doc_id = self.writer.submit("Meeting", "Summary").result(timeout=10)
+        self.assertEqual(self.server.text(doc_id), "Summary")
+
+    def test_permanent_failures_are_reported(self):
+        self.server.fail_next(1, status=403)
+        with self.assertRaises(Exception):
+            self.writer.submit("Meeting", "Summary").result(timeout=10)
+
+    def test_documents_are_held_while_credentials_are_unhealthy(self):
+        self.writer.set_healthy(False)
+        future = self.writer.submit("Meeting", "Summary")
+        time.sleep(0.3)
+        self.assertFalse(future.done())
+        self.assertEqual(self.server.http_requests, 0)
+        self.writer.set_healthy(True)
+        self.assertEqual(self.server.text(future.result(timeout=10)), "Summary")
+
+
+class TestCredentialManager(unittest.TestCase):
+    """
+    Test cases for the background-refreshed, file-cached Google credentials.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.token_path = os.path.join(self.directory.name, "google_token.json")
+        self.manager = None
+
+    def tearDown(self):
+        if self.manager:
+            self.manager.close()
+        self.directory.cleanup()
+
+    def cache_token(self, token, expires_in):
+        info = {"token": token, "refresh_token": "refresh", "client_id": "id", "client_secret": "secret",
+                "token_uri": "http://127.0.0.1:9/token",
+                "expiry": (datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)).isoformat() + "Z"}
+        with open(self.token_path, 'w') as file:
+            json.dump(info, file)
+
+    def start(self, refresh):
+        def refreshed(credentials, request):
+            refresh()
+            credentials.token = "fresh"
+            credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+        healthy = []
+        with patch("google.oauth2.credentials.Credentials.refresh", autospec=True, side_effect=refreshed):
+            self.manager = CredentialManager(self.token_path, retry_seconds=0.05, login_fn=Mock()).start()
+            self.manager.add_listener(healthy.append)
+            time.sleep(0.3)
+        return healthy
+
+    def test_token_cache_round_trip(self):
+        self.cache_token("cached", 3600)
+        credentials = read_token(self.token_path)
+        write_token(credentials, self.token_path)
+        self.assertEqual(read_token(self.token_path).token, "cached")
+        self.assertEqual(os.stat(self.token_path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(self.directory.name), ["google_token.json"])
+
+    def test_tenant_without_token_never_gets_another_users(self):
+        self.cache_token("alice", 3600)
+        bob_path = os.path.join(self.directory.name, "bob.json")
+        with patch("google_auth._read_legacy_token", return_value=read_token(self.token_path)) as legacy, \
+                patch("google_auth.login") as login:
+            with self.assertRaisesRegex(ValueError, "python google_auth.py .*bob.json"):
+                create_google_docs_writer(bob_path)  # as the daemon sets up a tenant's sink
+            login.assert_not_called()  # no browser flow in the daemon
+            self.assertFalse(os.path.exists(bob_path))
+
+            bob = read_token(self.token_path)
+            bob.token = "bob"
+            self.manager = CredentialManager(bob_path, login_fn=Mock(return_value=bob)).start()
+            legacy.assert_not_called()  # the legacy token belongs to the default user only
+        self.assertEqual(read_token(bob_path).token, "bob")
+
+    def test_expired_token_is_refreshed_in_background(self):
+        self.cache_token("stale", -60)
+        refresh = Mock()
+        healthy = self.start(refresh)
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(healthy[-1], True)
+        self.assertEqual(self.manager.credentials.token, "fresh")
+        self.assertEqual(read_token(self.token_path).token, "fresh")
+        self.manager.login_fn.assert_not_called()
+
+    def test_valid_token_is_not_refreshed_until_near_expiry(self):
+        self.cache_token("cached", 3600)
+        refresh = Mock()
+        self.assertEqual(self.start(refresh), [True])
+        refresh.assert_not_called()
+
+    def test_failed_refresh_marks_credentials_unhealthy_and_retries(self):
+        self.cache_token("stale", -60)
+        refresh = Mock(side_effect=[RuntimeError("offline"), RuntimeError("offline"), None])
+        healthy = self.start(refresh)
+        self.assertEqual(refresh.call_count, 3)
+        self.assertEqual(healthy, [False, True])
+
+    def test_token_refreshed_by_another_process_is_adopted(self):
+        self.cache_token("stale", -60)
+        self.manager = CredentialManager(self.token_path, login_fn=Mock())
+        self.manager.credentials = read_token(self.token_path)
+        self.cache_token("other", 3600)
+        self.manager.refresh()  # would fail: the token endpoint isn't reachable
+        self.assertEqual(self.manager.credentials.token, "other")
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Test cases for the benchmark helpers and the stub LLM server.
+    """
+    def test_generate_vtt_transcript(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "transcript.vtt")
+            size_bytes = generate_vtt_transcript(path, lines=50, speakers=5)
+            with open(path) as file:
+                content = file.read()
+        self.assertEqual(len(content), size_bytes)
+        self.assertTrue(content.startswith("WEBVTT\n\n1\n00:00:00.000 --> "))
+        self.assertIn("\n50\n", content)
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 0.5), 50)
+        self.assertEqual(percentile(samples, 0.99), 99)
+        self.assertEqual(percentile([3.0], 0.95), 3.0)
+
+    def test_time_calls_traces_memory_of_one_call(self):
+        retained = []
+        latencies, peak_mb = time_calls(lambda i: retained.append(bytearray(2 * 1024 * 1024)), 3)
+        self.assertEqual(len(latencies), 3)
+        self.assertEqual(len(retained), 4)  # one traced call after the timed ones
+        self.assertGreaterEqual(peak_mb, 2)
+        self.assertLess(peak_mb, 4)  # earlier calls' allocations aren't counted
+
+    def test_stub_server_serves_both_providers(self):
+        server = StubLLMServer(summary_words=4).start()
+        environment = {"ANTHROPIC_BASE_URL": server.url.rstrip("/"), "OPENAI_BASE_URL": server.url + "v1",
+                       "ANTHROPIC_API_KEY": "test", "OPENAI_API_KEY": "test"}
+        try:
+            with patch.dict(os.environ, environment):
+                for provider in (ClaudeProvider(), OpenAIProvider()):
+                    self.assertEqual(provider.summarize("Transcript").strip(), "The team agreed to")
+                    self.assertEqual("".join(provider.stream_summary("Transcript")), "The team agreed to ")
+                    provider.close()
+        finally:
+            server.stop()
+
+    def test_stub_server_serves_both_batch_apis(self):
+        server = StubLLMServer(summary_words=4, batch_seconds=0.2).start()
+        environment = {"ANTHROPIC_BASE_URL": server.url.rstrip("/"), "OPENAI_BASE_URL": server.url + "v1",
+                       "ANTHROPIC_API_KEY": "test", "OPENAI_API_KEY": "test"}
+        try:
+            with patch.dict(os.environ, environment):
+                for provider in (ClaudeProvider(), OpenAIProvider()):
+                    batch_id = provider.submit_batch([("a", "Transcript", None), ("b", "Summaries", "Combine")])
+                    self.assertIsNone(provider.batch_results(batch_id))
+                    time.sleep(0.2)
+                    results = provider.batch_results(batch_id)
+                    self.assertEqual({key: value.strip() for key, value in results.items()},
+                                     {"a": "The team agreed to", "b": "The team agreed to"})
+                    provider.close()
+        finally:
+            server.stop()
+        self.assertEqual((server.requests, server.batch_requests), (0, 4))
+
+
+class TestMultiViewSummarizer(unittest.TestCase):
+    """
+    Test cases for several views of a meeting requested against one cached transcript prompt.
+    """
+    TRANSCRIPT = "\n".join(f"Smith, John: Item {number} of the agenda is approved." for number in range(400))
+
+    def test_views_read_the_transcript_from_the_prompt_cache(self):
+        server = StubLLMServer(summary_words=4).start()
+        environment = {"ANTHROPIC_BASE_URL": server.url.rstrip("/"), "OPENAI_BASE_URL": server.url + "v1",
+                       "ANTHROPIC_API_KEY": "test", "OPENAI_API_KEY": "test"}
+        try:
+            with patch.dict(os.environ, environment):
+                for provider in (ClaudeProvider(), OpenAIProvider()):
+                    result = summarize_views(self.TRANSCRIPT, provider)
+                    self.assertEqual(list(result.summaries), list(SUMMARY_VIEWS))
+                    self.assertEqual({summary.strip() for summary in result.summaries.values()}, {"The team agreed to"})
+                    cached = result.usage["cache_read_input_tokens"]
+                    self.assertGreater(cached, 3 * len(self.TRANSCRIPT) // 4 * 0.9)  # every view but the first
+                    self.assertLess(result.usage["input_tokens"], cached)
+                    provider.close()
+        finally:
+            server.stop()
+        self.assertEqual(server.requests, 2 * len(SUMMARY_VIEWS))
+        self.assertEqual(len(server.cached_prefixes), 2)  # one transcript prefix per provider
+
+    def test_claude_reports_cache_writes(self):
+        server = StubLLMServer(summary_words=4).start()
+        environment = {"ANTHROPIC_BASE_URL": server.url.rstrip("/"), "ANTHROPIC_API_KEY": "test"}
+        try:
+            with patch.dict(os.environ, environment), patch("claude_summarizer.count") as mock_count:
+                provider = ClaudeProvider()
+                _, first = provider.summarize_view(self.TRANSCRIPT, "List the action items.")
+                _, second = provider.summarize_view(self.TRANSCRIPT, "List the decisions.")
+                provider.close()
+        finally:
+            server.stop()
+        self.assertGreater(first["cache_creation_input_tokens"], 0)
+        self.assertEqual(second["cache_read_input_tokens"], first["cache_creation_input_tokens"])
+        self.assertEqual(second["cache_creation_input_tokens"], 0)
+        counted = [call.args[0] for call in mock_count.call_args_list]
+        self.assertEqual(counted.count("cache_creation_input_tokens"), 1)
+        self.assertEqual(counted.count("cache_read_input_tokens"), 1)
+
+    def test_format_views(self):
+        self.assertEqual(format_views({"Decisions": "Ship on Friday.\n", "Action Items": "Emily: launch email"}),
+                         "Decisions\nShip on Friday.\n\nAction Items\nEmily: launch email")
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test cases for per-transcript metrics.
+    """
+    def test_job_accumulates_stages_and_counters(self):
+        registry = MetricsRegistry()
+        with patch("metrics.REGISTRY", registry), track_job("transcript.vtt") as job:
+            observe("llm", 1.0)
+            with track_job("transcript.vtt") as inner:
+                self.assertIs(inner, job)
+                observe("llm", 0.5)
+                count("llm_requests", 2)
+        self.assertIsNone(current_job())
+        self.assertEqual(job.stages, {"llm": 1.5})
+        self.assertEqual(job.counters, {"llm_requests": 2})
+        self.assertEqual(registry.counters["transcripts"], 1)
+        text = registry.prometheus_text()
+        self.assertIn('summarizer_stage_seconds_bucket{stage="llm",le="0.5"} 1', text)
+        self.assertIn('summarizer_stage_seconds_count{stage="llm"} 2', text)
+        self.assertIn("summarizer_llm_requests_total 2", text)
+
+    def test_hold_defers_job_log_until_released(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "metrics.jsonl")
+            registry = MetricsRegistry(log_path=log_path)
+            with patch("metrics.REGISTRY", registry), track_job("transcript.vtt") as job:
+                job.hold()
+                count("cache_hits")
+            self.assertFalse(os.path.exists(log_path))
+            job.release()
+            with open(log_path) as file:
+                lines = [json.loads(line) for line in file]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["transcript"], "transcript.vtt")
+        self.assertEqual(lines[0]["counters"], {"cache_hits": 1})
+
+
+class TestBulkSummarize(unittest.TestCase):
+    """
+    Test cases for the offline bulk summarizer, run against the stub LLM server's batch API.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.directory.name, "archive")
+        for meeting, lines in (("short", 20), ("long", 400)):
+            os.makedirs(os.path.join(self.archive, meeting))
+            generate_vtt_transcript(os.path.join(self.archive, meeting, "meeting.vtt"), lines, speakers=3)
+        self.server = StubLLMServer(summary_words=4).start()
+        environment = {"ANTHROPIC_BASE_URL": self.server.url.rstrip("/"), "ANTHROPIC_API_KEY": "test"}
+        self.provider = ClaudeProvider()
+        self.patches = [patch.dict(os.environ, environment),
+                        patch("bulk_summarize.get_provider", return_value=self.provider),
+                        patch("save_summary.SAVE_TO_PATH", self.directory.name)]
+        for active_patch in self.patches:
+            active_patch.start()
+        self.manifest_path = os.path.join(self.directory.name, "manifest.json")
+
+    def tearDown(self):
+        for active_patch in reversed(self.patches):
+            active_patch.stop()
+        self.provider.close()
+        self.server.stop()
+        self.directory.cleanup()
+
+    def summarizer(self):
+        return BulkSummarizer("anthropic", BulkManifest(self.manifest_path), summary_cache=SummaryCache(":memory:"),
+                              processed_index=ProcessedIndex(":memory:"), workers=1, poll_seconds=0.01,
+                              single_pass_tokens=1000, chunk_tokens=1000)
+
+    def test_find_transcripts(self):
+        paths = find_transcripts([self.archive, os.path.join(self.archive, "*", "*.vtt")])
+        self.assertEqual([os.path.basename(os.path.dirname(path)) for path in paths], ["long", "short"])
+
+    def test_prepare_transcript_uses_the_settings_it_is_given(self):
+        path = find_transcripts([self.archive])[1]
+        with patch("bulk_summarize.get_provider", side_effect=AssertionError("built a provider in the worker")):
+            _, cache_key, texts, error = prepare_transcript(path, "anthropic", "model", "role", single_pass_tokens=1000,
+                                                            chunk_tokens=1000)
+        self.assertIsNone(error)
+        self.assertEqual(len(texts), 1)
+        self.assertIsNotNone(cache_key)
+
+    def test_batched_rounds(self):
+        counts = self.summarizer().run(find_transcripts([self.archive]))
+        self.assertEqual(counts, {DONE: 2})
+        self.assertEqual(self.server.requests, 0)  # everything went through the batch API
+        self.assertGreater(self.server.batch_requests, 3)  # the long transcript was chunked and combined
+        self.assertEqual(len([name for name in os.listdir(self.directory.name) if name.endswith(".txt")]), 2)
+
+    def test_resume_polls_submitted_batches(self):
+        paths = find_transcripts([self.archive])
+        summarizer = self.summarizer()
+        with patch.object(self.provider, "batch_results", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                summarizer.run(paths)
+        submitted = self.server.batch_requests
+        self.assertEqual(len(BulkManifest(self.manifest_path).batches), 1)
+
+        counts = self.summarizer().run(paths)
+        self.assertEqual(counts, {DONE: 2})
+        map_requests = len(summarizer.manifest.requests)
+        self.assertEqual(submitted, map_requests)
+        self.assertLess(self.server.batch_requests, 2 * submitted)  # the map step wasn't submitted again
+        self.assertEqual(self.summarizer().run(paths), {DONE: 2})  # finished transcripts are skipped
+
+    def test_provider_without_batches_is_refused_up_front(self):
+        self.provider.supports_batches = False
+        with self.assertRaisesRegex(ValueError, "doesn't support batches"):
+            self.summarizer()
+        self.assertFalse(os.path.exists(self.manifest_path))
+        summarizer = BulkSummarizer("anthropic", BulkManifest(self.manifest_path), use_batches=False,
+                                    summary_cache=SummaryCache(":memory:"), processed_index=ProcessedIndex(":memory:"),
+                                    workers=1, single_pass_tokens=1000, chunk_tokens=1000)
+        self.assertEqual(summarizer.run(find_transcripts([self.archive])), {DONE: 2})
+
 
 class TestTranscriptHandler(unittest.TestCase):
     """
@@ -93,11 +1348,12 @@ class TestTranscriptHandler(unittest.TestCase):
         mo.assert_called_once_with(mock_filename, "w")
         mo().write.assert_called_once_with(mock_summary)
 
-    @patch("openai.ChatCompletion.create")
-    def test_summarize_transcript(self, mock_create):
+    @patch("summarize.OpenAIProvider.client")
+    def test_summarize_transcript(self, mock_client):
+        mock_create = mock_client.chat.completions.create
         mock_create.side_effect = [
-            Mock(choices=[Mock(message={"content": "Summary 1"})]),
-            Mock(choices=[Mock(message={"content": "Summary 2"})])
+            Mock(choices=[Mock(message=Mock(content="Summary 1"))]),
+            Mock(choices=[Mock(message=Mock(content="Summary 2"))])
         ]
         mock_transcript = "Long transcript content..."
         result = summarize_transcript(mock_transcript, "test_transcript.txt")
@@ -109,11 +1365,12 @@ class TestTranscriptHandler(unittest.TestCase):
     @patch("os.path.basename", return_value="test_transcript.txt")
     @patch("os.path.dirname", return_value="Meeting_Name")
     @patch("builtins.print")
-    @patch("openai.ChatCompletion.create")
-    def test_process_file(self, mock_create, mock_print, mock_dirname, mock_basename, mock_expanduser, mock_open):
+    @patch("summarize.OpenAIProvider.client")
+    def test_process_file(self, mock_client, mock_print, mock_dirname, mock_basename, mock_expanduser, mock_open):
+        mock_create = mock_client.chat.completions.create
         mock_create.side_effect = [
-            Mock(choices=[Mock(message={"content": "Detailed Summary"})]),
-            Mock(choices=[Mock(message={"content": "Executive Summary"})])
+            Mock(choices=[Mock(message=Mock(content="Detailed Summary"))]),
+            Mock(choices=[Mock(message=Mock(content="Executive Summary"))])
         ]
         mock_open.return_value.read.return_value = "Transcript content..."
 
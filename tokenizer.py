@@ -1,6 +1,32 @@
-import tiktoken
+import functools
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
+
 import re
 
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+ENCODE_BATCH_SIZE = 256  # sentences handed to tiktoken per encode_batch call
+# Anthropic doesn't publish Claude's tokenizer, and this tiktoken doesn't know newer OpenAI models, so models tiktoken
+# can't map are counted with this encoding.  It is close enough for budgeting and chunking.
+FALLBACK_ENCODING = "cl100k_base"
+COUNT_CACHE_SIZE = 4096  # token counts memoized per encoding
+COUNT_THREADS = 8  # threads tiktoken encodes on when counting many texts at once
+DEFAULT_CHARS_PER_TOKEN = 4.0  # estimator ratio until exact counts have calibrated it
+DEFAULT_ESTIMATE_ERROR = 0.25  # relative error assumed for upper bound estimates until calibrated
+CALIBRATION_MIN_CHARS = 200  # shorter texts are too noisy to calibrate the estimator with
+ERROR_WINDOW = 256  # the estimator's error bound is taken over this many of the latest calibration samples
+ERROR_PERCENTILE = 0.95  # upper bound estimates allow for this percentile of those samples' relative errors
+
+# A chunk of text together with its [start_token, end_token) offsets in the source document
+TextChunk = namedtuple("TextChunk", ["text", "start_token", "end_token"])
+# The estimator's characters per token, and the mean and ERROR_PERCENTILE of its relative error against the latest
+# ERROR_WINDOW exact counts it has been compared with
+Calibration = namedtuple("Calibration", ["samples", "chars_per_token", "mean_error", "error_bound"])
+
 
 def count_words(text_content):
     """
@@ -8,54 +34,282 @@ def count_words(text_content):
     """
     return len(text_content.split())
 
-def chunk_text_by_tokens(text, max_tokens=2048, model_name="gpt-3.5-turbo"):
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name="gpt-3.5-turbo"):
     """
-    Chunks the given text into smaller parts based on token count.
-    Tries to split at sentence boundaries.
+    Returns the tiktoken encoding for a model.  Encoders are expensive to build so one is cached per model name.
+    Models tiktoken doesn't know, such as Claude, use FALLBACK_ENCODING.
+    :param model_name: name of model for encoding
+    :return: tiktoken Encoding
+    """
+    import tiktoken  # imported with the first encoding, to keep startup fast
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        logging.info(f"No tiktoken encoding for {model_name}, counting its tokens with {FALLBACK_ENCODING}")
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+class TokenCounter:
+    """
+    Counts tokens with one encoding.  Exact counts are memoized in a bounded LRU keyed by a digest of each string,
+    so the cache doesn't keep large transcripts alive.  estimate gives a constant time count from the text's length,
+    calibrated against the exact counts made so far, for budgeting decisions that don't need exact counts.
+    Safe to share between threads.
+    """
+
+    def __init__(self, encoding, cache_size=COUNT_CACHE_SIZE):
+        """
+        Args:
+            encoding: The tiktoken Encoding.
+            cache_size: The number of token counts to memoize.
+        """
+        self.encoding = encoding
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._counts = OrderedDict()  # (digest, length) -> tokens, least recently used first
+        self._lock = threading.Lock()
+        self._chars = 0  # characters and tokens of the texts the estimator is calibrated with
+        self._tokens = 0
+        self._samples = 0  # estimates compared with exact counts
+        self._errors = deque(maxlen=ERROR_WINDOW)  # relative errors of the latest estimates
+        self._error_bound = 0.0  # ERROR_PERCENTILE of _errors
+
+    def _lookup(self, key):
+        tokens = self._counts.get(key)
+        if tokens is None:
+            self.misses += 1
+        else:
+            self._counts.move_to_end(key)
+            self.hits += 1
+        return tokens
+
+    def _store(self, key, tokens):
+        self._counts[key] = tokens
+        if len(self._counts) > self.cache_size:
+            self._counts.popitem(last=False)
+        self._calibrate(key[1], tokens)
+
+    def _calibrate(self, chars, tokens):
+        if chars < CALIBRATION_MIN_CHARS or not tokens:
+            return
+        if self._tokens:  # how far off the estimate would have been, before learning from this text
+            self._samples += 1
+            self._errors.append(abs(chars * self._tokens / self._chars - tokens) / tokens)
+            errors = sorted(self._errors)  # a window rather than the largest ever, so early outliers age out
+            self._error_bound = errors[min(len(errors) - 1, int(ERROR_PERCENTILE * len(errors)))]
+        self._chars += chars
+        self._tokens += tokens
+
+    def calibrate(self, chars, tokens):
+        """Calibrates the estimator with the exact token count of chars characters of text counted elsewhere."""
+        with self._lock:
+            self._calibrate(chars, tokens)
+
+    @staticmethod
+    def _key(text):
+        # a digest rather than hash(), whose collisions would return another text's count
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(), len(text)
+
+    def count(self, text):
+        """Returns the exact number of tokens in text."""
+        key = self._key(text)
+        with self._lock:
+            tokens = self._lookup(key)
+        if tokens is None:
+            tokens = len(self.encoding.encode(text, disallowed_special=()))
+            with self._lock:
+                self._store(key, tokens)
+        return tokens
+
+    def count_many(self, texts, num_threads=COUNT_THREADS):
+        """
+        Returns the exact number of tokens in each of texts.  Texts that aren't memoized are encoded in one batch
+        spread over num_threads threads (tiktoken releases the GIL while encoding).
+        """
+        texts = list(texts)
+        counts = [None] * len(texts)
+        missing = {}  # key -> indexes of the texts with that key
+        with self._lock:
+            for index, text in enumerate(texts):
+                key = self._key(text)
+                counts[index] = None if key in missing else self._lookup(key)
+                if counts[index] is None:
+                    missing.setdefault(key, []).append(index)
+        if missing:
+            batch = [texts[indexes[0]] for indexes in missing.values()]
+            encoded = self.encoding.encode_batch(batch, num_threads=num_threads, disallowed_special=())
+            with self._lock:
+                for (key, indexes), tokens in zip(missing.items(), encoded):
+                    self._store(key, len(tokens))
+                    for index in indexes:
+                        counts[index] = len(tokens)
+        return counts
+
+    def estimate(self, text, upper_bound=False):
+        """
+        Estimates the number of tokens in text from its length, without encoding it.
+        Args:
+            text: The text, or its length in characters.
+            upper_bound: Raise the estimate by the ERROR_PERCENTILE relative error of the latest calibration samples,
+                for budgets that must not be undercounted.
+        """
+        chars = text if isinstance(text, int) else len(text)
+        with self._lock:
+            chars_per_token = self._chars / self._tokens if self._tokens else DEFAULT_CHARS_PER_TOKEN
+            error = self._error_bound if self._samples else DEFAULT_ESTIMATE_ERROR
+        tokens = chars / chars_per_token
+        return math.ceil(tokens * (1 + error) if upper_bound else tokens)
+
+    def calibration(self):
+        """Returns the estimator's Calibration."""
+        with self._lock:
+            return Calibration(self._samples, self._chars / self._tokens if self._tokens else DEFAULT_CHARS_PER_TOKEN,
+                               sum(self._errors) / len(self._errors) if self._samples else None,
+                               self._error_bound if self._samples else None)
+
+
+@functools.lru_cache(maxsize=None)
+def _token_counter(encoding_name):
+    import tiktoken
+    return TokenCounter(tiktoken.get_encoding(encoding_name))
+
+
+def get_token_counter(model_name="gpt-3.5-turbo"):
+    """
+    Returns the shared TokenCounter for a model.  Models with the same encoding share a counter, so they share
+    memoized counts and the estimator's calibration.
+    """
+    return _token_counter(get_encoding(model_name).name)
+
+
+def iter_sentences(text):
+    """
+    Lazily splits text into sentences without building the full list of sentences in memory.
+    :param text: The text to split
+    :return: generator of sentences
+    """
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        yield text[start:match.start()]
+        start = match.end()
+    yield text[start:]
+
+
+def _iter_encoded_sentences(text, encoding):
+    """
+    Yields (sentence, tokens) pairs, encoding the sentences in batches so each part of the text is encoded once.
+    """
+    sentences = iter_sentences(text)
+    while True:
+        batch = list(islice(sentences, ENCODE_BATCH_SIZE))
+        if not batch:
+            return
+        yield from zip(batch, encoding.encode_batch(batch, disallowed_special=()))
+
+
+def iter_chunks_by_tokens(text, max_tokens=2048, model_name="gpt-3.5-turbo", overlap_tokens=0):
+    """
+    Lazily chunks the given text into parts of at most max_tokens tokens.
+    Tries to split at sentence boundaries.  A sentence longer than max_tokens is hard split on token boundaries.
 
     :param text: The text to be chunked
     :param max_tokens: The maximum token count for each chunk
     :param model_name: The name of the model for which the encoding is to be used
-    :return: A list of text chunks
+    :param overlap_tokens: Up to this many tokens of trailing sentences are repeated at the start of the next chunk
+    :return: generator of TextChunk tuples with the chunk text and its token offsets in the document
     """
-    # Get the encoding for the specified model
-    encoding = tiktoken.encoding_for_model(model_name)
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("overlap_tokens must be between 0 and max_tokens")
 
-    # Simple split of text into sentences
-    sentences = re.split(r'(?<=[.!?])\s+', text)
+    encoding = get_encoding(model_name)
 
-    chunks = []
-    current_chunk = []
-    current_token_count = 0
+    def pieces():
+        for sentence, tokens in _iter_encoded_sentences(text, encoding):
+            if len(tokens) <= max_tokens:
+                yield sentence, len(tokens)
+            else:  # hard split oversized sentences so no chunk exceeds max_tokens
+                for i in range(0, len(tokens), max_tokens):
+                    yield encoding.decode(tokens[i:i + max_tokens]), len(tokens[i:i + max_tokens])
 
-    for sentence in sentences:
-        sentence_token_count = len(encoding.encode(sentence))
+    for window, start_token, end_token in iter_token_windows(pieces(), max_tokens, overlap_tokens):
+        yield TextChunk(' '.join(window).strip(), start_token, end_token)
+
+
+def iter_token_windows(pieces, max_tokens, overlap_tokens=0, split_before=None):
+    """
+    Lazily groups consecutive pieces into windows of at most max_tokens tokens.
+    Pieces are never split, so each piece must fit in max_tokens by itself.
+
+    :param pieces: iterable of (piece, token_count) pairs
+    :param max_tokens: The maximum token count for each window
+    :param overlap_tokens: Up to this many tokens of trailing pieces are repeated at the start of the next window
+    :param split_before: Optional function (first_piece, piece) returning True to end the window before piece, where
+        first_piece is the first piece that is new in the window
+    :return: generator of (pieces, start_token, end_token) tuples with the token offsets of each window
+    """
+    window = deque()  # (piece, start_token, token_count) for the window being built
+    window_tokens = 0
+    offset = 0  # token offset of the next piece
+    first = None  # first piece of the window that wasn't carried over as overlap
+
+    for piece, piece_tokens in pieces:
+        # If adding the next piece exceeds the max token count, emit the current window
+        if window and (window_tokens + piece_tokens > max_tokens
+                       or split_before is not None and split_before(first, piece)):
+            yield [p for p, _, _ in window], window[0][1], offset
+            # keep trailing pieces as overlap, as long as the next piece still fits
+            while window and (window_tokens > overlap_tokens or window_tokens + piece_tokens > max_tokens):
+                window_tokens -= window.popleft()[2]
+            first = None
+        window.append((piece, offset, piece_tokens))
+        window_tokens += piece_tokens
+        offset += piece_tokens
+        if first is None:
+            first = piece
+
+    # Emit any remaining pieces in the current window
+    if window:
+        yield [p for p, _, _ in window], window[0][1], offset
 
-        # If adding the next sentence doesn't exceed the max token count, add it
-        if current_token_count + sentence_token_count <= max_tokens:
-            current_chunk.append(sentence)
-            current_token_count += sentence_token_count
-        # Otherwise, store the current chunk and start a new one
-        else:
-            chunks.append(' '.join(current_chunk).strip())
-            current_chunk = [sentence]
-            current_token_count = sentence_token_count
 
-    # Append any remaining text in the current chunk
-    if current_chunk:
-        chunks.append(' '.join(current_chunk).strip())
+def chunk_text_by_tokens(text, max_tokens=2048, model_name="gpt-3.5-turbo", overlap_tokens=0):
+    """
+    Chunks the given text into smaller parts based on token count.
+    Tries to split at sentence boundaries.
+
+    :param text: The text to be chunked
+    :param max_tokens: The maximum token count for each chunk
+    :param model_name: The name of the model for which the encoding is to be used
+    :param overlap_tokens: Up to this many tokens of trailing sentences are repeated at the start of the next chunk
+    :return: A list of text chunks
+    """
+    return [chunk.text for chunk in iter_chunks_by_tokens(text, max_tokens, model_name, overlap_tokens)]
 
-    return chunks
 
 def count_tokens(text_string, model_name="gpt-3.5-turbo"):
     """
-    Counts the number of tokens in a string
+    Counts the number of tokens in a string.  Counts of repeated strings are memoized.
     :param text_string: input string
     :param model_name: name of model for encoding
     :return: number of tokens
     """
-    encoding = tiktoken.encoding_for_model(model_name)
-    return len(encoding.encode(text_string))
+    return get_token_counter(model_name).count(text_string)
+
+
+def estimate_tokens(text_string, model_name="gpt-3.5-turbo", upper_bound=False):
+    """
+    Estimates the number of tokens in a string from its length, calibrated against exact counts made so far.
+    :param text_string: input string
+    :param model_name: name of model for encoding
+    :param upper_bound: raise the estimate by the ERROR_PERCENTILE relative error of the last ERROR_WINDOW samples
+    :return: estimated number of tokens
+    """
+    return get_token_counter(model_name).estimate(text_string, upper_bound)
 
 if __name__ == '__main__':
     # read sample meeting transcript into string
@@ -64,10 +318,7 @@ if __name__ == '__main__':
 
     # assume model is gpt 3.5
     model_name = "gpt-3.5-turbo"
-    encoding = tiktoken.encoding_for_model(model_name)
-
-    chunks = chunk_text_by_tokens(sample_text, max_tokens=200)
-    for idx, chunk in enumerate(chunks):
 
-        tokens_for_chunk = len(encoding.encode(chunk)) # get tokens in chunk
-        print(f"Chunk {idx + 1}, length {len(chunk)}, tokens {tokens_for_chunk}:\n{chunk}\n{'-' * 20}")
+    for idx, chunk in enumerate(iter_chunks_by_tokens(sample_text, max_tokens=200)):
+        tokens_for_chunk = chunk.end_token - chunk.start_token  # get tokens in chunk
+        print(f"Chunk {idx + 1}, length {len(chunk.text)}, tokens {tokens_for_chunk}:\n{chunk.text}\n{'-' * 20}")
@@ -0,0 +1,236 @@
+"""
+Streaming parser for Zoom transcripts.
+
+Zoom saves closed captions as WebVTT (.vtt) or SubRip (.srt) cues, and meeting transcripts as text (.txt) where each
+turn starts with a "[Speaker] hh:mm:ss" line.  Files are read line by line into a Transcript of compact SpeakerTurn
+records (speaker id, start and end time, text), so large transcripts never have to be held as one string, and the
+chunker can split on speaker turns and time boundaries instead of re-scanning raw text for sentence ends.
+Lines that don't match any of these formats are kept as turns without a speaker or time.
+"""
+
+import re
+from array import array
+from collections import namedtuple
+from itertools import islice
+
+from tokenizer import ENCODE_BATCH_SIZE, get_token_counter, iter_chunks_by_tokens, iter_token_windows
+
+_TIME = r'(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})'
+CUE_TIMING = re.compile(rf'^{_TIME}\s+-->\s+{_TIME}')  # "00:01:02.500 --> 00:01:04.000" (VTT) or "...,500" (SRT)
+ZOOM_TURN_HEADER = re.compile(r'^\[(.+)\] (\d+):(\d{2}):(\d{2})$')  # "[Smith, John] 15:01:00"
+SPEAKER_PREFIX = re.compile(r'^([^:]{1,100}?): (.*)$')  # "Smith, John: text" at the start of a caption cue
+VTT_BLOCKS = ("NOTE", "STYLE", "REGION")  # WebVTT blocks that carry no captions
+
+# A chunk of rendered turns with its [start_token, end_token) offsets and the time span it covers
+TurnChunk = namedtuple("TurnChunk", ["text", "start_token", "end_token", "start_time", "end_time"])
+
+
+class SpeakerTurn:
+    """
+    One caption cue or transcript turn.  speaker is an id into Transcript.speakers (None if unknown), start and end
+    are seconds from the start of the meeting (None if unknown).
+    """
+    __slots__ = ("speaker", "start", "end", "text")
+
+    def __init__(self, speaker, start, end, text):
+        self.speaker = speaker
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def __repr__(self):
+        return f"SpeakerTurn({self.speaker!r}, {self.start!r}, {self.end!r}, {self.text!r})"
+
+
+def _seconds(hours, minutes, seconds, fraction=None):
+    total = int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+    return total + int(fraction) / 10 ** len(fraction) if fraction else float(total)
+
+
+def format_timestamp(seconds):
+    """Formats seconds as hh:mm:ss."""
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d}"
+
+
+def iter_turns(lines, speaker_ids):
+    """
+    Lazily parses transcript lines into SpeakerTurns.
+    :param lines: iterable of lines, e.g. an open file
+    :param speaker_ids: dict of speaker name to id.  New speakers are added with the next free id.
+    :return: generator of SpeakerTurn
+    """
+    def turn():
+        speaker_id = None if speaker is None else speaker_ids.setdefault(speaker, len(speaker_ids))
+        return SpeakerTurn(speaker_id, start, end, " ".join(text))
+
+    in_turn = False  # inside a caption cue or a Zoom text turn
+    speaker = start = end = None
+    text = []
+    pending = None  # a line outside any turn: either a cue identifier or a line of plain text
+    skipping = False  # inside the WEBVTT header or a NOTE/STYLE/REGION block
+    is_vtt = False
+
+    for number, line in enumerate(lines):
+        line = line.strip()
+        if number == 0:
+            line = line.lstrip("\ufeff")
+            is_vtt = skipping = line.startswith("WEBVTT")
+        if skipping:
+            skipping = bool(line)
+            continue
+
+        timing = CUE_TIMING.match(line)
+        header = None if timing else ZOOM_TURN_HEADER.match(line)
+        if timing or header or not line:
+            if text:
+                yield turn()
+                text = []
+            if pending is not None and not timing:  # the line before a cue timing is the cue's identifier
+                yield SpeakerTurn(None, None, None, pending)
+            pending = None
+            in_turn = bool(timing or header)
+            if timing:
+                speaker = None
+                start, end = _seconds(*timing.groups()[:4]), _seconds(*timing.groups()[4:])
+            elif header:
+                speaker = header.group(1)
+                start, end = _seconds(*header.groups()[1:]), None
+            continue
+
+        if in_turn:
+            if not text and speaker is None:
+                prefix = SPEAKER_PREFIX.match(line)
+                if prefix:
+                    speaker, line = prefix.groups()
+            text.append(line)
+        elif is_vtt and line.split(" ", 1)[0] in VTT_BLOCKS:
+            skipping = True
+        else:
+            if pending is not None:
+                yield SpeakerTurn(None, None, None, pending)
+            pending = line
+
+    if text:
+        yield turn()
+    if pending is not None:
+        yield SpeakerTurn(None, None, None, pending)
+
+
+class Transcript:
+    """
+    The speaker turns of one meeting.
+    """
+
+    def __init__(self, turns=(), speaker_ids=None, timestamps=True, header=None):
+        """
+        Args:
+            turns: The SpeakerTurns of the meeting.
+            speaker_ids: Dict of speaker name to the id used in the turns.
+            timestamps: Include each turn's start time when rendering it.
+            header: Text sent ahead of the turns, and ahead of every chunk of them (e.g. a legend of speakers).
+        """
+        self.turns = list(turns)  # consumed first, so a parser has added every speaker to speaker_ids
+        self.speaker_ids = speaker_ids if speaker_ids is not None else {}
+        self.speakers = list(self.speaker_ids)  # speaker names, indexed by speaker id
+        self.timestamps = timestamps
+        self.header = header
+        self._turn_tokens = {}  # model name -> array of token counts per rendered turn
+
+    @classmethod
+    def parse(cls, lines):
+        """Parses an iterable of transcript lines."""
+        speaker_ids = {}
+        return cls(iter_turns(lines, speaker_ids), speaker_ids)
+
+    @classmethod
+    def from_file(cls, path):
+        """Parses a .vtt, .srt or Zoom .txt transcript file, reading it one line at a time."""
+        with open(path, 'r', encoding='utf-8-sig') as file:
+            return cls.parse(file)
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __iter__(self):
+        return iter(self.turns)
+
+    def render(self, turn):
+        """Renders a turn as one line of text for the model: "[hh:mm:ss] Speaker: text"."""
+        line = turn.text
+        if turn.speaker is not None:
+            line = f"{self.speakers[turn.speaker]}: {line}"
+        if self.timestamps and turn.start is not None:
+            line = f"[{format_timestamp(turn.start)}] {line}"
+        return line
+
+    def text(self):
+        """Returns the transcript as text with the header and one rendered turn per line."""
+        lines = (self.render(turn) for turn in self.turns)
+        return "\n".join([self.header, *lines] if self.header else lines)
+
+    def turn_tokens(self, model_name="gpt-3.5-turbo"):
+        """
+        Returns an array of the token count of each rendered turn.  Turns are encoded once per model, in batches,
+        and the totals calibrate the model's token estimator.
+        """
+        counts = self._turn_tokens.get(model_name)
+        if counts is None:
+            counter = get_token_counter(model_name)
+            counts = array('I')
+            chars = 0
+            lines = (self.render(turn) for turn in self.turns)
+            while batch := list(islice(lines, ENCODE_BATCH_SIZE)):
+                counts.extend(len(tokens) for tokens in counter.encoding.encode_batch(batch, disallowed_special=()))
+                chars += sum(map(len, batch))
+            counter.calibrate(chars, sum(counts))
+            self._turn_tokens[model_name] = counts
+        return counts
+
+    def header_tokens(self, model_name="gpt-3.5-turbo"):
+        """Returns the number of tokens in the header."""
+        return get_token_counter(model_name).count(self.header) if self.header else 0
+
+    def token_count(self, model_name="gpt-3.5-turbo"):
+        """Returns the number of tokens in the transcript's header and turns."""
+        return self.header_tokens(model_name) + sum(self.turn_tokens(model_name))
+
+
+def iter_turn_chunks(transcript, max_tokens=2048, model_name="gpt-3.5-turbo", overlap_tokens=0, max_seconds=None):
+    """
+    Lazily chunks a transcript into runs of whole speaker turns of at most max_tokens tokens, each starting with the
+    transcript's header.  A turn too long for a chunk is split at sentence boundaries like iter_chunks_by_tokens.
+
+    :param transcript: The Transcript to chunk
+    :param max_tokens: The maximum token count for each chunk
+    :param model_name: The name of the model for which the encoding is to be used
+    :param overlap_tokens: Up to this many tokens of trailing turns are repeated at the start of the next chunk
+    :param max_seconds: If set, a chunk also ends before a turn starting more than this many seconds after its first
+    :return: generator of TurnChunk tuples, with token offsets counted over the turns only
+    """
+    max_tokens -= transcript.header_tokens(model_name)  # room left for turns in each chunk
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive and leave room after the header")
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("overlap_tokens must be between 0 and max_tokens")
+
+    def pieces():
+        for turn, turn_tokens in zip(transcript.turns, transcript.turn_tokens(model_name)):
+            if turn_tokens <= max_tokens:
+                yield (transcript.render(turn), turn), turn_tokens
+            else:
+                for chunk in iter_chunks_by_tokens(transcript.render(turn), max_tokens, model_name):
+                    yield (chunk.text, turn), chunk.end_token - chunk.start_token
+
+    def split_before(first, piece):
+        first_start, start = first[1].start, piece[1].start
+        return first_start is not None and start is not None and start - first_start > max_seconds
+
+    windows = iter_token_windows(pieces(), max_tokens, overlap_tokens,
+                                 split_before=split_before if max_seconds is not None else None)
+    for window, start_token, end_token in windows:
+        starts = [turn.start for _, turn in window if turn.start is not None]
+        ends = [turn.end if turn.end is not None else turn.start for _, turn in window if turn.start is not None]
+        lines = [text for text, _ in window]
+        yield TurnChunk("\n".join([transcript.header, *lines] if transcript.header else lines), start_token, end_token,
+                        min(starts, default=None), max(ends, default=None))
@@ -0,0 +1,116 @@
+"""
+Token-reduction preprocessing for parsed transcripts.
+
+Zoom transcripts spend many tokens on things the summary doesn't need: a timestamp on every cue, the speaker's full
+name repeated on every cue of a long turn, filler words ("um", "you know") and back-channel turns ("Yeah.", "Mm-hmm.").
+preprocess_transcript removes them before the transcript is sent to the model and logs the tokens saved.
+Each step can be switched off with the constants below.
+"""
+
+import logging
+import re
+
+from metrics import count
+from transcript_parser import SpeakerTurn, Transcript
+
+STRIP_TIMESTAMPS = True  # drop the [hh:mm:ss] start time of each turn
+MERGE_SPEAKER_TURNS = True  # join consecutive turns by the same speaker into one
+REMOVE_FILLERS = True  # drop filler words such as "um" and ", you know,"
+REMOVE_BACKCHANNELS = True  # drop turns that are only an acknowledgement such as "Yeah." or "Mm-hmm."
+ALIAS_SPEAKERS = False  # replace speaker names with S1, S2, ... and put a legend at the top of the transcript
+
+# removed when lowercase, or capitalized at the start of a sentence, so acronyms such as "ER" are kept
+FILLER_WORDS = ("um", "umm", "uh", "uhh", "er", "erm", "ah", "hmm", "mm")
+# phrases that are only fillers when set off by commas ("So, you know, the budget" but not "do you know the budget")
+SET_OFF_FILLERS = ("you know", "I mean", "like", "sort of", "kind of")
+# a turn made only of these phrases is a back-channel ("Yeah.", "Okay, got it.", "Mm-hmm, thanks."), unless it is
+# a question ("Right?")
+BACKCHANNEL_PHRASES = ("yeah", "yep", "yup", "right", "mm-hmm", "mhm", "uh-huh", "okay", "ok", "sure", "got it",
+                       "thanks", "thank you", "cool", "great", "mm", "hmm", "uh", "um")
+
+# a filler is a whole word: not part of a hyphenated word such as "uh-huh"
+_FILLER_WORD = re.compile(rf"(?:(?<![\w-])(?:{'|'.join(FILLER_WORDS)})"
+                          rf"|(?P<sentence_start>(?:^|(?<=[.?!]\s))(?:{'|'.join(map(str.capitalize, FILLER_WORDS))})))"
+                          rf"(?![\w-]),?\s*")
+_SENTENCE_START = "\0"  # marks where a filler starting the turn or a sentence was removed
+_SET_OFF_FILLER = re.compile(rf"(?:^{_SENTENCE_START}?|(,))\s*(?:{'|'.join(SET_OFF_FILLERS)})\s*,\s*", re.IGNORECASE)
+_SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,.?!])")
+_DOUBLE_PUNCTUATION = re.compile(r",\s*([,.?!])")
+_BACKCHANNEL = re.compile(rf"(?:(?:{'|'.join(map(re.escape, sorted(BACKCHANNEL_PHRASES, key=len, reverse=True)))})"
+                          rf"(?![\w-])[\s,.!]*)+", re.IGNORECASE)
+
+
+def remove_fillers(text):
+    """
+    Removes filler words from a turn, e.g. "Um, so, you know, the budget" becomes "So, the budget".  The word after
+    a filler that started the turn or a sentence is capitalized; other text keeps its case, e.g. "iPhone".
+    """
+    text = _FILLER_WORD.sub(
+        lambda match: _SENTENCE_START if match.group("sentence_start") or match.start() == 0 else "", text)
+    text = _SET_OFF_FILLER.sub(lambda match: ", " if match.group(1) else _SENTENCE_START, text)
+    text = re.sub(f"{_SENTENCE_START}+(\\w*)",  # "eBay" keeps its case
+                  lambda match: match.group(1).capitalize() if match.group(1).islower() else match.group(1), text)
+    text = _DOUBLE_PUNCTUATION.sub(r"\1", _SPACE_BEFORE_PUNCTUATION.sub(r"\1", text)).strip(" ,")
+    if not re.search(r"\w", text):  # the turn was only fillers
+        return ""
+    return text
+
+
+def is_backchannel(text):
+    """
+    Returns True if a turn is only an acknowledgement such as "Yeah." or "Got it, thanks", but not for a question
+    such as "Right, you got it?".
+    """
+    return _BACKCHANNEL.fullmatch(text.strip()) is not None
+
+
+def speaker_legend(speakers, aliases):
+    """Returns the legend line mapping speaker aliases to names."""
+    return "Speakers: " + "; ".join(f"{alias} = {name}" for alias, name in zip(aliases, speakers))
+
+
+def preprocess_transcript(transcript, strip_timestamps=STRIP_TIMESTAMPS, merge_turns=MERGE_SPEAKER_TURNS,
+                          fillers=REMOVE_FILLERS, backchannels=REMOVE_BACKCHANNELS, alias_speakers=ALIAS_SPEAKERS):
+    """
+    Returns a smaller copy of a transcript for summarization.  The tokens before and after are logged and the
+    difference is counted against the current job as preprocessing_tokens_saved.
+    Args:
+        transcript (Transcript): The parsed transcript.
+        strip_timestamps (bool): Drop the start time of each turn.
+        merge_turns (bool): Join consecutive turns by the same speaker, including across dropped back-channel turns.
+        fillers (bool): Remove filler words.
+        backchannels (bool): Remove turns that are only an acknowledgement.
+        alias_speakers (bool): Replace speaker names with short aliases explained in a legend.
+    Returns:
+        Transcript: The preprocessed transcript.
+    """
+    turns = []
+    for turn in transcript:
+        if backchannels and turn.speaker is not None and is_backchannel(turn.text):
+            continue
+        text = remove_fillers(turn.text) if fillers else turn.text
+        if not text:
+            continue
+        previous = turns[-1] if turns else None
+        if merge_turns and previous is not None and turn.speaker is not None and previous.speaker == turn.speaker:
+            previous.text = f"{previous.text} {text}"
+            previous.end = turn.end if turn.end is not None else previous.end
+        else:
+            turns.append(SpeakerTurn(turn.speaker, turn.start, turn.end, text))
+
+    speaker_ids = dict(transcript.speaker_ids)
+    header = transcript.header
+    if alias_speakers and speaker_ids:
+        aliases = [f"S{speaker_id + 1}" for speaker_id in range(len(speaker_ids))]
+        legend = speaker_legend(transcript.speakers, aliases)
+        header = f"{header}\n{legend}" if header else legend
+        speaker_ids = {alias: speaker_id for speaker_id, alias in enumerate(aliases)}
+
+    result = Transcript(turns, speaker_ids, timestamps=transcript.timestamps and not strip_timestamps, header=header)
+    # counted per turn, so the counts are reused when the result is checked against the model's budget and chunked
+    tokens_before, tokens_after = transcript.token_count(), result.token_count()
+    saved = tokens_before - tokens_after
+    logging.info(f"Preprocessing reduced the transcript from {tokens_before} to {tokens_after} tokens "
+                 f"({saved / max(tokens_before, 1):.0%} smaller)")
+    count("preprocessing_tokens_saved", saved)
+    return result
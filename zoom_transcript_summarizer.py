@@ -1,10 +1,17 @@
 """
-This script monitors ZOOM_TRANSCRIPT_PATH for new zoom transcripts.  When a transcript is found, the text is
-divided into chunks of length MAX_TOKENS and sent to Open AI for summarization.
+This script monitors ZOOM_TRANSCRIPT_PATH for new zoom transcripts.  When a transcript is found, it is sent to
+the SUMMARY_PROVIDER (Claude, Open AI, or a router across both, see router.py) for summarization.  Transcripts are
+parsed into speaker turns and stripped of timestamps, filler words and back-channel turns first (see
+transcript_preprocessor.py).  Transcripts longer than the model's MAX_TOKENS are divided into chunks that are
+summarized in parallel and then combined (see map_reduce_summarizer.py).
+With MULTI_VIEW_SUMMARIES the summary is made of several views of the meeting (executive summary, action items,
+decisions and follow-ups per person) requested against one cached transcript prompt (see multi_view_summarizer.py).
 The model used is determined by MODEL_NAME. When summarizing, the prompt used for the chatbot's role is defined in
 DETAILED_SUMMARY_ROLE.
 
-The results of the summary are saved into a directory in SAVE_TO_PATH.
+The results of the summary are saved into a directory in SAVE_TO_PATH and to the SUMMARY_SINK (Google Docs).
+Providers and sinks are plugins (see plugins.py) imported on first use, so only the SDKs of the configured ones are
+loaded.
 
 OPENAI_API_KEY environment variable should contain your API key.
 
@@ -19,13 +26,22 @@ import time
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from save_summary import save_google_doc, format_and_save_summary
-from summarize import summarize_transcript
-from claude_summarizer import summarize_transcript_with_claude
+from save_summary import format_and_save_summary, stream_and_save_summary, summary_title
+from map_reduce_summarizer import summarize_long_transcript
+from multi_view_summarizer import format_views, summarize_views, views_prompt
+from summary_cache import SummaryCache, summary_cache_key
+from job_queue import TranscriptJobQueue
+from plugins import SINKS, load
+from metrics import configure_metrics, count, stage, track_job, METRICS_LOG_PATH, METRICS_PORT, PROFILE_DIRECTORY, \
+    PROFILE_JOBS
+from processed_index import ProcessedIndex, DONE, FAILED, PENDING, TRANSCRIPT_SUFFIXES
+from providers import get_provider
+from rolling_summarizer import RollingSummaryStore, is_finished, merge_delta, read_tail, FINALIZE_SECONDS, \
+    MIN_DELTA_TOKENS, UPDATE_SECONDS
+from transcript_parser import Transcript
+from transcript_preprocessor import preprocess_transcript
 
-from googleapiclient.discovery import build
 import os
-from google_auth import get_google_credentials
 
 # USER CONFIGURATION
 ZOOM_TRANSCRIPT_PATH = "~/Documents/Zoom"  # this is directory where Zoom saves meeting transcriptions
@@ -34,7 +50,18 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
-USE_CLAUDE=True # flag to selet if we use claude or openai
+# provider plugin: "anthropic" (Claude), "openai", or "router" to route between both and hedge slow requests
+SUMMARY_PROVIDER = os.environ.get("SUMMARY_PROVIDER", "anthropic")
+SUMMARY_SINK = "google_docs"  # sink plugin summaries are also saved to, None to only save them locally
+STREAM_SUMMARIES=True  # write summaries locally and to Google Docs as they are generated
+ROLLING_SUMMARIES = False  # summarize transcripts incrementally while Zoom is still writing them
+MULTI_VIEW_SUMMARIES = False  # save action items, decisions and per-person follow-ups along with the summary
+
+
+def is_transcript(path):
+    """Returns True for transcript files; Zoom also saves the recording (.m4a, .mp4) and chat in the same folder."""
+    return path.lower().endswith(TRANSCRIPT_SUFFIXES)
+
 
 class TranscriptHandler(FileSystemEventHandler):
     """
@@ -43,10 +70,34 @@ class TranscriptHandler(FileSystemEventHandler):
     focusing on essential points, decisions, action items, and key takeaways.
     """
 
-    def __init__(self):
+    def __init__(self, docs_writer=None, summary_cache=None, processed_index=None, rolling_summaries=None, jobs=None,
+                 tenant=None):
+        """
+        Args:
+            docs_writer: DocsWriter for Google Docs output.  Defaults to the tenant's or the SUMMARY_SINK plugin.
+            summary_cache: SummaryCache to use.  Defaults to the cache in the summarizer's state directory.
+            processed_index: ProcessedIndex to use.  Defaults to the index in the summarizer's state directory.
+            rolling_summaries: RollingSummaryStore to use when ROLLING_SUMMARIES is set.  Defaults to the store in the
+                summarizer's state directory.
+            jobs: Started TranscriptJobQueue running this handler's process_file, e.g. one shared by the tenants of
+                tenant_daemon.py.  Defaults to a queue of the handler's own.
+            tenant: tenants.Tenant whose save path, sink and provider quota are used.  Defaults to the settings in
+                this module.
+        """
         super().__init__()  # Initialize the superclass
-        creds = get_google_credentials()  # Use the refactored function to get credentials
-        self.service = build('docs', 'v1', credentials=creds)
+        self.tenant = tenant
+        self.save_to_path = tenant.save_to_path if tenant else None
+        sink, sink_options = (tenant.sink, tenant.sink_options) if tenant else (SUMMARY_SINK, {})
+        if docs_writer is None and sink:
+            docs_writer = load(SINKS, sink)(**sink_options)  # Google Docs are written in the background
+        self.docs_writer = docs_writer
+        self.service = getattr(docs_writer, "service", None)
+        self.summary_cache = summary_cache or SummaryCache()
+        self.processed_index = processed_index or ProcessedIndex()
+        self.rolling_summaries = rolling_summaries or (RollingSummaryStore() if ROLLING_SUMMARIES else None)
+        # transcripts are processed on worker threads; growing transcripts are read at least every UPDATE_SECONDS
+        self.jobs = jobs or TranscriptJobQueue(
+            self.process_file, max_debounce_seconds=UPDATE_SECONDS if ROLLING_SUMMARIES else None).start()
 
     def on_created(self, event):
         """
@@ -56,9 +107,20 @@ class TranscriptHandler(FileSystemEventHandler):
         """
         logging.info(f"File System Event Detected: {event}")
 
-        if not event.is_directory:
+        if not event.is_directory and is_transcript(event.src_path):
             transcript_file = event.src_path
-            self.process_file(transcript_file)
+            self.jobs.submit(transcript_file)
+
+    def on_modified(self, event):
+        """
+        Method called by watchdog when a file is modified.  Zoom may still be writing the transcript, so this
+        restarts the file's debounce window rather than processing it immediately.  With ROLLING_SUMMARIES the
+        appended part is summarized at least every UPDATE_SECONDS while the file keeps growing.
+        Args:
+            event: The file system event object containing information about the modified file.
+        """
+        if not event.is_directory and is_transcript(event.src_path):
+            self.jobs.submit(event.src_path)
 
     def process_file(self, transcript_file):
         """
@@ -67,16 +129,124 @@ class TranscriptHandler(FileSystemEventHandler):
             transcript_file: The path to the transcript file to be processed.
         """
         logging.info(f"New transcript found: {transcript_file}")
-        transcript_content = self.read_transcript(transcript_file)
-        full_summary = summarize_transcript_with_claude(transcript_content) if USE_CLAUDE else summarize_transcript(transcript_content)
-        format_and_save_summary(full_summary, transcript_file)
+        with track_job(transcript_file):  # per-stage timings and token counts for this transcript
+            try:
+                if ROLLING_SUMMARIES:
+                    finished = self.update_rolling_summary(transcript_file)
+                else:
+                    self.summarize_and_save(transcript_file)
+                    finished = True
+            except Exception:
+                self.processed_index.mark(transcript_file, FAILED)  # retried by the next startup backfill
+                raise
+            self.processed_index.mark(transcript_file, DONE if finished else PENDING)
+
+    def update_rolling_summary(self, transcript_file):
+        """
+        Reads the part of the transcript appended since the last update and merges it into the rolling summary once
+        it has MIN_DELTA_TOKENS tokens.  When the file hasn't changed for FINALIZE_SECONDS the rest is merged and the
+        rolling summary is saved as the final summary.
+        Args:
+            transcript_file: The path to the transcript file to be processed.
+        Returns:
+            bool: True if the transcript is finished and its summary saved.
+        """
+        offset, summary = self.rolling_summaries.get(transcript_file)
+        if os.path.getsize(transcript_file) < offset:  # the file was replaced, start over
+            offset, summary = 0, None
+        finished = is_finished(transcript_file)
+        with stage("file_read"):
+            tail, end = read_tail(transcript_file, offset, complete_only=not finished)
+        with stage("preprocess"):
+            delta = preprocess_transcript(Transcript.parse(tail.splitlines()))
+        with stage("tokenization"):
+            merge = bool(delta.turns) and (finished or delta.token_count() >= MIN_DELTA_TOKENS)
+        if merge:
+            summary = merge_delta(summary, delta, self.summarize_fn(), self.single_pass_tokens())
+        if merge or not delta.turns:  # tails without any turns (e.g. the VTT header) are skipped
+            self.rolling_summaries.put(transcript_file, end, summary)
+        if not finished:
+            self.jobs.submit(transcript_file, delay=FINALIZE_SECONDS)  # finish it if Zoom stops writing
+            return False
+        if summary:
+            format_and_save_summary(summary, transcript_file, self.save_to_path)
+            self.format_and_save_to_google_docs(summary, transcript_file)
+        return True
+
+    def summarize_and_save(self, transcript_file):
+        """
+        Summarizes the transcript, or fetches its summary from the cache, and saves it locally and to Google Docs.
+        Args:
+            transcript_file: The path to the transcript file to be processed.
+        """
+        with stage("file_read"):
+            transcript = self.parse_transcript(transcript_file)
+        with stage("preprocess"):  # timestamps, fillers and back-channel turns cost input tokens but add nothing
+            transcript = preprocess_transcript(transcript)
+        transcript_content = transcript.text()
+        multi_view = MULTI_VIEW_SUMMARIES and self.fits_single_pass(transcript)
+        provider = self.provider()
+        prompt = views_prompt() if multi_view else provider.summary_role
+        cache_key = summary_cache_key(transcript_content, provider.name, provider.model, prompt)
+        full_summary = self.summary_cache.get(cache_key)  # duplicate transcripts are served from the cache
+        count("cache_misses" if full_summary is None else "cache_hits")
+        if full_summary is None and multi_view:
+            full_summary = format_views(summarize_views(transcript_content, provider).summaries)
+            self.summary_cache.put(cache_key, full_summary)
+        if full_summary is None and STREAM_SUMMARIES and self.fits_single_pass(transcript):
+            # readers see the summary start as soon as the model produces its first tokens
+            full_summary, _ = stream_and_save_summary(provider.stream_summary(transcript_content), transcript_file,
+                                                      docs_writer=self.docs_writer, save_to_path=self.save_to_path)
+            self.summary_cache.put(cache_key, full_summary)
+            return
+        if full_summary is None:
+            full_summary = self.summarize(transcript)
+            self.summary_cache.put(cache_key, full_summary)
+        format_and_save_summary(full_summary, transcript_file, self.save_to_path)
         self.format_and_save_to_google_docs(full_summary,transcript_file)
 
+    def provider(self):
+        """Returns the tenant's provider or the SUMMARY_PROVIDER, importing its plugin on first use."""
+        return self.tenant.provider() if self.tenant else get_provider(SUMMARY_PROVIDER)
+
+    def single_pass_tokens(self):
+        """Returns the largest transcript, in tokens, that the configured backend summarizes in one request."""
+        return self.provider().max_input_tokens
+
+    def fits_single_pass(self, transcript):
+        """Returns True if the configured backend can summarize the Transcript in one request."""
+        with stage("tokenization"):
+            return transcript.token_count() <= self.single_pass_tokens()
+
+    def summarize(self, transcript_content):
+        """
+        Summarizes the transcript with the configured backend, using map-reduce for long transcripts.
+        Args:
+            transcript_content: The transcript to summarize, as text or a Transcript.
+        Returns:
+            str: The summary of the transcript.
+        """
+        return summarize_long_transcript(transcript_content, self.summarize_fn(),
+                                         single_pass_tokens=self.single_pass_tokens())
+
+    def summarize_fn(self):
+        """Returns the summarize function of the configured backend."""
+        return self.provider().summarize
+
     def format_and_save_to_google_docs(self, summary, transcript_file):
-        """Formats the summary and saves it to a Google Doc."""
-        service = self.service
-        if service:
-            save_google_doc(service, summary, transcript_file)
+        """Queues the summary to be saved to a Google Doc by the background Docs writer."""
+        if self.docs_writer:
+            self.docs_writer.submit(summary_title(transcript_file), summary)
+
+    def parse_transcript(self, transcript_file):
+        """
+        Parses a .vtt, .srt or Zoom .txt transcript file into speaker turns, reading it one line at a time.
+        Args:
+            transcript_file: The path to the transcript file to be parsed.
+        Returns:
+            Transcript: The turns of the transcript.
+        """
+        return Transcript.from_file(transcript_file)
 
     def read_transcript(self, transcript_file):
         """
@@ -93,11 +263,16 @@ class TranscriptHandler(FileSystemEventHandler):
 if __name__ == "__main__":
 
     zoom_directory = os.path.expanduser("%s" % ZOOM_TRANSCRIPT_PATH)  # Replace with your actual Zoom directory path
+    configure_metrics(METRICS_PORT, METRICS_LOG_PATH, PROFILE_DIRECTORY if PROFILE_JOBS else None)
     event_handler = TranscriptHandler()
     observer = Observer()
     observer.schedule(event_handler, path=zoom_directory, recursive=True)
     observer.start()
 
+    # catch up on transcripts that arrived while the summarizer wasn't running
+    for transcript_file in event_handler.processed_index.scan(zoom_directory):
+        event_handler.jobs.submit(transcript_file, delay=0)
+
     try:
         print("Zoom transcript summarizer is running...")
         print(f"monitoring path {zoom_directory}")
@@ -107,3 +282,7 @@ if __name__ == "__main__":
         observer.stop()
 
     observer.join()
+    print("Finishing queued transcripts...")
+    event_handler.jobs.shutdown()
+    if event_handler.docs_writer:
+        event_handler.docs_writer.close()